@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from instrumentation import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+DB_CONCURRENCY = int(os.getenv("DB_CONCURRENCY", 8))           # Concurrent operations per database identity
+DB_QUEUE_SIZE = int(os.getenv("DB_QUEUE_SIZE", 32))            # Waiters per database identity before 429
+DB_INTERACTIVE_RESERVE = int(os.getenv("DB_INTERACTIVE_RESERVE", 2))  # Slots background metadata work can't take
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 16))        # Concurrent OpenAI calls across all users
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", 64))          # Waiters for the LLM before 429
+ADMISSION_WAIT_TIMEOUT = float(os.getenv("ADMISSION_WAIT_TIMEOUT", 10))  # Seconds queued before giving up with 429
+
+INTERACTIVE = 0
+BACKGROUND = 1
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of the work running in the current task; background jobs set it for everything they call
+_priority = contextvars.ContextVar("admission_priority", default=INTERACTIVE)
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def background():
+    """Run the enclosed work (e.g. a metadata refresh) behind interactive requests."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class Limiter:
+    """A semaphore with a bounded, priority-ordered wait queue.
+
+    Interactive waiters are admitted before background ones, and background work
+    never takes the last `reserve` slots. When the queue is full, or a waiter has
+    waited `wait_timeout` seconds, Overloaded is raised instead of waiting longer.
+    """
+
+    def __init__(self, name, limit, max_queue, wait_timeout=ADMISSION_WAIT_TIMEOUT, reserve=0):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self.reserve = reserve
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters = []  # heap of (priority, arrival, future)
+        self._arrivals = itertools.count()
+
+    def _capacity(self, priority):
+        if priority == INTERACTIVE:
+            return self.limit
+        return max(self.limit - self.reserve, 1)
+
+    def _can_start(self, priority):
+        # Free capacity, and nobody of the same or higher priority already queued ahead of us
+        if self.in_flight >= self._capacity(priority):
+            return False
+        return not self._waiters or self._waiters[0][0] > priority
+
+    def queued(self):
+        return len(self._waiters)
+
+    def idle(self):
+        return self.in_flight == 0 and not self._waiters
+
+    def _reject(self, reason, message):
+        self.rejected += 1
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        raise Overloaded(message, retry_after=max(math.ceil(self.wait_timeout / 2), 1))
+
+    def check(self, priority=None):
+        """Raise Overloaded now if an acquire would be rejected, e.g. before starting a streamed response."""
+        priority = _priority.get() if priority is None else priority
+        if not self._can_start(priority) and len(self._waiters) >= self.max_queue:
+            self._reject("queue_full", f"Too many concurrent {self.name} requests, try again shortly")
+
+    def _start(self):
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(self.name).inc()
+
+    def _release(self):
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.labels(self.name).dec()
+        while self._waiters and self.in_flight < self._capacity(self._waiters[0][0]):
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._start()
+                future.set_result(None)
+
+    async def _acquire(self, priority):
+        if self._can_start(priority):
+            self._start()
+            return
+        self.check(priority)
+        entry = (priority, next(self._arrivals), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        ADMISSION_QUEUE_DEPTH.labels(self.name).inc()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(entry[2], self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._reject("timeout", f"Timed out waiting for a {self.name} slot after {self.wait_timeout}s")
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled():
+                # The slot was handed to us just as we were cancelled; pass it on
+                self._release()
+            raise
+        finally:
+            ADMISSION_QUEUE_DEPTH.labels(self.name).dec()
+            ADMISSION_WAIT_SECONDS.labels(self.name, _PRIORITY_NAMES[priority]).observe(time.monotonic() - started)
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, priority=None):
+        await self._acquire(_priority.get() if priority is None else priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "queued": self.queued(), "rejected": self.rejected}
+
+
+class Admission:
+    """Per-database-identity limits on database work plus a global cap on LLM calls."""
+
+    def __init__(self, db_limit=DB_CONCURRENCY, db_queue=DB_QUEUE_SIZE, db_reserve=DB_INTERACTIVE_RESERVE,
+                 llm_limit=LLM_CONCURRENCY, llm_queue=LLM_QUEUE_SIZE, wait_timeout=ADMISSION_WAIT_TIMEOUT):
+        self.db_limit = db_limit
+        self.db_queue = db_queue
+        self.db_reserve = db_reserve
+        self.wait_timeout = wait_timeout
+        self._databases = {}  # connection key -> Limiter, dropped again once idle
+        self.llm = Limiter("llm", llm_limit, llm_queue, wait_timeout)
+
+    def _database(self, creds):
+        limiter = self._databases.get(creds.key)
+        if limiter is None:
+            limiter = Limiter("database", self.db_limit, self.db_queue, self.wait_timeout, self.db_reserve)
+            self._databases[creds.key] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def database(self, creds, priority=None):
+        limiter = self._database(creds)
+        try:
+            async with limiter.slot(priority):
+                yield
+        finally:
+            if limiter.idle() and self._databases.get(creds.key) is limiter:
+                del self._databases[creds.key]
+
+    def check_database(self, creds):
+        limiter = self._databases.get(creds.key)
+        if limiter is not None:
+            limiter.check()
+
+    def stats(self):
+        databases = self._databases.values()
+        return {
+            "databases": len(self._databases),
+            "database_in_flight": sum(limiter.in_flight for limiter in databases),
+            "database_queued": sum(limiter.queued() for limiter in databases),
+            "database_limit": self.db_limit,
+            "llm": self.llm.stats(),
+        }
+
+
+admission = Admission()
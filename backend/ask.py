@@ -0,0 +1,112 @@
+import logging
+import re
+import time
+from contextlib import aclosing, contextmanager
+
+from instrumentation import stage, STAGE_SECONDS
+from chat_stream import sse_event
+from streaming import iter_batches, STREAM_BATCH_SIZE
+from query_cache import is_read_only, syntax_error
+
+logger = logging.getLogger(__name__)
+
+# Appended to the chat system prompt so the completion is a query rather than prose
+ASK_INSTRUCTION = ("Reply with exactly one read-only {dialect} query in a ```sql code block and nothing else. "
+                   "If the question cannot be answered with a query, reply without a code block.")
+
+_SQL_LANGUAGES = {"sql", "postgresql", "postgres", "psql", "mysql", "duckdb", "clickhouse", "sqlite", "pgsql"}
+# ```lang\n...``` blocks; the closing fence may be missing if the completion was cut off
+_FENCED = re.compile(r"```[ \t]*([\w+-]*)[^\n]*\n(.*?)(?:```|\Z)", re.DOTALL)
+_INLINE = re.compile(r"`((?:select|with)\b[^`]+)`", re.IGNORECASE)
+_STATEMENT_START = re.compile(r"^[ \t]*(?:select|with)\b", re.IGNORECASE | re.MULTILINE)
+_LOOKS_LIKE_SQL = re.compile(r"^\s*\(*\s*(?:select|with|show|describe|desc|values|table|explain)\b", re.IGNORECASE)
+
+
+def _statement(text):
+    # Up to the first semicolon or blank line, whichever ends the statement
+    text = re.split(r"\n\s*\n", text.strip(), maxsplit=1)[0]
+    end = text.find(";")
+    return (text[:end] if end >= 0 else text).strip()
+
+
+def extract_sql(completion):
+    """The SQL in a chat completion, or None.
+
+    Prefers a ```sql block, then any fenced block that reads like a query, then
+    `inline code`, then a SELECT/WITH statement written straight into the prose.
+    """
+    if not completion:
+        return None
+    blocks = _FENCED.findall(completion)
+    for language, body in blocks:
+        if language.lower() in _SQL_LANGUAGES and body.strip():
+            return body.strip().rstrip(";").strip()
+    for _, body in blocks:
+        if _LOOKS_LIKE_SQL.match(body):
+            return body.strip().rstrip(";").strip()
+    inline = _INLINE.search(completion)
+    if inline:
+        return inline.group(1).strip().rstrip(";").strip()
+    start = _STATEMENT_START.search(completion)
+    if start:
+        return _statement(completion[start.start():])
+    return None
+
+
+def check_sql(query):
+    """Why `query` won't be run without a look from the user, or None if it's safe to run."""
+    if not query:
+        return "The answer did not contain a SQL query"
+    problem = syntax_error(query)
+    if problem:
+        return problem
+    if not is_read_only(query):
+        return "Only single read-only queries are run automatically"
+    return None
+
+
+@contextmanager
+def timed(timings, name):
+    # Like instrumentation.stage, and also keeps the milliseconds for the response
+    started = time.perf_counter()
+    try:
+        with stage(name):
+            yield
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def stream_ask(request, creds, sql, timings, pipeline_started, cached=False, batch_size=STREAM_BATCH_SIZE,
+                     timeout_ms=None):
+    """Server-Sent Events for a generated query: `sql` first, then `columns` and `rows`
+    batches as they are read, then `done` with the row count and per-stage timings.
+
+    A database failure ends the stream with an `error` event naming the stage.
+    """
+    started = time.perf_counter()
+    yield sse_event("sql", {"sql": sql, "cached": cached, "timings": dict(timings)})
+    row_count = 0
+    current = "execute"
+    try:
+        async with aclosing(iter_batches(creds, sql, batch_size, timeout_ms)) as batches:
+            async for columns, rows in batches:
+                if current == "execute":
+                    # Time to the first batch: planning and execution, as far as the database lets us see
+                    timings["execute"] = round((time.perf_counter() - started) * 1000, 1)
+                    STAGE_SECONDS.labels("ask_first_rows").observe(time.perf_counter() - started)
+                    current = "fetch"
+                    yield sse_event("columns", {"columns": columns})
+                row_count += len(rows)
+                yield sse_event("rows", {"rows": [dict(zip(columns, row)) for row in rows]})
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, stopping ask stream")
+                    return
+    except Exception as e:
+        logger.warning("Database error while streaming ask results: %s", e)
+        yield sse_event("error", {"stage": current, "detail": f"Database error: {str(e)}", "sql": sql})
+        return
+    timings.setdefault("execute", round((time.perf_counter() - started) * 1000, 1))
+    timings["fetch"] = round((time.perf_counter() - started) * 1000, 1)
+    timings["total"] = round((time.perf_counter() - pipeline_started) * 1000, 1)
+    STAGE_SECONDS.labels("ask_fetch").observe(time.perf_counter() - started)
+    yield sse_event("done", {"row_count": row_count, "timings": timings})
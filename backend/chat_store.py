@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from executor import run_blocking
+
+logger = logging.getLogger(__name__)
+
+CHAT_DB_PATH = os.getenv("CHAT_DB_PATH", "chats.db")
+LEGACY_CHATS_DIR = "chats"
+
+
+def generate_chat_title(messages):
+    if not messages:
+        return "New Chat"
+
+    # Get the first user message
+    first_message = None
+    for msg in messages:
+        if isinstance(msg, dict) and msg.get("role") == "user" and msg.get("content"):
+            first_message = msg["content"]
+            break
+
+    if not first_message:
+        return "New Chat"
+
+    # Generate title from the first message
+    title = first_message.strip()
+    # Truncate to first 30 characters and add ellipsis if longer
+    if len(title) > 30:
+        title = title[:27] + "..."
+    return title
+
+
+def _normalize_legacy_chat(data, chat_id):
+    # Old chat files are either a chat object or a bare list of messages/strings
+    if isinstance(data, list):
+        chat = {"id": chat_id, "messages": data, "title": "New Chat"}
+    else:
+        chat = data if isinstance(data, dict) else {}
+
+    formatted_messages = []
+    messages = chat.get("messages", [])
+    if isinstance(messages, list):
+        for msg in messages:
+            if isinstance(msg, dict):
+                formatted_messages.append({
+                    "role": msg.get("role", "user"),
+                    "content": msg.get("content", "")
+                })
+            elif isinstance(msg, str):
+                formatted_messages.append({
+                    "role": "user",
+                    "content": msg
+                })
+
+    return {
+        "id": chat.get("id", chat_id),
+        "messages": formatted_messages,
+        "createdAt": chat.get("createdAt", datetime.now().isoformat()),
+        "title": chat.get("title") or generate_chat_title(formatted_messages)
+    }
+
+
+class ChatStore:
+    """Chats in an embedded SQLite database.
+
+    Chat rows are indexed by createdAt so the sidebar list is a range scan, and
+    messages live in their own table so they are only read when a chat is opened.
+    """
+
+    def __init__(self, path=CHAT_DB_PATH, legacy_dir=LEGACY_CHATS_DIR):
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self._local = threading.local()
+        self._migrate_lock = threading.Lock()
+        self._ready = False
+
+    def _conn(self):
+        # sqlite3 connections are bound to the thread that opened them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        if not self._ready:
+            self._setup(conn)
+        return conn
+
+    def _setup(self, conn):
+        with self._migrate_lock:
+            if self._ready:
+                return
+            with conn:
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS chats (
+                        id TEXT PRIMARY KEY,
+                        title TEXT NOT NULL,
+                        created_at TEXT NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS chats_created_at ON chats (created_at DESC, id DESC);
+                    CREATE TABLE IF NOT EXISTS messages (
+                        chat_id TEXT NOT NULL REFERENCES chats (id) ON DELETE CASCADE,
+                        seq INTEGER NOT NULL,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        PRIMARY KEY (chat_id, seq)
+                    ) WITHOUT ROWID;
+                    CREATE TABLE IF NOT EXISTS store_meta (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL
+                    );
+                """)
+            migrated = conn.execute("SELECT value FROM store_meta WHERE key = 'legacy_migrated'").fetchone()
+            if migrated is None:
+                self._migrate_legacy(conn)
+            self._ready = True
+
+    def _migrate_legacy(self, conn):
+        # One-time import of the chats/*.json files; the files are left in place as a backup
+        imported = 0
+        if os.path.isdir(self.legacy_dir):
+            for file in sorted(os.listdir(self.legacy_dir)):
+                if not file.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.legacy_dir, file), "r") as f:
+                        chat = _normalize_legacy_chat(json.load(f), file[:-len(".json")])
+                except (json.JSONDecodeError, IOError) as e:
+                    logger.warning("Error reading chat file %s: %s", file, e)
+                    continue
+                self._write_chat(conn, chat)
+                imported += 1
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('legacy_migrated', ?)",
+                         (datetime.now().isoformat(),))
+        if imported:
+            logger.info("Migrated %d chats from %s/ into %s", imported, self.legacy_dir, self.path)
+
+    def _write_chat(self, conn, chat):
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO chats (id, title, created_at) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET title = excluded.title, created_at = excluded.created_at
+                """,
+                (chat["id"], chat["title"], chat["createdAt"])
+            )
+            conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat["id"],))
+            self._insert_messages(conn, chat["id"], 0, chat["messages"])
+
+    def save_chat(self, chat):
+        """Store a full chat, writing only what changed.
+
+        When the stored messages are a prefix of the incoming ones (the usual case:
+        one more turn) only the new messages are inserted, otherwise the chat is rewritten.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            count, last = self._tail(conn, chat["id"])
+            messages = chat["messages"]
+            if count == 0 or count > len(messages) or messages[count - 1] != last:
+                # Nothing stored yet, or history was edited: rewrite the chat
+                conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat["id"],))
+                count = 0
+            conn.execute(
+                """
+                INSERT INTO chats (id, title, created_at) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET title = excluded.title, created_at = excluded.created_at
+                """,
+                (chat["id"], chat["title"], chat["createdAt"])
+            )
+            self._insert_messages(conn, chat["id"], count, messages[count:])
+
+    def append_messages(self, chat_id, messages, created_at=None, title=None):
+        """Append new messages to a chat (creating it if needed) and return its message count.
+
+        Each call is one transaction that only inserts rows, so concurrent writers
+        serialize on SQLite's write lock instead of overwriting each other.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            exists = conn.execute("SELECT 1 FROM chats WHERE id = ?", (chat_id,)).fetchone()
+            if exists is None:
+                conn.execute(
+                    "INSERT INTO chats (id, title, created_at) VALUES (?, ?, ?)",
+                    (chat_id, title or generate_chat_title(messages), created_at or datetime.now().isoformat())
+                )
+            elif title:
+                conn.execute("UPDATE chats SET title = ? WHERE id = ?", (title, chat_id))
+            count, _ = self._tail(conn, chat_id)
+            self._insert_messages(conn, chat_id, count, messages)
+        return count + len(messages)
+
+    def _tail(self, conn, chat_id):
+        # (number of stored messages, last stored message)
+        row = conn.execute(
+            "SELECT seq, role, content FROM messages WHERE chat_id = ? ORDER BY seq DESC LIMIT 1", (chat_id,)
+        ).fetchone()
+        if row is None:
+            return 0, None
+        return row[0] + 1, {"role": row[1], "content": row[2]}
+
+    def _insert_messages(self, conn, chat_id, start, messages):
+        conn.executemany(
+            "INSERT INTO messages (chat_id, seq, role, content) VALUES (?, ?, ?, ?)",
+            [(chat_id, start + i, msg["role"], msg["content"]) for i, msg in enumerate(messages)]
+        )
+
+    def checkpoint(self):
+        # Fold the write-ahead log back into the database file. SQLite does this atomically,
+        # readers keep seeing a consistent snapshot throughout.
+        return self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+
+    async def checkpoint_forever(self, interval=300):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_blocking("sqlite", self.checkpoint)
+            except Exception as e:
+                logger.warning("Error checkpointing chat store: %s", e)
+
+    def _messages(self, conn, chat_id):
+        rows = conn.execute(
+            "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY seq", (chat_id,)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def list_chats(self, limit=None, before=None, include_messages=True):
+        """Newest first. `before` is the (createdAt, id) of the last chat on the previous page.
+
+        Chats created at the same instant are ordered by id, so paging never skips or
+        repeats one. A bare createdAt is still accepted and starts strictly before it.
+        """
+        conn = self._conn()
+        query = "SELECT id, title, created_at FROM chats"
+        params = []
+        if isinstance(before, (tuple, list)):
+            # Row value comparison; walks the (created_at DESC, id DESC) index
+            query += " WHERE (created_at, id) < (?, ?)"
+            params.extend(before)
+        elif before is not None:
+            query += " WHERE created_at < ?"
+            params.append(before)
+        query += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        chats = []
+        for chat_id, title, created_at in conn.execute(query, params).fetchall():
+            chat = {"id": chat_id, "createdAt": created_at, "title": title}
+            if include_messages:
+                chat["messages"] = self._messages(conn, chat_id)
+            chats.append(chat)
+        return chats
+
+    def get_chat(self, chat_id, include_messages=True):
+        conn = self._conn()
+        row = conn.execute("SELECT id, title, created_at FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return None
+        chat = {"id": row[0], "createdAt": row[2], "title": row[1]}
+        if include_messages:
+            chat["messages"] = self._messages(conn, chat_id)
+        return chat
+
+    def delete_chat(self, chat_id):
+        conn = self._conn()
+        with conn:
+            deleted = conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,)).rowcount
+        return deleted > 0
+
+
+chat_store = ChatStore()
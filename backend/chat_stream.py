@@ -0,0 +1,72 @@
+import json
+import logging
+import time
+
+from instrumentation import STAGE_SECONDS
+from admission import admission, Overloaded
+from results import json_default
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
+
+
+async def stream_cached_answer(response):
+    yield sse_event("token", {"content": response})
+    yield sse_event("done", {"response": response, "cached": True, "first_token_ms": 0.0, "total_ms": 0.0})
+
+
+async def stream_chat_completion(request, client, model, messages, empty_response, on_complete=None):
+    """Forward an OpenAI chat completion to the browser as Server-Sent Events.
+
+    Emits a `token` event per content delta, then one `done` event with the full
+    text and timings. The upstream call is closed as soon as the browser goes away.
+    """
+    started = time.perf_counter()
+    first_token_ms = None
+    parts = []
+    stream = None
+    try:
+        # The LLM slot is held until the upstream stream is finished or abandoned
+        async with admission.llm.slot():
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if not content:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                    STAGE_SECONDS.labels("llm_first_token").observe(first_token_ms / 1000)
+                parts.append(content)
+                yield sse_event("token", {"content": content})
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling OpenAI stream")
+                    return
+
+        response = "".join(parts).strip()
+        STAGE_SECONDS.labels("llm").observe(time.perf_counter() - started)
+        if response and on_complete is not None:
+            await on_complete(response)
+        yield sse_event("done", {
+            "response": response or empty_response,
+            "first_token_ms": first_token_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Overloaded as e:
+        yield sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+    except Exception as api_error:
+        logger.error("OpenAI API error: %s", api_error)
+        yield sse_event("error", {"detail": f"Error with OpenAI API: {str(api_error)}"})
+    finally:
+        if stream is not None:
+            # Closing the HTTP response stops OpenAI from generating (and billing) further tokens
+            await stream.close()
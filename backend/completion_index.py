@@ -0,0 +1,285 @@
+import bisect
+import functools
+import os
+import re
+from collections import Counter
+
+AUTOCOMPLETE_LIMIT = int(os.getenv("AUTOCOMPLETE_LIMIT", 10))  # Suggestions returned by default
+
+_SCAN_FACTOR = 20              # Prefix matches looked at per suggestion returned, before ranking
+_FUZZY_MIN_SIMILARITY = 0.5    # Share of the typed text's trigrams a fuzzy match must contain
+_EXACT, _PREFIX, _SEGMENT, _FUZZY = range(4)
+_BULK_UPDATE_SHARE = 0.05      # Above this share of tables changed, update re-sorts once instead of inserting
+
+
+def _segment_starts(name):
+    # Offsets where a word starts inside an identifier: "orderItems_2024" -> 0, 5, 11
+    starts = {0}
+    for match in re.finditer(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[^A-Za-z0-9])(?=[A-Za-z0-9])|(?<=[A-Za-z])(?=\d)", name):
+        starts.add(match.start())
+    return sorted(starts)
+
+
+@functools.lru_cache(maxsize=65536)
+def _keys(name):
+    # The name, and its tail from every later word, so "items" finds "order_items"
+    lowered = name.lower()
+    return tuple(lowered[start:] for start in _segment_starts(name) if lowered[start:])
+
+
+def _trigrams(text, closed=True):
+    # Names are closed on the right; typed text is a prefix, so it isn't
+    padded = f"  {text} " if closed else f"  {text}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _quality(name, typed):
+    lowered = name.lower()
+    if lowered == typed:
+        return _EXACT
+    if lowered.startswith(typed):
+        return _PREFIX
+    return _SEGMENT
+
+
+def _suggestion(table, column=None, data_type=None, fuzzy=False):
+    if column is None:
+        return {"label": table, "kind": "table", "table": table, "fuzzy": fuzzy}
+    return {"label": f"{table}.{column}", "kind": "column", "table": table, "column": column, "type": data_type,
+            "fuzzy": fuzzy}
+
+
+class CompletionIndex:
+    """Prefix index over table and column names for @table / @table.column completion.
+
+    Every name is kept in one sorted array under its full lowercased form and under
+    the tail starting at each word inside it, so a lookup is a bisect plus a short
+    scan. Misspellings fall back to trigram similarity. Built from schema cache
+    metadata; `update` re-indexes only the tables whose columns changed.
+    """
+
+    def __init__(self, metadata=None):
+        self._entries = []        # sorted (key, table, column); column is "" for the table itself
+        self._tables = {}         # lowercased table -> table
+        self._columns = {}        # table -> {lowercased column: [column, type, ...]}
+        self._signatures = {}     # table -> columns as indexed, to detect changes
+        self._names = {}          # lowercased name -> set of (table, column), for fuzzy matches
+        self._trigram_names = {}  # trigram -> set of lowercased names
+        if metadata:
+            self.update(metadata)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def copy(self):
+        """An independent index with the same contents; updating it leaves this one untouched."""
+        index = CompletionIndex()
+        index._entries = list(self._entries)
+        index._tables = dict(self._tables)
+        index._columns = dict(self._columns)
+        index._signatures = dict(self._signatures)
+        index._names = {name: set(refs) for name, refs in self._names.items()}
+        index._trigram_names = {trigram: set(names) for trigram, names in self._trigram_names.items()}
+        return index
+
+    def _table_entries(self, table, columns):
+        entries = [(key, table, "") for key in _keys(table)]
+        for column in columns:
+            entries.extend((key, table, column[0]) for key in _keys(column[0]))
+        return entries
+
+    def _add_name(self, name, ref):
+        lowered = name.lower()
+        refs = self._names.get(lowered)
+        if refs is None:
+            refs = self._names[lowered] = set()
+            for trigram in _trigrams(lowered):
+                self._trigram_names.setdefault(trigram, set()).add(lowered)
+        refs.add(ref)
+
+    def _remove_name(self, name, ref):
+        lowered = name.lower()
+        refs = self._names.get(lowered)
+        if refs is None:
+            return
+        refs.discard(ref)
+        if not refs:
+            del self._names[lowered]
+            for trigram in _trigrams(lowered):
+                names = self._trigram_names.get(trigram)
+                if names is not None:
+                    names.discard(lowered)
+                    if not names:
+                        del self._trigram_names[trigram]
+
+    def _register(self, table, columns):
+        self._tables[table.lower()] = table
+        self._columns[table] = {column[0].lower(): column for column in columns}
+        self._signatures[table] = tuple(tuple(column) for column in columns)
+        self._add_name(table, (table, ""))
+        for column in columns:
+            self._add_name(column[0], (table, column[0]))
+
+    def _remove(self, table, entries=True):
+        # entries=False leaves the table's keys in self._entries for the caller to filter out
+        columns = self._signatures.pop(table)
+        for entry in self._table_entries(table, columns) if entries else ():
+            position = bisect.bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+        self._remove_name(table, (table, ""))
+        for column in columns:
+            self._remove_name(column[0], (table, column[0]))
+        if self._tables.get(table.lower()) == table:
+            del self._tables[table.lower()]
+        del self._columns[table]
+
+    def update(self, metadata):
+        """Bring the index in line with `metadata`; returns the number of tables re-indexed."""
+        changed = [table for table, columns in metadata.items()
+                   if self._signatures.get(table) != tuple(tuple(column) for column in columns)]
+        removed = [table for table in self._signatures if table not in metadata]
+        stale = removed + [table for table in changed if table in self._signatures]
+        if len(stale) + len(changed) > _BULK_UPDATE_SHARE * len(self._signatures):
+            # First build, or many tables changed: filter and sort once instead of one bisect per key
+            for table in stale:
+                self._remove(table, entries=False)
+            if stale:
+                stale = set(stale)
+                self._entries = [entry for entry in self._entries if entry[1] not in stale]
+            for table in changed:
+                self._register(table, metadata[table])
+                self._entries.extend(self._table_entries(table, metadata[table]))
+            self._entries.sort()
+        else:
+            for table in stale:
+                self._remove(table)
+            for table in changed:
+                self._register(table, metadata[table])
+                for entry in self._table_entries(table, metadata[table]):
+                    bisect.insort(self._entries, entry)
+        return len(changed) + len(removed)
+
+    def complete(self, text, limit=AUTOCOMPLETE_LIMIT, usage=None):
+        """Suggestions for what follows an @: "ord" completes tables and columns, "orders.cu" columns of orders.
+
+        Ranked by how well the name matches, then by `usage` ({(table, column): count},
+        lowercased, column "" for a table), then by length. Falls back to fuzzy matches
+        when nothing starts with the typed text.
+        """
+        text = text.lstrip("@").strip()
+        usage = usage or {}
+        if "." in text:
+            table_text, column_text = text.split(".", 1)
+            return self._complete_columns(table_text, column_text.lower(), limit, usage)
+        return self._complete_names(text.lower(), limit, usage)
+
+    def _rank(self, candidates, usage):
+        # candidates: {(table, column): quality}
+        def key(ref):
+            table, column = ref
+            return (candidates[ref], -usage.get((table.lower(), column.lower()), 0), column != "",
+                    len(column or table), table, column)
+        return sorted(candidates, key=key)
+
+    def _complete_names(self, typed, limit, usage):
+        if not typed:
+            # Nothing typed yet: the most used references, then tables in name order
+            candidates = {}
+            for (table, column), _ in Counter(usage).most_common(limit):
+                ref = self._resolve(table, column)
+                if ref is not None:
+                    candidates[ref] = _PREFIX
+            for table in sorted(self._columns)[:limit]:
+                candidates.setdefault((table, ""), _SEGMENT)
+            return [self._suggest(ref) for ref in self._rank(candidates, usage)[:limit]]
+
+        start = bisect.bisect_left(self._entries, (typed,))
+        end = bisect.bisect_left(self._entries, (typed + "￿",), start)
+        candidates = {}
+        for key, table, column in self._entries[start:min(end, start + limit * _SCAN_FACTOR)]:
+            ref = (table, column)
+            quality = _quality(column or table, typed)
+            if candidates.get(ref, _FUZZY) > quality:
+                candidates[ref] = quality
+        if end - start > limit * _SCAN_FACTOR:
+            # Too many matches to rank them all: make sure frequently used ones aren't cut off
+            for table, column in usage:
+                ref = self._resolve(table, column)
+                if ref is not None and ref not in candidates and any(
+                        key.startswith(typed) for key in _keys(ref[1] or ref[0])):
+                    candidates[ref] = _quality(ref[1] or ref[0], typed)
+        if candidates:
+            return [self._suggest(ref) for ref in self._rank(candidates, usage)[:limit]]
+        return [self._suggest(ref, fuzzy=True) for ref in self._fuzzy(typed, limit, usage)]
+
+    def _complete_columns(self, table_text, typed, limit, usage):
+        table = self._tables.get(table_text.lower())
+        fuzzy = False
+        if table is None:
+            # Misspelt table: complete against the closest one
+            tables = [ref[0] for ref in self._fuzzy(table_text.lower(), 1, usage, tables_only=True)]
+            if not tables:
+                return []
+            table, fuzzy = tables[0], True
+        columns = self._columns[table]
+        candidates = {}
+        for lowered, column in columns.items():
+            if not typed:
+                candidates[(table, column[0])] = _PREFIX
+            elif any(key.startswith(typed) for key in _keys(column[0])):
+                candidates[(table, column[0])] = _quality(column[0], typed)
+        if candidates:
+            ranked = self._rank(candidates, usage) if typed else [
+                # Nothing typed after the dot: used columns first, otherwise table order
+                ref for _, ref in sorted(enumerate(candidates),
+                                         key=lambda item: (-usage.get((table.lower(), item[1][1].lower()), 0), item[0]))]
+            return [self._suggest(ref, fuzzy) for ref in ranked[:limit]]
+        names = {lowered: lowered for lowered in columns}
+        return [self._suggest((table, columns[name][0]), fuzzy=True)
+                for name in self._similar(typed, names, limit)]
+
+    def _similar(self, typed, names, limit):
+        # The `limit` names in `names` sharing most of the typed text's trigrams
+        grams = _trigrams(typed, closed=False)
+        scored = []
+        for name in names:
+            similarity = len(grams & _trigrams(name)) / len(grams)
+            if similarity >= _FUZZY_MIN_SIMILARITY:
+                scored.append((-similarity, len(name), name))
+        return [name for _, _, name in sorted(scored)[:limit]]
+
+    def _fuzzy(self, typed, limit, usage, tables_only=False):
+        grams = _trigrams(typed, closed=False)
+        shared = Counter()
+        for gram in grams:
+            for name in self._trigram_names.get(gram, ()):
+                shared[name] += 1
+        scored = []
+        for name, count in shared.items():
+            similarity = count / len(grams)
+            if similarity < _FUZZY_MIN_SIMILARITY:
+                continue
+            for table, column in self._names[name]:
+                if tables_only and column:
+                    continue
+                scored.append((-similarity, -usage.get((table.lower(), column.lower()), 0), column != "",
+                               len(name), table, column))
+        return [(table, column) for *_, table, column in sorted(scored)[:limit]]
+
+    def _resolve(self, table, column):
+        # Lowercased (table, column) from usage counts -> the names as they are in the schema
+        table = self._tables.get(table)
+        if table is None:
+            return None
+        if not column:
+            return table, ""
+        found = self._columns[table].get(column)
+        return (table, found[0]) if found is not None else None
+
+    def _suggest(self, ref, fuzzy=False):
+        table, column = ref
+        if not column:
+            return _suggestion(table, fuzzy=fuzzy)
+        found = self._columns[table][column.lower()]
+        return _suggestion(table, column, found[1] if len(found) > 1 else None, fuzzy)
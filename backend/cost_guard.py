@@ -0,0 +1,333 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from pools import registry, POSTGRESQL, MYSQL, MOTHERDUCK, CLICKHOUSE
+from query_timeout import run_interruptible, clickhouse_settings, new_query_id
+from instrumentation import stage, COST_GUARD_VERDICTS
+from query_cache import sql_fingerprint, outside_quotes
+
+logger = logging.getLogger(__name__)
+
+COST_GUARD = os.getenv("COST_GUARD", "off").lower()                         # off, reject, limit or confirm
+COST_GUARD_MAX_ROWS = int(os.getenv("COST_GUARD_MAX_ROWS", 10_000_000))      # Estimated rows any plan step may handle
+COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST", 0))            # Planner cost (PostgreSQL/MySQL), 0 for none
+COST_GUARD_LIMIT = int(os.getenv("COST_GUARD_LIMIT", 10_000))               # LIMIT added in "limit" mode
+COST_GUARD_CACHE_TTL = float(os.getenv("COST_GUARD_CACHE_TTL", 300))        # Seconds an EXPLAIN estimate is reused
+COST_GUARD_CACHE_SIZE = int(os.getenv("COST_GUARD_CACHE_SIZE", 4096))       # Estimates kept
+COST_GUARD_EXPLAIN_TIMEOUT_MS = int(os.getenv("COST_GUARD_EXPLAIN_TIMEOUT_MS", 2000))  # Budget for the EXPLAIN itself
+
+# Only queries EXPLAIN accepts on every backend are guarded
+_GUARDED = re.compile(r"^\(*\s*(select|with)\b", re.IGNORECASE)
+_HAS_LIMIT = re.compile(r"\blimit\b", re.IGNORECASE)
+# DuckDB's text plan: "EC: 12345" up to 0.9, "~12,345 rows" since 0.10
+_DUCKDB_ROWS = re.compile(r"EC:\s*(\d[\d,]*)|~(\d[\d,]*)\s*rows?\b", re.IGNORECASE)
+# The top edge of one operator's box; boxes in a row of the drawing are the children of the row above
+_DUCKDB_BOX_TOP = re.compile(r"┌[─┴]*┐")
+# Joins DuckDB prints without an estimate (or with the size of one input): the output can be
+# as large as the product of the inputs
+_DUCKDB_PRODUCT_JOINS = {"CROSS_PRODUCT", "NESTED_LOOP_JOIN", "PIECEWISE_MERGE_JOIN", "BLOCKWISE_NL_JOIN",
+                         "POSITIONAL_JOIN"}
+
+
+@dataclass
+class Estimate:
+    rows: int = None       # Rows the query returns
+    scanned: int = None    # Most rows any single plan step reads or produces
+    cost: float = None     # Planner cost units, where the backend has them
+    unestimated: str = None  # A join step whose size the planner gives no way to bound
+
+    def as_dict(self):
+        return {"rows": self.rows, "scanned": self.scanned, "cost": self.cost}
+
+
+@dataclass
+class Verdict:
+    action: str            # run, limit, confirm or reject
+    sql: str               # What to execute; has a LIMIT added for "limit"
+    estimate: Estimate = None
+    reason: str = None
+
+
+def _max_or_none(values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _postgres_estimate(plan):
+    # [{"Plan": {"Plan Rows", "Total Cost", "Plans": [...]}}]
+    root = plan[0]["Plan"]
+    rows = []
+
+    def walk(node):
+        rows.append(node.get("Plan Rows"))
+        for child in node.get("Plans", ()):
+            walk(child)
+    walk(root)
+    return Estimate(root.get("Plan Rows"), _max_or_none(rows), root.get("Total Cost"))
+
+
+def _mysql_estimate(plan):
+    # {"query_block": {"cost_info": {"query_cost"}, "table" / "nested_loop": [...] ...}}
+    block = plan.get("query_block", {})
+    produced, examined = [], []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "rows_produced_per_join" in node:
+                produced.append(int(node["rows_produced_per_join"]))
+            if "rows_examined_per_scan" in node:
+                examined.append(int(node["rows_examined_per_scan"]))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    walk(block)
+    cost = block.get("cost_info", {}).get("query_cost")
+    return Estimate(produced[-1] if produced else None, _max_or_none(produced + examined),
+                    float(cost) if cost is not None else None)
+
+
+def _duckdb_rows(text):
+    return [int((old or new).replace(",", "")) for old, new in _DUCKDB_ROWS.findall(text)]
+
+
+def _duckdb_plan(plan_text):
+    # [name, rows, children] of the root box of DuckDB's text plan, or None if it has no boxes
+    lines = plan_text.splitlines()
+    above, root, i = [], None, 0
+    while i < len(lines):
+        tops = [match.span() for match in _DUCKDB_BOX_TOP.finditer(lines[i])]
+        if not tops:
+            i += 1
+            continue
+        end = i + 1
+        while end < len(lines) and "└" not in lines[end]:
+            end += 1
+        row = []
+        for start, stop in tops:
+            content = [line[start + 1:stop - 1].strip() for line in lines[i + 1:end]]
+            content = [text for text in content if text]
+            rows = _duckdb_rows(" ".join(content))
+            node = [content[0] if content else "", rows[0] if rows else None, []]
+            # Each box sits under the nearest box to its left (or straight above it) in the row above
+            parents = [parent for offset, parent in above if offset <= start]
+            if parents:
+                parents[-1][2].append(node)
+            elif root is None:
+                root = node
+            row.append((start, node))
+        above, i = row, end + 1
+    return root
+
+
+def _duckdb_estimate(plan_text):
+    root = _duckdb_plan(plan_text)
+    if root is None:
+        # Not drawn as boxes; the first estimate printed is the result's
+        rows = _duckdb_rows(plan_text)
+        return Estimate(rows[0] if rows else None, _max_or_none(rows))
+    sizes, unestimated = [], []
+
+    def walk(node):
+        name, rows, children = node
+        child_rows = [walk(child) for child in children]
+        if name in _DUCKDB_PRODUCT_JOINS and child_rows:
+            rows = None
+            if None in child_rows:
+                unestimated.append(name)
+            else:
+                rows = 1
+                for value in child_rows:
+                    rows *= value
+        elif rows is None:
+            # Projections, filters and the like: no bigger than their input
+            rows = _max_or_none(child_rows)
+        sizes.append(rows)
+        return rows
+    rows = walk(root)
+    return Estimate(rows, _max_or_none(sizes), unestimated=unestimated[0] if unestimated else None)
+
+
+def _clickhouse_estimate(rows):
+    # EXPLAIN ESTIMATE: (database, table, parts, rows, marks) per table read
+    scanned = sum(int(row[3]) for row in rows)
+    return Estimate(None, scanned if rows else None)
+
+
+# Blocking halves, run on the backend's executor
+def _mysql_explain(conn, sql):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("EXPLAIN FORMAT=JSON " + sql)
+        return _mysql_estimate(json.loads(cursor.fetchall()[0][0]))
+    finally:
+        cursor.close()
+
+
+def _duckdb_explain(conn, sql):
+    return _duckdb_estimate("\n".join(str(row[-1]) for row in conn.execute("EXPLAIN " + sql).fetchall()))
+
+
+def _clickhouse_explain(client, sql, timeout_ms=None, query_id=None):
+    return _clickhouse_estimate(client.execute("EXPLAIN ESTIMATE " + sql, settings=clickhouse_settings(timeout_ms),
+                                               query_id=query_id))
+
+
+_BLOCKING_EXPLAIN = {
+    MYSQL: _mysql_explain,
+    MOTHERDUCK: _duckdb_explain,
+    CLICKHOUSE: _clickhouse_explain,
+}
+
+
+def supports(db_type):
+    return db_type == POSTGRESQL or db_type in _BLOCKING_EXPLAIN
+
+
+async def explain(creds, sql, timeout_ms=COST_GUARD_EXPLAIN_TIMEOUT_MS):
+    """The planner's Estimate for `sql`, from the backend's EXPLAIN (the query itself isn't run).
+
+    Planning can be slow too (huge IN lists, many partitions), so the EXPLAIN gets its own
+    short timeout and is interrupted on the server like any other statement.
+    """
+    async with registry.acquire(creds) as conn:
+        if creds.type == POSTGRESQL:
+            # asyncpg cancels the statement on the server when this times out
+            plan = await conn.fetchval("EXPLAIN (FORMAT JSON) " + sql, timeout=timeout_ms / 1000 if timeout_ms else None)
+            return _postgres_estimate(json.loads(plan) if isinstance(plan, str) else plan)
+        if creds.type == CLICKHOUSE:
+            query_id = new_query_id()
+            return await run_interruptible(creds, conn, timeout_ms, _clickhouse_explain, conn, sql, timeout_ms, query_id,
+                                           query_id=query_id)
+        return await run_interruptible(creds, conn, timeout_ms, _BLOCKING_EXPLAIN[creds.type], conn, sql)
+
+
+def add_limit(sql, limit):
+    # Append a LIMIT, or wrap the query when it already has one of its own somewhere
+    bare = outside_quotes(sql).strip().rstrip(";").strip()
+    sql = sql.strip().rstrip(";").rstrip()
+    if not _HAS_LIMIT.search(bare):
+        return f"{sql}\nLIMIT {limit}"
+    return f"SELECT * FROM (\n{sql}\n) AS guarded LIMIT {limit}"
+
+
+def over_threshold(estimate, max_rows=COST_GUARD_MAX_ROWS, max_cost=COST_GUARD_MAX_COST):
+    """Why `estimate` is too expensive to run unchecked, or None."""
+    if max_rows and estimate.unestimated:
+        return f"The plan has a {estimate.unestimated} whose size can't be estimated"
+    if max_rows and estimate.scanned is not None and estimate.scanned > max_rows:
+        return f"Estimated {estimate.scanned:,} rows in one step of the plan (limit {max_rows:,})"
+    if max_cost and estimate.cost is not None and estimate.cost > max_cost:
+        return f"Estimated cost {estimate.cost:,.0f} (limit {max_cost:,.0f})"
+    return None
+
+
+_MODES = ("off", "limit", "confirm", "reject")  # Least to most strict
+
+
+def effective_mode(requested=None):
+    # Requests can make the server's guard stricter, never weaker
+    if requested not in _MODES:
+        return COST_GUARD
+    return max(requested, COST_GUARD, key=_MODES.index)
+
+
+@dataclass
+class _CachedEstimate:
+    estimate: Estimate
+    secret: str      # Password digest of the credentials that ran the EXPLAIN
+    created_at: float
+
+
+class CostGuard:
+    """EXPLAIN read-only queries before running them and act on expensive plans.
+
+    Over the thresholds, "reject" refuses the query, "limit" adds a LIMIT (and, where
+    the backend reports a cost, re-checks the limited plan), and "confirm" refuses
+    until the request is repeated with confirmed=True. Estimates are cached per
+    connection and SQL fingerprint, so a repeated query costs no extra round trip.
+    """
+
+    def __init__(self, ttl=COST_GUARD_CACHE_TTL, max_entries=COST_GUARD_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (connection key, fingerprint) -> _CachedEstimate, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    async def estimate(self, creds, sql):
+        key = (creds.key, sql_fingerprint(sql))
+        entry = self._entries.get(key)
+        if entry is not None and entry.secret == creds.secret and time.monotonic() - entry.created_at < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.estimate
+        self.misses += 1
+        with stage("explain"):
+            estimate = await explain(creds, sql)
+        self._entries[key] = _CachedEstimate(estimate, creds.secret, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return estimate
+
+    async def check(self, creds, sql, mode=None, confirmed=False):
+        """The Verdict for running `sql` under `mode` (default COST_GUARD)."""
+        mode = effective_mode(mode)
+        if mode == "confirm" and confirmed:
+            if COST_GUARD in ("off", "confirm"):
+                return Verdict("run", sql)
+            # Confirming waives a confirm step, not the LIMIT the server enforces
+            mode = COST_GUARD
+        if mode == "off" or not supports(creds.type) or not _GUARDED.match(sql):
+            return Verdict("run", sql)
+        try:
+            estimate = await self.estimate(creds, sql)
+        except Exception as e:
+            # The query would fail the same way; let it, so the user sees the database's own error
+            logger.info("EXPLAIN failed, not guarding the query: %s", e)
+            return Verdict("run", sql)
+
+        reason = over_threshold(estimate)
+        if reason is None:
+            verdict = Verdict("run", sql, estimate)
+        elif mode == "limit":
+            verdict = await self._limit(creds, sql, estimate, reason)
+        elif mode == "confirm":
+            verdict = Verdict("confirm", sql, estimate, reason)
+        else:
+            verdict = Verdict("reject", sql, estimate, reason)
+        COST_GUARD_VERDICTS.labels(verdict.action).inc()
+        return verdict
+
+    async def _limit(self, creds, sql, estimate, reason):
+        limited = add_limit(sql, COST_GUARD_LIMIT)
+        if estimate.cost is None:
+            # No cost model to re-check against; a LIMIT lets the scan stop early
+            return Verdict("limit", limited, estimate, reason)
+        try:
+            limited_estimate = await self.estimate(creds, limited)
+        except Exception as e:
+            logger.info("EXPLAIN of the limited query failed: %s", e)
+            return Verdict("reject", sql, estimate, reason)
+        still = over_threshold(Estimate(limited_estimate.rows, None, limited_estimate.cost))
+        if still is not None:
+            return Verdict("reject", sql, limited_estimate, f"{still}, even with LIMIT {COST_GUARD_LIMIT:,}")
+        return Verdict("limit", limited, limited_estimate, reason)
+
+    def invalidate(self, creds):
+        # After a write or DDL on the connection, plans may have changed
+        for key in [key for key in self._entries if key[0] == creds.key]:
+            del self._entries[key]
+
+    def stats(self):
+        return {"mode": COST_GUARD, "entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+cost_guard = CostGuard()
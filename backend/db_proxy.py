@@ -1,7 +1,11 @@
+import logging
+
 import asyncpg
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 class DatabaseConnection(BaseModel):
@@ -25,5 +29,5 @@ async def test_connection(connection: DatabaseConnection):
         
         return {"success": True, "message": "Connection successful!"}
     except Exception as e:
-        print(f"Connection error: {str(e)}")
+        logger.warning("Connection error: %s", e)
         raise HTTPException(status_code=400, detail=str(e)) 
\ No newline at end of file
@@ -0,0 +1,67 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+# Worker threads per blocking backend. Each backend gets its own executor so a slow
+# MySQL server can't starve ClickHouse or MotherDuck queries of threads.
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", 8))
+BACKEND_WORKERS = {
+    "mysql": int(os.getenv("MYSQL_WORKERS", EXECUTOR_WORKERS)),
+    "clickhouse": int(os.getenv("CLICKHOUSE_WORKERS", EXECUTOR_WORKERS)),
+    "motherduck": int(os.getenv("MOTHERDUCK_WORKERS", EXECUTOR_WORKERS)),
+}
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 60))
+
+_executors = {}
+_http_client = None
+_openai_clients = {}
+
+
+def executor_for(backend):
+    executor = _executors.get(backend)
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=BACKEND_WORKERS.get(backend, EXECUTOR_WORKERS),
+            thread_name_prefix=f"{backend}-worker",
+        )
+        _executors[backend] = executor
+    return executor
+
+
+async def run_blocking(backend, fn, *args, **kwargs):
+    # Run a blocking driver call on the backend's thread pool instead of the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor_for(backend), functools.partial(fn, *args, **kwargs))
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT)
+    return _http_client
+
+
+def get_openai_client(api_key):
+    client = _openai_clients.get(api_key)
+    if client is None:
+        # Imported on first chat request; the openai package is slow to import
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=api_key)
+        _openai_clients[api_key] = client
+    return client
+
+
+async def shutdown():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    for client in _openai_clients.values():
+        await client.close()
+    _openai_clients.clear()
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
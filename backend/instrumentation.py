@@ -0,0 +1,117 @@
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()   # DEBUG also logs prompts, responses and per-request details
+
+# Latency buckets in seconds, from sub-millisecond cache hits to multi-second LLM calls
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "text2sql_stage_seconds",
+    "Time spent in each request stage (connect, metadata, prompt, llm, execute, serialize)",
+    ["stage"],
+    buckets=_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "text2sql_request_seconds",
+    "Time until the response headers are sent, by route",
+    ["method", "route", "status"],
+    buckets=_BUCKETS,
+)
+STAGE_ERRORS = Counter("text2sql_stage_errors_total", "Stages that raised", ["stage"])
+ADMISSION_IN_FLIGHT = Gauge("text2sql_admission_in_flight", "Operations holding an admission slot", ["limiter"])
+ADMISSION_QUEUE_DEPTH = Gauge("text2sql_admission_queue_depth", "Operations waiting for an admission slot", ["limiter"])
+ADMISSION_WAIT_SECONDS = Histogram(
+    "text2sql_admission_wait_seconds",
+    "Time spent waiting for an admission slot",
+    ["limiter", "priority"],
+    buckets=_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "text2sql_admission_rejected_total", "Operations turned away with 429", ["limiter", "reason"]
+)
+COALESCED = Counter(
+    "text2sql_coalesced_total", "Requests that shared an identical in-flight operation", ["operation"]
+)
+COST_GUARD_VERDICTS = Counter(
+    "text2sql_cost_guard_verdicts_total", "Queries checked against their EXPLAIN estimate, by outcome", ["action"]
+)
+
+# Stage timings of the current request, for the Server-Timing header
+_timings = contextvars.ContextVar("stage_timings", default=None)
+
+
+def setup_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+@contextmanager
+def stage(name):
+    """Time a block as `name`, in the stage histogram and the request's Server-Timing header."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def server_timing(timings):
+    # Repeated stages (e.g. two metadata queries) are summed into one entry
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in totals.items())
+
+
+class TimingMiddleware:
+    """Adds a Server-Timing header and records request latency.
+
+    Plain ASGI rather than BaseHTTPMiddleware so streaming responses pass through
+    untouched. A streamed response's header only covers the stages that finished
+    before its first byte; later stages still land in the histograms.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = []
+        token = _timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                route = scope.get("route")
+                REQUEST_SECONDS.labels(
+                    scope["method"], getattr(route, "path", "unmatched"), str(message["status"])
+                ).observe(elapsed)
+                headers = list(message.get("headers", []))
+                value = server_timing(timings + [("total", elapsed)])
+                headers.append((b"server-timing", value.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+
+
+def metrics_response():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,461 @@
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Callable
+
+INTROSPECTION_PAGE_SIZE = int(os.getenv("INTROSPECTION_PAGE_SIZE", 10000))   # Catalog rows fetched per round trip
+INTROSPECTION_WORKERS = int(os.getenv("INTROSPECTION_WORKERS", 4))          # Schemas introspected in parallel
+
+POSTGRESQL = "postgresql"
+MYSQL = "mysql"
+DUCKDB = "duckdb"
+CLICKHOUSE = "clickhouse"
+
+# Connection types that share a catalog dialect
+_ALIASES = {"motherduck": DUCKDB, "postgres": POSTGRESQL}
+
+
+@dataclass(frozen=True)
+class CatalogQueries:
+    # (schema, table, column, type, nullable, comment, position) for one schema, one page at a time,
+    # keyset-paginated on (table, position); parameters: schema, after_table, after_position, limit
+    columns: str
+    # (schema, table, column, kind, ref_schema, ref_table, ref_column), kind is 'PRIMARY KEY' or 'FOREIGN KEY';
+    # parameter: schema
+    keys: str
+    # User schemas (databases on MySQL and ClickHouse), no parameters
+    schemas: str
+    # (column count, hash over table/column/type/nullability/comment) of one schema, computed
+    # server-side for cheap change detection; parameter: schema
+    fingerprint: str
+    # Binds the leading (schema, after_table, after_position, limit) values a query takes, in the driver's paramstyle
+    params: Callable
+    # Same rows as `columns` for a list of (lower-cased) table names instead of a page
+    table_columns: str = None
+    # Binds (schema, tables) for `table_columns`, when `params` can't
+    table_params: Callable = None
+    # Turns the rows of `keys` into the 7-tuples above, when the catalog can't produce them directly
+    key_rows: Callable = None
+    # Server version, no parameters; servers older than `legacy_before` get the `legacy` queries,
+    # which leave out catalog columns those versions don't have
+    version: str = None
+    legacy_before: tuple = None
+    legacy: "CatalogQueries" = None
+
+
+def _positional(*values):
+    return tuple(values)
+
+
+def _mysql_table_params(schema, tables):
+    # mysql.connector can't bind a list; the names go in as a JSON array
+    return schema, json.dumps(tables)
+
+
+def _clickhouse_table_params(schema, tables):
+    return {"schema": schema, "tables": tuple(tables)}
+
+
+def _clickhouse_params(*values):
+    return dict(zip(("schema", "after_table", "after_position", "limit"), values))
+
+
+# FOREIGN KEY (a, b) REFERENCES [schema.]table(x, y), as duckdb_constraints() prints it
+_DUCKDB_REFERENCES = re.compile(r"REFERENCES\s+(.+?)\s*\((.*)\)\s*$", re.IGNORECASE | re.DOTALL)
+
+
+def _unquote(name):
+    name = name.strip()
+    if len(name) > 1 and name[0] == name[-1] == '"':
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+def _duckdb_key_rows(rows):
+    # duckdb_constraints() only has referenced_table/referenced_column_names since 1.x,
+    # so the referenced side is read from the constraint text, which every version has
+    for schema, table, columns, kind, text in rows:
+        if kind == "PRIMARY KEY":
+            for column in columns:
+                yield schema, table, column, kind, None, None, None
+            continue
+        match = _DUCKDB_REFERENCES.search(text or "")
+        if not match:
+            continue
+        ref_schema, _, ref_table = match.group(1).rpartition(".")
+        ref_columns = [_unquote(column) for column in match.group(2).split(",")]
+        for column, ref_column in zip(columns, ref_columns):
+            yield schema, table, column, kind, _unquote(ref_schema) or schema, _unquote(ref_table), ref_column
+
+
+def _version(text):
+    # "v0.9.2" -> (0, 9, 2)
+    return tuple(int(part) for part in re.findall(r"\d+", text or "")[:3])
+
+
+_DUCKDB_COLUMNS = """
+    SELECT schema_name, table_name, column_name, data_type, is_nullable, {comment}, column_index
+    FROM duckdb_columns()
+    WHERE database_name = current_database() AND schema_name = coalesce(?::VARCHAR, current_schema())
+      AND NOT internal AND (table_name, column_index) > (?, ?)
+    ORDER BY table_name, column_index
+    LIMIT ?
+"""
+_DUCKDB_TABLE_COLUMNS = """
+    SELECT schema_name, table_name, column_name, data_type, is_nullable, {comment}, column_index
+    FROM duckdb_columns()
+    WHERE database_name = current_database() AND schema_name = coalesce(?::VARCHAR, current_schema())
+      AND NOT internal AND list_contains(?, lower(table_name))
+    ORDER BY table_name, column_index
+"""
+_DUCKDB_FINGERPRINT = """
+    SELECT count(*), coalesce(bit_xor(hash(concat_ws(':', table_name, column_name, data_type, is_nullable,
+                                                     {comment}))), 0)
+    FROM duckdb_columns()
+    WHERE database_name = current_database() AND schema_name = coalesce(?::VARCHAR, current_schema())
+      AND NOT internal
+"""
+
+_DUCKDB = CatalogQueries(
+    columns=_DUCKDB_COLUMNS.format(comment="comment"),
+    table_columns=_DUCKDB_TABLE_COLUMNS.format(comment="comment"),
+    keys="""
+        SELECT schema_name, table_name, constraint_column_names, constraint_type, constraint_text
+        FROM duckdb_constraints()
+        WHERE database_name = current_database() AND schema_name = coalesce(?::VARCHAR, current_schema())
+          AND constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')
+        ORDER BY table_name, constraint_index
+    """,
+    schemas="""
+        SELECT schema_name
+        FROM information_schema.schemata
+        WHERE catalog_name = current_database() AND schema_name NOT IN ('information_schema', 'pg_catalog')
+        ORDER BY schema_name
+    """,
+    fingerprint=_DUCKDB_FINGERPRINT.format(comment="comment"),
+    params=_positional,
+    key_rows=_duckdb_key_rows,
+    version="SELECT library_version FROM pragma_version()",
+    # Column comments (duckdb_columns().comment) arrived in 0.10
+    legacy_before=(0, 10),
+)
+_DUCKDB = replace(_DUCKDB, legacy=replace(_DUCKDB, columns=_DUCKDB_COLUMNS.format(comment="NULL"),
+                                         table_columns=_DUCKDB_TABLE_COLUMNS.format(comment="NULL"),
+                                         fingerprint=_DUCKDB_FINGERPRINT.format(comment="NULL"), legacy=None))
+
+# A NULL schema means the connection's current schema/database
+_QUERIES = {
+    POSTGRESQL: CatalogQueries(
+        columns="""
+            SELECT c.table_schema, c.table_name, c.column_name, c.data_type, c.is_nullable = 'YES',
+                   col_description(format('%I.%I', c.table_schema, c.table_name)::regclass, c.ordinal_position::int),
+                   c.ordinal_position::int
+            FROM information_schema.columns c
+            WHERE c.table_schema = coalesce($1::text, current_schema())
+              AND (c.table_name::text COLLATE "C", c.ordinal_position::int) > ($2::text COLLATE "C", $3::int)
+            ORDER BY c.table_name::text COLLATE "C", c.ordinal_position
+            LIMIT $4
+        """,
+        table_columns="""
+            SELECT c.table_schema, c.table_name, c.column_name, c.data_type, c.is_nullable = 'YES',
+                   col_description(format('%I.%I', c.table_schema, c.table_name)::regclass, c.ordinal_position::int),
+                   c.ordinal_position::int
+            FROM information_schema.columns c
+            WHERE c.table_schema = coalesce($1::text, current_schema()) AND lower(c.table_name) = ANY($2::text[])
+            ORDER BY c.table_name, c.ordinal_position
+        """,
+        keys="""
+            SELECT tc.table_schema, tc.table_name, kcu.column_name, tc.constraint_type,
+                   ref.table_schema, ref.table_name, ref.column_name
+            FROM information_schema.table_constraints tc
+            JOIN information_schema.key_column_usage kcu
+              ON kcu.constraint_schema = tc.constraint_schema AND kcu.constraint_name = tc.constraint_name
+             AND kcu.table_name = tc.table_name
+            LEFT JOIN information_schema.referential_constraints rc
+              ON rc.constraint_schema = tc.constraint_schema AND rc.constraint_name = tc.constraint_name
+            LEFT JOIN information_schema.key_column_usage ref
+              ON ref.constraint_schema = rc.unique_constraint_schema AND ref.constraint_name = rc.unique_constraint_name
+             AND ref.ordinal_position = kcu.position_in_unique_constraint
+            WHERE tc.table_schema = coalesce($1::text, current_schema())
+              AND tc.constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')
+            ORDER BY tc.table_name, tc.constraint_name, kcu.ordinal_position
+        """,
+        schemas="""
+            SELECT schema_name
+            FROM information_schema.schemata
+            WHERE schema_name NOT IN ('information_schema', 'pg_catalog', 'pg_toast') AND schema_name NOT LIKE 'pg_temp_%'
+              AND schema_name NOT LIKE 'pg_toast_temp_%'
+            ORDER BY schema_name
+        """,
+        fingerprint="""
+            SELECT count(*), coalesce(md5(string_agg(
+                       concat_ws(':', c.table_name, c.column_name, c.data_type, c.is_nullable,
+                                 col_description(format('%I.%I', c.table_schema, c.table_name)::regclass,
+                                                 c.ordinal_position::int)),
+                       ',' ORDER BY c.table_name, c.ordinal_position)), '')
+            FROM information_schema.columns c
+            WHERE c.table_schema = coalesce($1::text, current_schema())
+        """,
+        params=_positional,
+    ),
+    MYSQL: CatalogQueries(
+        columns="""
+            SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, IS_NULLABLE = 'YES', COLUMN_COMMENT, ORDINAL_POSITION
+            FROM information_schema.columns
+            WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND (TABLE_NAME, ORDINAL_POSITION) > (%s, %s)
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+            LIMIT %s
+        """,
+        table_columns="""
+            SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, IS_NULLABLE = 'YES', COLUMN_COMMENT, ORDINAL_POSITION
+            FROM information_schema.columns
+            WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND JSON_CONTAINS(%s, JSON_QUOTE(LOWER(TABLE_NAME)))
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """,
+        keys="""
+            SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME,
+                   IF(CONSTRAINT_NAME = 'PRIMARY', 'PRIMARY KEY', 'FOREIGN KEY'),
+                   REFERENCED_TABLE_SCHEMA, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+            FROM information_schema.key_column_usage
+            WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE())
+              AND (CONSTRAINT_NAME = 'PRIMARY' OR REFERENCED_TABLE_NAME IS NOT NULL)
+            ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+        """,
+        schemas="""
+            SELECT SCHEMA_NAME
+            FROM information_schema.schemata
+            WHERE SCHEMA_NAME NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys')
+            ORDER BY SCHEMA_NAME
+        """,
+        fingerprint="""
+            SELECT COUNT(*),
+                   COALESCE(BIT_XOR(CRC32(CONCAT_WS(':', TABLE_NAME, COLUMN_NAME, DATA_TYPE, IS_NULLABLE, COLUMN_COMMENT))), 0)
+            FROM information_schema.columns
+            WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE())
+        """,
+        params=_positional,
+        table_params=_mysql_table_params,
+    ),
+    DUCKDB: _DUCKDB,
+    CLICKHOUSE: CatalogQueries(
+        columns="""
+            SELECT database, table, name, type, startsWith(type, 'Nullable('), comment, position
+            FROM system.columns
+            WHERE database = coalesce(%(schema)s, currentDatabase())
+              AND (table, position) > (%(after_table)s, %(after_position)s)
+            ORDER BY table, position
+            LIMIT %(limit)s
+        """,
+        table_columns="""
+            SELECT database, table, name, type, startsWith(type, 'Nullable('), comment, position
+            FROM system.columns
+            WHERE database = coalesce(%(schema)s, currentDatabase()) AND lower(table) IN %(tables)s
+            ORDER BY table, position
+        """,
+        # No foreign keys in ClickHouse; the sorting/primary key columns are reported as the primary key
+        keys="""
+            SELECT database, table, name, 'PRIMARY KEY', '', '', ''
+            FROM system.columns
+            WHERE database = coalesce(%(schema)s, currentDatabase()) AND is_in_primary_key
+            ORDER BY table, position
+        """,
+        schemas="""
+            SELECT name
+            FROM system.databases
+            WHERE name NOT IN ('system', 'information_schema', 'INFORMATION_SCHEMA')
+            ORDER BY name
+        """,
+        fingerprint="""
+            SELECT count(), groupBitXor(cityHash64(table, name, type, comment))
+            FROM system.columns
+            WHERE database = coalesce(%(schema)s, currentDatabase())
+        """,
+        params=_clickhouse_params,
+        table_params=_clickhouse_table_params,
+    ),
+}
+
+
+def dialect(db_type):
+    """Catalog dialect for a connection type, or None when introspection isn't supported."""
+    db_type = (db_type or "").lower()
+    db_type = _ALIASES.get(db_type, db_type)
+    return db_type if db_type in _QUERIES else None
+
+
+def queries_for(db_type):
+    name = dialect(db_type)
+    if name is None:
+        raise ValueError(f"Schema introspection is not supported for database type: {db_type}")
+    return _QUERIES[name]
+
+
+def _for_version(queries, version_rows):
+    if queries.legacy is not None and _version(version_rows[0][0]) < queries.legacy_before:
+        return queries.legacy
+    return queries
+
+
+def resolve(run, db_type):
+    """queries_for(), picking the variant the server's version supports; `run(query, params)` as in introspect()."""
+    queries = queries_for(db_type)
+    if queries.version is None:
+        return queries
+    return _for_version(queries, run(queries.version, queries.params()))
+
+
+async def resolve_async(run, db_type):
+    queries = queries_for(db_type)
+    if queries.version is None:
+        return queries
+    return _for_version(queries, await run(queries.version, queries.params()))
+
+
+def _key_rows(queries, rows):
+    return queries.key_rows(rows) if queries.key_rows is not None else rows
+
+
+def assemble(column_rows, key_rows):
+    """Build (metadata, keys) from catalog rows.
+
+    metadata: {table: [[column, type, nullable, comment], ...]}, columns in ordinal order
+    keys:     {table: {"primary_key": [column, ...], "foreign_keys": [(column, ref_table, ref_column), ...]}},
+              the shape schema_encoder.encode_schema takes
+    """
+    metadata = {}
+    for _, table, column, data_type, nullable, comment, _ in column_rows:
+        metadata.setdefault(table, []).append([column, data_type, bool(nullable), comment or ""])
+
+    keys = {}
+    for schema, table, column, kind, ref_schema, ref_table, ref_column in key_rows:
+        info = keys.setdefault(table, {"primary_key": [], "foreign_keys": []})
+        if kind == "PRIMARY KEY":
+            info["primary_key"].append(column)
+        elif ref_table:
+            # Cross-schema references keep their schema
+            target = ref_table if not ref_schema or ref_schema == schema else f"{ref_schema}.{ref_table}"
+            info["foreign_keys"].append((column, target, ref_column))
+    return metadata, keys
+
+
+def _merge(per_schema):
+    # [(schema, (metadata, keys)), ...] -> one (metadata, keys) with schema-qualified table names
+    metadata, keys = {}, {}
+    for schema, (schema_metadata, schema_keys) in per_schema:
+        metadata.update({f"{schema}.{table}": columns for table, columns in schema_metadata.items()})
+        for table, info in schema_keys.items():
+            keys[f"{schema}.{table}"] = {
+                "primary_key": info["primary_key"],
+                "foreign_keys": [(column, ref_table if "." in ref_table else f"{schema}.{ref_table}", ref_column)
+                                 for column, ref_table, ref_column in info["foreign_keys"]],
+            }
+    return metadata, keys
+
+
+def introspect(run, db_type, schema=None, page_size=INTROSPECTION_PAGE_SIZE):
+    """Columns and keys of one schema (None for the current one) in a few bulk catalog queries.
+
+    `run(query, params)` executes a catalog query on a blocking connection and returns its rows.
+    Columns are read in pages of `page_size` rows, so very large catalogs never come back as one result.
+    """
+    queries = resolve(run, db_type)
+    column_rows = []
+    after_table, after_position = "", 0
+    while True:
+        rows = [tuple(row) for row in run(queries.columns, queries.params(schema, after_table, after_position, page_size))]
+        column_rows.extend(rows)
+        if len(rows) < page_size:
+            break
+        after_table, after_position = rows[-1][1], rows[-1][6]
+    return assemble(column_rows, _key_rows(queries, run(queries.keys, queries.params(schema))))
+
+
+async def introspect_async(run, db_type, schema=None, page_size=INTROSPECTION_PAGE_SIZE):
+    """introspect() for an async `run(query, params)`, e.g. one that borrows a pooled connection."""
+    queries = await resolve_async(run, db_type)
+    column_rows = []
+    after_table, after_position = "", 0
+    while True:
+        rows = [tuple(row) for row in await run(queries.columns,
+                                                queries.params(schema, after_table, after_position, page_size))]
+        column_rows.extend(rows)
+        if len(rows) < page_size:
+            break
+        after_table, after_position = rows[-1][1], rows[-1][6]
+    return assemble(column_rows, _key_rows(queries, await run(queries.keys, queries.params(schema))))
+
+
+def introspect_keys(run, db_type, schema=None):
+    """Only the primary/foreign keys of one schema, in one catalog query."""
+    queries = queries_for(db_type)
+    return assemble([], _key_rows(queries, run(queries.keys, queries.params(schema))))[1]
+
+
+async def introspect_tables_async(run, db_type, tables, schema=None):
+    """introspect_async() for just `tables` (matched case-insensitively): the same column
+    rows and the keys of those tables, read concurrently."""
+    queries = await resolve_async(run, db_type)
+    tables = sorted({table.lower() for table in tables})
+    if not tables:
+        return {}, {}
+    bind = queries.table_params or queries.params
+    column_rows, key_rows = await asyncio.gather(
+        run(queries.table_columns, bind(schema, tables)),
+        run(queries.keys, queries.params(schema)),
+    )
+    metadata, keys = assemble(column_rows, _key_rows(queries, key_rows))
+    return metadata, {table: info for table, info in keys.items() if table in metadata}
+
+
+async def fingerprint_async(run, db_type, schema=None):
+    """"count:hash" of a schema's columns; changes whenever a column is added, dropped or altered."""
+    queries = await resolve_async(run, db_type)
+    count, digest = (await run(queries.fingerprint, queries.params(schema)))[0]
+    return f"{count}:{digest}"
+
+
+def list_schemas(run, db_type):
+    queries = queries_for(db_type)
+    return [row[0] for row in run(queries.schemas, queries.params())]
+
+
+async def list_schemas_async(run, db_type):
+    queries = queries_for(db_type)
+    return [row[0] for row in await run(queries.schemas, queries.params())]
+
+
+def introspect_schemas(connect, db_type, schemas=None, workers=INTROSPECTION_WORKERS, page_size=INTROSPECTION_PAGE_SIZE):
+    """Introspect several schemas in parallel, one connection per worker.
+
+    `connect()` returns a (run, close) pair for a new connection. `schemas` defaults to
+    every user schema. Tables in the result are qualified as schema.table.
+    """
+    if schemas is None:
+        run, close = connect()
+        try:
+            schemas = list_schemas(run, db_type)
+        finally:
+            close()
+    if not schemas:
+        return {}, {}
+
+    def one(schema):
+        run, close = connect()
+        try:
+            return schema, introspect(run, db_type, schema, page_size)
+        finally:
+            close()
+
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(schemas)), 1), thread_name_prefix="introspect") as pool:
+        return _merge(pool.map(one, schemas))
+
+
+async def introspect_schemas_async(run, db_type, schemas=None, page_size=INTROSPECTION_PAGE_SIZE):
+    """introspect_schemas() for an async `run`; the schemas are read concurrently."""
+    if schemas is None:
+        schemas = await list_schemas_async(run, db_type)
+    results = await asyncio.gather(*[introspect_async(run, db_type, schema, page_size) for schema in schemas])
+    return _merge(zip(schemas, results))
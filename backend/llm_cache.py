@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from executor import run_blocking
+
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 24 * 3600))        # Seconds an answer stays valid
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 1000))              # Answers kept in memory
+LLM_CACHE_HISTORY_WINDOW = int(os.getenv("LLM_CACHE_HISTORY_WINDOW", 4))  # Trailing messages that are part of the key
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")                          # Optional SQLite file to survive restarts
+
+
+def normalize_question(message):
+    # "Top 10 customers by revenue last month?" and "top 10  customers by revenue last month" share an entry
+    return re.sub(r"\s+", " ", message.strip().lower()).rstrip(" ?.!")
+
+
+def cache_key(message, schema, dialect, model, history, mode=None):
+    window = [
+        {"role": m["role"], "content": m["content"]}
+        for m in history[-LLM_CACHE_HISTORY_WINDOW:]
+    ] if LLM_CACHE_HISTORY_WINDOW > 0 else []
+    parts = {
+        "question": normalize_question(message),
+        "schema": hashlib.sha256(schema.encode()).hexdigest(),
+        "dialect": (dialect or "").lower(),
+        "model": model,
+        "history": hashlib.sha256(json.dumps(window, sort_keys=True).encode()).hexdigest(),
+    }
+    if mode:
+        # A different instruction for the same question (e.g. SQL only, for /api/v1/ask)
+        parts["mode"] = mode
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class _SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections are bound to the thread that opened them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, oldest):
+        return self._conn().execute(
+            "SELECT response, created_at FROM llm_cache WHERE key = ? AND created_at >= ?", (key, oldest)
+        ).fetchone()
+
+    def put(self, key, response, created_at):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response, created_at) VALUES (?, ?, ?)",
+            (key, response, created_at)
+        )
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (created_at - LLM_CACHE_TTL,))
+        conn.commit()
+
+
+class LLMCache:
+    def __init__(self, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_SIZE, path=LLM_CACHE_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (response, created_at), least recently used first
+        self._store = _SQLiteStore(path) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, response, created_at):
+        self._entries[key] = (response, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self._entries.pop(key, None)
+        if self._store is not None:
+            row = await run_blocking("sqlite", self._store.get, key, now - self.ttl)
+            if row is not None:
+                self._remember(key, *row)
+                self.hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    async def put(self, key, response):
+        created_at = time.time()
+        self._remember(key, response, created_at)
+        if self._store is not None:
+            await run_blocking("sqlite", self._store.put, key, response, created_at)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "persistent": self._store is not None,
+        }
+
+
+llm_cache = LLMCache()
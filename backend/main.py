@@ -1,6 +1,6 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
 
 # from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 # from sqlalchemy import create_engine, Column, Integer, String
@@ -11,24 +11,43 @@ from dotenv import load_dotenv
 # import jwt
 # from datetime import datetime, timedelta
 
-import openai
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, Literal, List
-import mysql.connector
-from mysql.connector import Error
-import duckdb
-import clickhouse_driver
-import requests
+import asyncio
+import hashlib
 import json
-from script import * # fetch_api_key, fetch_credentials, create_db_connection, fetch_table_metadata, generate_sql_query, execute_query, determine_db_type
-import os
-from datetime import datetime
-import psycopg2
-import asyncpg
-import sqlite3
-from openai import OpenAI
+import logging
+import time
+# Loads .env before the modules below read their settings; database drivers and
+# openai are imported on first use (see pools.driver and executor.get_openai_client)
+from settings import OPENAI_API_KEY
+from instrumentation import setup_logging, stage, TimingMiddleware, metrics_response
+from pools import registry, driver, DBCredentials, POSTGRESQL, MYSQL, CLOUDFLARE
+import executor
+from executor import run_blocking, get_openai_client
+from streaming import stream_ndjson, stream_json, STREAM_BATCH_SIZE
+from schema_cache import schema_cache, supports_metadata, fetch_table_columns, list_schemas
+from completion_index import AUTOCOMPLETE_LIMIT
+from chat_stream import stream_chat_completion, stream_cached_answer
+from ask import ASK_INSTRUCTION, extract_sql, check_sql, timed, stream_ask
+from llm_cache import llm_cache, cache_key
+from chat_store import chat_store, generate_chat_title
+from prompt_budget import PromptAssembler, count_tokens, load_encoding
+from schema_encoder import encode_schema, SCHEMA_PROMPT_FORMAT
+from results import (execute_and_describe, d1_query, rows_payload, columnar_payload, fetch_arrow_ipc, ARROW_MEDIA_TYPE,
+                     render_result, mark_cached)
+from query_cache import query_cache, is_read_only, parse_cache_control
+from cost_guard import cost_guard
+from query_timeout import effective_timeout_ms, cancel_on_disconnect, ClientDisconnected
+from admission import admission, Overloaded
+import single_flight
+from single_flight import query_flight, llm_flight
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+app.add_middleware(TimingMiddleware)
 
 # Enable CORS
 app.add_middleware(
@@ -40,8 +59,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Cache", "X-Prompt-Tokens", "Retry-After", "ETag", "X-Cost-Guard",
+                    "X-Next-Cursor"],
 )
 
+
+def overloaded_response(error):
+    return JSONResponse(status_code=429, content={"detail": str(error)},
+                        headers={"Retry-After": str(error.retry_after)})
+
+
+@app.exception_handler(Overloaded)
+async def handle_overloaded(request: Request, error: Overloaded):
+    # Admission control turned the request away; clients should back off and retry
+    return overloaded_response(error)
+
+
 @app.get("/")
 async def root():
     return {
@@ -55,6 +88,20 @@ async def root():
         }
     }
 
+@app.on_event("startup")
+async def start_pool_reaper():
+    app.state.pool_reaper = asyncio.create_task(registry.reap_forever())
+    app.state.chat_checkpointer = asyncio.create_task(chat_store.checkpoint_forever())
+    # tiktoken reads (or downloads) its BPE file on first use; token counts are estimated until then
+    app.state.tokenizer = asyncio.create_task(run_blocking("index", load_encoding, CHAT_MODEL))
+
+@app.on_event("shutdown")
+async def close_pools():
+    app.state.pool_reaper.cancel()
+    app.state.chat_checkpointer.cancel()
+    await registry.close_all()
+    await executor.shutdown()
+
 class DatabaseConnection(BaseModel):
     display_name: str
     host: str
@@ -63,6 +110,8 @@ class DatabaseConnection(BaseModel):
     username: str
     password: str
 
+METADATA_MAX_PAGE_SIZE = 5000  # Tables per /api/v1/metadata page
+
 # Add this class for query requests
 class QueryRequest(BaseModel):
     query: str
@@ -72,6 +121,21 @@ class QueryRequest(BaseModel):
     username: str
     password: str
     type: Optional[Literal["postgresql", "mysql", "motherduck", "clickhouse", "cloudflare"]] = None
+    # Stream rows as they are read instead of buffering the whole result
+    stream: bool = False
+    stream_format: Literal["ndjson", "json"] = "ndjson"
+    batch_size: int = Field(STREAM_BATCH_SIZE, ge=1, le=100000)
+    # "rows" returns one object per row, "columnar" one array per column, "arrow" an Arrow IPC stream
+    format: Literal["rows", "columnar", "arrow"] = "rows"
+    # Serve repeated read-only queries from the result cache; Cache-Control: no-cache / no-store / max-age apply
+    cache: bool = False
+    cache_ttl: Optional[float] = Field(None, gt=0)  # Seconds, remembered per connection
+    # Statement timeout, enforced by the database; defaults to QUERY_TIMEOUT_MS
+    timeout_ms: Optional[int] = Field(None, ge=1)
+    # What to do with a read-only query whose EXPLAIN estimate is too high; defaults to COST_GUARD,
+    # and can only make it stricter (off < limit < confirm < reject)
+    cost_guard: Optional[Literal["off", "reject", "limit", "confirm"]] = None
+    confirmed: bool = False  # Run it anyway after a "confirm" response
 
 # Add these models
 class Message(BaseModel):
@@ -84,10 +148,28 @@ class ChatSession(BaseModel):
     createdAt: str
     title: str
 
+class AppendMessagesRequest(BaseModel):
+    messages: List[Message]
+    # Only used when the chat doesn't exist yet
+    createdAt: Optional[str] = None
+    title: Optional[str] = None
+
 class ChatRequest(BaseModel):
     message: str
     history: List[Message]
     database_credentials: Optional[dict] = None
+    # Skip the answer cache and always ask the model
+    bypass_cache: bool = False
+
+class AskRequest(BaseModel):
+    message: str
+    history: List[Message] = []
+    database_credentials: dict
+    bypass_cache: bool = False
+    batch_size: int = Field(STREAM_BATCH_SIZE, ge=1, le=100000)  # Rows per `rows` event
+    timeout_ms: Optional[int] = Field(None, ge=1)
+    cost_guard: Optional[Literal["off", "reject", "limit", "confirm"]] = None
+    confirmed: bool = False
 
 class DatabaseMetadataRequest(BaseModel):
     host: str
@@ -95,177 +177,195 @@ class DatabaseMetadataRequest(BaseModel):
     database: str
     username: str
     password: str
+    schema_name: Optional[str] = None  # Schema (database on MySQL/ClickHouse) to describe, default the connection's own
+    # full: tables with their columns; tables: names and column counts only; schemas: the schemas there are
+    view: Literal["full", "tables", "schemas"] = "full"
+    tables: Optional[List[str]] = None  # Only these tables' columns, for expanding the schema tree lazily
+    # Paging over tables in name order: pass the previous page's next_cursor
+    page_size: Optional[int] = Field(None, ge=1, le=METADATA_MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+    stream: bool = False  # NDJSON, one table per line
+
+class AutocompleteRequest(BaseModel):
+    host: str
+    port: int
+    database: str
+    username: str
+    password: str
+    schema_name: Optional[str] = None
+    text: str = ""  # What follows the @ so far: "ord" or "orders.cu"
+    limit: int = Field(AUTOCOMPLETE_LIMIT, ge=1, le=100)
 
 @app.post("/api/test-connection")
 async def test_connection(connection: DatabaseConnection):
     try:
-        print(f"\nTesting connection to: {connection.host}")
-        print(f"Port: {connection.port}")
-        print(f"Database: {connection.database}")
-        print(f"Username: {connection.username}")
+        logger.info("Testing connection to %s:%s/%s as %s",
+                    connection.host, connection.port, connection.database, connection.username)
         
-        if '.mysql.database.azure.com' in connection.host:
-            # Format username correctly for Azure
-            server_name = connection.host.split('.')[0]  # Gets server name from the host
-            full_username = f"{connection.username}"
-            
-            config = {
-                'host': connection.host,
-                'user': full_username,
-                'password': connection.password,
-                'database': connection.database,
-                'port': connection.port,
-                'ssl_ca': '/etc/ssl/certs/ca-certificates.crt',
-                'ssl_verify_cert': True
-            }
-            
-            print("\n=== MySQL Connection Config ===")
-            print({**config, 'password': '****'})
-            print("=======================\n")
-            
+        creds = DBCredentials.from_request(connection)
+        
+        if creds.type == MYSQL:
             try:
-                conn = mysql.connector.connect(**config)
-                conn.close()
+                # Opening a pooled connection warms the pool for the queries that follow
+                async with registry.acquire(creds):
+                    pass
                 return {"success": True, "message": "MySQL connection successful!"}
-            except mysql.connector.Error as mysql_error:
-                print(f"MySQL connection error: {str(mysql_error)}")
+            except driver(MYSQL).Error as mysql_error:
+                logger.warning("MySQL connection error: %s", mysql_error)
                 raise HTTPException(status_code=400, detail=f"MySQL connection error: {str(mysql_error)}")
         
-        elif '.postgres.database.azure.com' in connection.host or connection.port == 5432:
+        elif creds.type == POSTGRESQL:
             # PostgreSQL
             try:
-                print("\n=== PostgreSQL Connection Config ===")
-                print(f"Host: {connection.host}")
-                print(f"Port: {connection.port}")
-                print(f"Database: {connection.database}")
-                print(f"Username: {connection.username}")
-                print("=======================\n")
-                
-                conn = await asyncpg.connect(
-                    user=connection.username,
-                    password=connection.password,
-                    database=connection.database,
-                    host=connection.host,
-                    port=connection.port,
-                    ssl='require' if '.postgres.database.azure.com' in connection.host else None
-                )
-                await conn.close()
+                async with registry.acquire(creds):
+                    pass
                 return {"success": True, "message": "PostgreSQL connection successful!"}
-            except asyncpg.PostgresError as pg_error:
-                print(f"PostgreSQL connection error: {str(pg_error)}")
+            except driver(POSTGRESQL).PostgresError as pg_error:
+                logger.warning("PostgreSQL connection error: %s", pg_error)
                 raise HTTPException(status_code=400, detail=f"PostgreSQL connection error: {str(pg_error)}")
         
+        elif registry.supports(creds.type):
+            async with registry.acquire(creds):
+                pass
+            return {"success": True, "message": "Connection successful!"}
+        
         else:
-            error_msg = "Unsupported database type. Currently supporting PostgreSQL and MySQL."
-            print(error_msg)
+            error_msg = "Unsupported database type. Currently supporting PostgreSQL, MySQL, MotherDuck and ClickHouse."
+            logger.warning(error_msg)
             raise HTTPException(status_code=400, detail=error_msg)
 
+    except Overloaded:
+        raise
     except Exception as e:
         error_msg = f"Connection error: {str(e)}"
-        print(error_msg)
+        logger.warning(error_msg)
         raise HTTPException(status_code=400, detail=error_msg)
 
 # def open_connection():
 #     return psycopg2.connect(global_connstr)
 
+async def run_query(query_request: QueryRequest, request: Request, creds, query, read_only, timeout_ms, headers=None):
+    headers = headers or {}
+    if read_only:
+        # Identical read-only queries running at the same time share one execution and one rendered body
+        key = (creds.key, creds.secret, query, query_request.format, timeout_ms)
+
+        def render():
+            return query_flight.do(key, lambda: render_result(creds, query, query_request.format, timeout_ms))
+
+        if not query_request.cache:
+            body, media_type = await render()
+            return Response(content=body, media_type=media_type, headers=headers)
+        body, media_type, cached = await query_cache.fetch(
+            creds, query, query_request.format,
+            parse_cache_control(request.headers.get("cache-control")),
+            query_request.cache_ttl,
+            render
+        )
+        return Response(
+            content=mark_cached(body, media_type) if cached else body,
+            media_type=media_type,
+            headers={"X-Cache": "HIT" if cached else "MISS", **headers}
+        )
+    
+    if query_request.format == "columnar":
+        columns, values = await execute_and_describe(creds, query, columnar=True, timeout_ms=timeout_ms)
+        return Response(content=columnar_payload(query, columns, values), media_type="application/json",
+                        headers=headers)
+    
+    if query_request.format == "arrow":
+        return Response(content=await fetch_arrow_ipc(creds, query, timeout_ms), media_type=ARROW_MEDIA_TYPE,
+                        headers=headers)
+    
+    if creds.type == CLOUDFLARE:
+        # Cloudflare D1 results are passed through as returned by the API
+        formatted_result = await d1_query(creds, query, timeout_ms)
+
+    elif registry.supports(creds.type):
+        # One execution per query; column names come from the same cursor as the rows
+        columns, rows = await execute_and_describe(creds, query, timeout_ms=timeout_ms)
+        formatted_result = rows_payload(columns, rows)
+
+    else:
+        raise Exception("Unknown database type. Please check your connection settings.")
+
+    return {
+        "response": "Query executed successfully",
+        "sql": query,
+        "data": formatted_result
+    }
+
+
+def guard_response(verdict, **extra):
+    # 422 for a query the cost guard won't run, 409 for one that needs the user's go-ahead
+    if verdict.action == "confirm":
+        message = f"{verdict.reason}. Send it again with confirmed=true to run it anyway."
+    else:
+        message = f"Query not run: {verdict.reason}"
+    return JSONResponse(status_code=409 if verdict.action == "confirm" else 422, content={
+        "response": message,
+        "sql": verdict.sql,
+        "data": None,
+        "estimate": verdict.estimate.as_dict(),
+        "confirm": verdict.action == "confirm",
+        **extra,
+    })
+
+
 # session_started = False
 # Add this new endpoint
 @app.post("/api/v1/query")
-async def handle_query(query_request: QueryRequest):
+async def handle_query(query_request: QueryRequest, request: Request):
     try:
         query = query_request.query.strip()
 
         try:
-            result = None
-            
             # Determine database type from the connection string or configuration
-            if '.postgres.database.azure.com' in query_request.host or query_request.port == 5432:
-                # PostgreSQL
-                conn = await asyncpg.connect(
-                    user=query_request.username,
-                    password=query_request.password,
-                    database=query_request.database,
-                    host=query_request.host,
-                    port=query_request.port,
-                    ssl='require' if '.postgres.database.azure.com' in query_request.host else None
-                )
-                result = await conn.fetch(query)
-                await conn.close()
-                formatted_result = [dict(row) for row in result]
-
-            elif '.mysql.database.azure.com' in query_request.host or query_request.port == 3306:
-                # MySQL
-                config = {
-                    'host': query_request.host,
-                    'user': query_request.username,
-                    'password': query_request.password,
-                    'database': query_request.database,
-                    'port': query_request.port,
-                    # 'ssl_ca': '/etc/ssl/certs/ca-certificates.crt',  # Standard CA bundle location
-                    # 'ssl_verify_cert': True
-                }
-                
-                print("Connecting to MySQL with config:", {**config, 'password': '****'})  # Debug log
-                
-                conn = mysql.connector.connect(**config)
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute(query)
-                formatted_result = cursor.fetchall()
-                cursor.close()
-                conn.close()
-
-            elif 'motherduck' in query_request.host.lower():
-                # MotherDuck
-                conn_str = f"md:{query_request.database}?token={query_request.password}"  # Using password field for token
-                conn = duckdb.connect(conn_str)
-                result = conn.execute(query).fetchall()
-                columns = conn.execute(query).description
-                formatted_result = [
-                    dict(zip([col[0] for col in columns], row))
-                    for row in result
-                ]
-                conn.close()
-
-            elif 'clickhouse' in query_request.host.lower():
-                # ClickHouse
-                client = clickhouse_driver.Client(
-                    host=query_request.host,
-                    port=query_request.port,
-                    user=query_request.username,
-                    password=query_request.password,
-                    database=query_request.database,
-                    secure=True
+            creds = DBCredentials.from_request(query_request)
+            read_only = is_read_only(query)
+            if not read_only:
+                query_cache.invalidate(creds)
+                cost_guard.invalidate(creds)
+                schema_cache.invalidate(creds)
+            timeout_ms = effective_timeout_ms(query_request.timeout_ms)
+
+            guard_headers = {}
+            if read_only:
+                # EXPLAIN first: expensive plans are refused, limited or sent back for confirmation
+                verdict = await cost_guard.check(creds, query, query_request.cost_guard, query_request.confirmed)
+                if verdict.action in ("reject", "confirm"):
+                    return guard_response(verdict)
+                query = verdict.sql
+                if verdict.action == "limit":
+                    guard_headers["X-Cost-Guard"] = "limit"
+            
+            if query_request.stream:
+                # Reject before the 200 goes out if this connection's queue is already full
+                admission.check_database(creds)
+                # Rows are read through server-side cursors and written out batch by batch
+                if query_request.stream_format == "ndjson":
+                    return StreamingResponse(
+                        stream_ndjson(request, creds, query, query_request.batch_size, timeout_ms),
+                        media_type="application/x-ndjson", headers=guard_headers
+                    )
+                return StreamingResponse(
+                    stream_json(request, creds, query, query_request.batch_size, timeout_ms),
+                    media_type="application/json", headers=guard_headers
                 )
-                result = client.execute(query)
-                columns = client.execute(query, with_column_types=True)[1]
-                formatted_result = [
-                    dict(zip([col[0] for col in columns], row))
-                    for row in result
-                ]
-
-            elif 'cloudflare' in query_request.host.lower():
-                # Cloudflare D1
-                headers = {
-                    'Authorization': f'Bearer {query_request.password}',  # Using password field for API token
-                    'Content-Type': 'application/json'
-                }
-                url = f"https://api.cloudflare.com/client/v4/accounts/{query_request.username}/d1/database/{query_request.database}/query"  # Using username field for account_id
-                response = requests.post(url, headers=headers, json={"sql": query})
-                if response.status_code != 200:
-                    raise Exception(f"Cloudflare D1 error: {response.text}")
-                formatted_result = response.json()['result']
+            
+            # If the client goes away the statement is cancelled on the database too
+            return await cancel_on_disconnect(
+                request, run_query(query_request, request, creds, query, read_only, timeout_ms, guard_headers)
+            )
 
-            else:
-                raise Exception("Unknown database type. Please check your connection settings.")
+        except ClientDisconnected:
+            return Response(status_code=499)
 
-            return {
-                "response": "Query executed successfully",
-                "sql": query,
-                "data": formatted_result
-            }
+        except Overloaded as e:
+            return overloaded_response(e)
 
         except Exception as db_error:
-            print(f"Database error: {str(db_error)}")
+            logger.warning("Database error: %s", db_error)
             return {
                 "response": f"Database error: {str(db_error)}",
                 "sql": query,
@@ -273,465 +373,575 @@ async def handle_query(query_request: QueryRequest):
             }
 
     except Exception as e:
-        print(f"General error: {str(e)}")
+        logger.exception("General error in handle_query")
         return {
             "response": f"Error: {str(e)}",
             "sql": None,
             "data": None
         }
 
-# Add this new endpoint
-@app.post("/api/v1/chat")
-async def chat(request: ChatRequest):
-    try:
-        print("Starting chat endpoint...")
-        message = request.message.lower()
-        database_credentials = request.database_credentials
-        
-        # Extract table references and commands
-        references = []
-        commands = []
-        table_info = ""  # Initialize table_info variable
-        
-        # Split message into words
-        words = message.split()
+def parse_message(message):
+    references = []
+    commands = []
+    
+    for word in message.split():
+        # Handle table/column references
+        if word.startswith('@'):
+            ref = word[1:].rstrip('.,;:!?)')  # Remove @ symbol and trailing punctuation
+            if not ref:
+                continue
+            if '.' in ref:
+                # Handle @table.* or @table.column format
+                table, col = ref.split('.', 1)
+                references.append({
+                    'table': table,
+                    'column': col or '*'
+                })
+            else:
+                # Handle @table format
+                references.append({
+                    'table': ref,
+                    'column': '*'
+                })
         
-        for word in words:
-            # Handle table/column references
-            if word.startswith('@'):
-                ref = word[1:]  # Remove @ symbol
-                if '.' in ref:
-                    # Handle @table.* or @table.column format
-                    table, col = ref.split('.')
-                    references.append({
-                        'table': table,
-                        'column': '*' if col == '*' else col
-                    })
+        # Handle commands
+        elif word.startswith('/'):
+            commands.append(word[1:])  # Remove / symbol
+    
+    return references, commands
+
+
+def referenced_columns(references):
+    # table -> set of referenced columns, or None when the whole table is wanted
+    wanted = {}
+    for reference in references:
+        table = reference['table'].lower()
+        column = reference['column'].lower()
+        if column == '*' or wanted.get(table, set()) is None:
+            wanted[table] = None
+        else:
+            wanted.setdefault(table, set()).add(column)
+    return wanted
+
+
+def describe_tables(tables, wanted, keys=None):
+    selected_tables = {}
+    for table_name, columns in tables.items():
+        selected = wanted.get(table_name.lower())
+        if selected is not None:
+            # @table.column references narrow the prompt to those columns
+            columns = [column for column in columns if column[0].lower() in selected]
+        if columns:
+            selected_tables[table_name] = columns
+    # SCHEMA_PROMPT_FORMAT picks prose, ddl or compact; see schema_encoder.py
+    table_info = encode_schema(selected_tables, keys=keys)
+    if table_info and logger.isEnabledFor(logging.DEBUG):
+        # Counting tokens is real work; only pay for it when the line is logged
+        logger.debug("Schema tokens: %d (%s format)", count_tokens(table_info, CHAT_MODEL), SCHEMA_PROMPT_FORMAT)
+    return table_info
+
+
+CHAT_MODEL = "gpt-4o-mini"
+prompt_assembler = PromptAssembler(CHAT_MODEL)
+EMPTY_CHAT_RESPONSE = "Please rephrase your query to make it more specific and relevant to the database!"
+
+
+def get_openai_api_key():
+    # Read once at startup (settings.py), not per request
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+    return OPENAI_API_KEY
+
+
+async def build_chat_messages(request: ChatRequest, instruction=None):
+    message = request.message.lower()
+    database_credentials = request.database_credentials
+    
+    # Extract table references and commands
+    references, commands = parse_message(message)
+    
+    logger.debug("References: %s, commands: %s", references, commands)
+    
+    natural_language_query = request.message
+    chat_history = request.history
+    
+    if database_credentials:
+        DB_NAME = database_credentials.get('type') or DBCredentials.from_request(database_credentials).type
+    else:
+        DB_NAME = "PostgreSQL"  # default database
+
+    metadata_description = "No metadata available"  # Default value
+    if references and database_credentials:
+        # Fetch table information if we have references and credentials
+        try:
+            creds = DBCredentials.from_request(database_credentials)
+            if supports_metadata(creds.type):
+                wanted = referenced_columns(references)
+                schema = schema_cache.peek(creds)
+                if schema is not None:
+                    schema.record_usage(references)
+                    tables = {}
+                    for table in wanted:
+                        table_name, columns = schema.table(table)
+                        if table_name is not None:
+                            tables[table_name] = columns
+                    keys = schema.keys
                 else:
-                    # Handle @table format
-                    references.append({
-                        'table': ref,
-                        'column': '*'
-                    })
+                    # Cold cache: read just the referenced tables (columns and keys together)
+                    # and load the full schema in the background for the next turn
+                    tables, keys = await fetch_table_columns(creds, wanted)
+                    schema_cache.warm(creds)
+                table_info = describe_tables(tables, wanted, keys)
+                metadata_description = table_info if table_info else metadata_description
             
-            # Handle commands
-            elif word.startswith('/'):
-                commands.append(word[1:])  # Remove / symbol
-        
-        print("References:", references)
-        print("Commands:", commands)
-        print("DATABASE CREDENTIALS:", database_credentials)
-        print("------------PROMPT------------")
-        
-        # Load OpenAI API key
-        load_dotenv()
-        api_key = os.getenv("OPENAI_APIKEY")
-        # print(f"API Key loaded: {'Yes' if api_key else 'No'}")
-        # print(f"API Key length: {len(api_key) if api_key else 'None'}")
-        
-        if not api_key:
-            raise HTTPException(status_code=500, detail="OpenAI API key not configured")
-        
-        natural_language_query = request.message
-        chat_history = request.history
-        
+        except Overloaded:
+            raise
+        except Exception as db_error:
+            logger.warning("Error fetching table metadata: %s", db_error)
+            # Continue with default metadata description
+    elif database_credentials:
+        # No @references: pick the tables that best match the question from the cached schema
         try:
-            # print("Initializing OpenAI client...")
-            openai.api_key = api_key
-            print("OpenAI client initialized successfully")
-            
-            if database_credentials:
-                DB_NAME = database_credentials.get('type')
-            else:
-                DB_NAME = "PostgreSQL"  # default database
+            creds = DBCredentials.from_request(database_credentials)
+            if supports_metadata(creds.type):
+                schema = await schema_cache.get(creds)
+                tables = await schema.relevant_tables(natural_language_query)
+                logger.debug("Retrieved tables: %s", list(tables))
+                table_info = describe_tables(tables, {}, schema.keys)
+                metadata_description = table_info if table_info else metadata_description
+        except Overloaded:
+            raise
+        except Exception as db_error:
+            logger.warning("Error retrieving relevant tables: %s", db_error)
 
-            metadata_description = "No metadata available"  # Default value
-            if references and database_credentials:
-                # Fetch table information if we have references and credentials
-                try:
-                    if database_credentials.get('type') == 'postgresql' or '.postgres.database.azure.com' in database_credentials.get('host', ''):
-                        print("Connecting to POSTGRESQL...")
-                        conn = await asyncpg.connect(
-                            user=database_credentials['username'],
-                            password=database_credentials['password'],
-                            database=database_credentials['database'],
-                            host=database_credentials['host'],
-                            port=database_credentials['port'],
-                            ssl='require' if '.postgres.database.azure.com' in database_credentials['host'] else None
-                        )
-                        for reference in references:
-                            table_name = reference['table']
-                            columns = await conn.fetch("""
-                                SELECT column_name, data_type
-                                FROM information_schema.columns
-                                WHERE table_schema = 'public' AND table_name = $1
-                            """, table_name)
-                            
-                            table_info += f"Table '{table_name}' has the following columns:\n"
-                            for record in columns:
-                                table_info += f"- {record['column_name']} ({record['data_type']})\n"
-                            table_info += "\n"
-                        await conn.close()
-                        metadata_description = table_info if table_info else metadata_description
-                    
-                    elif database_credentials.get('type') == 'mysql' or '.mysql.database.azure.com' in database_credentials.get('host', ''):
-                        print("Connecting to MYSQL...")
-                        conn = mysql.connector.connect(
-                            host=database_credentials['host'],
-                            user=database_credentials['username'],
-                            password=database_credentials['password'],
-                            database=database_credentials['database'],
-                            port=database_credentials['port'],
-                            # ssl_ca='/etc/ssl/certs/ca-certificates.crt',
-                            # ssl_verify_cert=True
-                        )
-                        cursor = conn.cursor()
-                        # print("MySQL))))))")
-                        for reference in references:
-                            table_name = reference['table']
-                            cursor.execute("""
-                                SELECT COLUMN_NAME, DATA_TYPE
-                                FROM INFORMATION_SCHEMA.COLUMNS
-                                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s
-                            """, (database_credentials['database'], table_name))
-                        
-                            columns = cursor.fetchall()
-                            table_info += f"Table '{table_name}' has the following columns:\n"
-                            for col_name, data_type in columns:
-                                table_info += f"- {col_name} ({data_type})\n"
-                            table_info += "\n\n"
-                        
-                        cursor.close()
-                        conn.close()
-                        metadata_description = table_info if table_info else metadata_description
-                        # print("MySQL))))))")
-                        # return {"response": table_info}
-                    
-                except Exception as db_error:
-                    print(f"Error fetching table metadata: {str(db_error)}")
-                    # Continue with default metadata description
-            # print("METADATA DESCRIPTION:", metadata_description)
-            
-            prompt2 = f"""You are a helpful {DB_NAME} database agent that takes queries in natural language and converts it into a {DB_NAME} query. The database metadata is as follows- {metadata_description}.
+    prompt2 = f"""You are a helpful {DB_NAME} database agent that takes queries in natural language and converts it into a {DB_NAME} query. The database metadata is as follows- {metadata_description}.
                 You must interact with the user as a database ai agent and convert the relevant user queries to {DB_NAME} query."""
-            task2 = f"User: {natural_language_query}"
-            
-            print("Prompt:", prompt2+task2)
-            print("--------------INSIDE------------------")
-            
-            messages = [
-                {"role": "system", "content": prompt2}
-            ]
-            
-            # Convert Message objects to dictionaries
-            formatted_history = []
-            for msg in chat_history:
-                if isinstance(msg, Message):
-                    formatted_history.append({"role": msg.role, "content": msg.content})
-                elif isinstance(msg, dict):
-                    formatted_history.append(msg)
-            
-            formatted_history.append({"role": "user", "content": task2})
-            if formatted_history:
-                messages.extend(formatted_history)
+    if instruction:
+        prompt2 += "\n" + instruction.format(dialect=DB_NAME)
+    task2 = f"User: {natural_language_query}"
+    
+    logger.debug("Prompt: %s%s", prompt2, task2)
+    
+    # Convert Message objects to dictionaries
+    formatted_history = []
+    for msg in chat_history:
+        if isinstance(msg, Message):
+            formatted_history.append({"role": msg.role, "content": msg.content})
+        elif isinstance(msg, dict):
+            formatted_history.append(msg)
+    
+    # System prompt and recent turns verbatim, older turns summarized, within the token budget
+    messages, prompt_tokens = prompt_assembler.assemble(prompt2, formatted_history, task2)
+    logger.debug("Prompt tokens: %d (%d history messages)", prompt_tokens, len(formatted_history))
+    
+    # Same question, same referenced schema, same dialect, model and recent history -> same answer
+    key = cache_key(natural_language_query, metadata_description, DB_NAME, CHAT_MODEL, formatted_history, instruction)
+    return messages, key, prompt_tokens
 
-            print("Making OpenAI API call...")
-            try:
-                client = OpenAI(api_key=api_key)
-                completion = client.chat.completions.create(
-                    model="gpt-4o-mini",  # Changed from gpt-4o-mini to gpt-3.5-turbo (NO NEED TO CHANGE)
+
+async def complete_chat(api_key, messages, key):
+    # The same question asked by several users at once is sent to OpenAI once
+    client = get_openai_client(api_key)
+
+    async def complete():
+        async with admission.llm.slot():
+            with stage("llm"):
+                completion = await client.chat.completions.create(
+                    model=CHAT_MODEL,
                     messages=messages,
                     temperature=0
                 )
-                print("OpenAI API call successful")
-                openai_response = completion.choices[0].message.content.strip()
-                print("ASSISTANT RESPONSE:")
-                print(openai_response)
-                chat_history.append({"role": "assistant", "content": openai_response})
-                
-                if openai_response != "":
-                    return {"response": openai_response}
-                else:
-                    return {"response": "Please rephrase your query to make it more specific and relevant to the database!"}
-                    
-            except Exception as api_error:
-                print(f"OpenAI API error details: {str(api_error)}")
-                raise HTTPException(status_code=500, detail=f"Error with OpenAI API: {str(api_error)}")
+        return completion.choices[0].message.content.strip()
+
+    response = await llm_flight.do(key, complete)
+    if response != "":
+        await llm_cache.put(key, response)
+    return response
+
+
+# Add this new endpoint
+@app.post("/api/v1/chat")
+async def chat(request: ChatRequest):
+    try:
+        api_key = get_openai_api_key()
+        with stage("prompt"):
+            messages, key, prompt_tokens = await build_chat_messages(request)
+        
+        if not request.bypass_cache:
+            cached = await llm_cache.get(key)
+            if cached is not None:
+                logger.debug("Answer served from cache")
+                return {"response": cached, "cached": True}
+
+        try:
+            openai_response = await complete_chat(api_key, messages, key)
+            logger.debug("Assistant response: %s", openai_response)
+            
+            if openai_response != "":
+                return {"response": openai_response, "prompt_tokens": prompt_tokens}
+            else:
+                return {"response": EMPTY_CHAT_RESPONSE, "prompt_tokens": prompt_tokens}
                 
-        except Exception as client_error:
-            print(f"Error initializing OpenAI client: {str(client_error)}")
-            raise HTTPException(status_code=500, detail=f"Error initializing OpenAI client: {str(client_error)}")
+        except Overloaded:
+            raise
+        except Exception as api_error:
+            logger.error("OpenAI API error: %s", api_error)
+            raise HTTPException(status_code=500, detail=f"Error with OpenAI API: {str(api_error)}")
             
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"General error in chat endpoint: {str(e)}")
+        logger.exception("General error in chat endpoint")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def generate_chat_title(messages):
-    if not messages:
-        return "New Chat"
-    
-    # Get the first user message
-    first_message = None
-    for msg in messages:
-        if isinstance(msg, dict) and msg.get("role") == "user" and msg.get("content"):
-            first_message = msg["content"]
-            break
-    
-    if not first_message:
-        return "New Chat"
-    
-    # Generate title from the first message
-    title = first_message.strip()
-    # Truncate to first 30 characters and add ellipsis if longer
-    if len(title) > 30:
-        title = title[:27] + "..."
-    return title
+@app.post("/api/v1/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    # Same prompt as /api/v1/chat, but tokens are forwarded as Server-Sent Events as they arrive
+    try:
+        api_key = get_openai_api_key()
+        with stage("prompt"):
+            messages, key, prompt_tokens = await build_chat_messages(request)
+        cached = None if request.bypass_cache else await llm_cache.get(key)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("General error in chat stream endpoint")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if cached is not None:
+        logger.debug("Answer served from cache")
+        return StreamingResponse(
+            stream_cached_answer(cached),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    async def remember(response):
+        await llm_cache.put(key, response)
+
+    admission.llm.check()
+
+    return StreamingResponse(
+        stream_chat_completion(http_request, get_openai_client(api_key), CHAT_MODEL, messages,
+                               EMPTY_CHAT_RESPONSE, on_complete=remember),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Prompt-Tokens": str(prompt_tokens)}
+    )
+
+
+@app.post("/api/v1/ask")
+async def ask(request: AskRequest, http_request: Request):
+    # Question in, rows out: generate the SQL, check it, then run it on a pooled connection
+    pipeline_started = time.perf_counter()
+    timings = {}
+    try:
+        api_key = get_openai_api_key()
+        creds = DBCredentials.from_request(request.database_credentials)
+        with timed(timings, "prompt"):
+            messages, key, prompt_tokens = await build_chat_messages(request, ASK_INSTRUCTION)
+
+        with timed(timings, "generate"):
+            completion = None if request.bypass_cache else await llm_cache.get(key)
+            cached = completion is not None
+            if not cached:
+                try:
+                    completion = await complete_chat(api_key, messages, key)
+                except Overloaded:
+                    raise
+                except Exception as api_error:
+                    logger.error("OpenAI API error: %s", api_error)
+                    raise HTTPException(status_code=500, detail=f"Error with OpenAI API: {str(api_error)}")
+
+        with timed(timings, "extract"):
+            sql = extract_sql(completion)
+        with timed(timings, "validate"):
+            problem = check_sql(sql)
+        if problem:
+            # Nothing is run; the client can show the answer and let the user run the SQL via /api/v1/query
+            return JSONResponse(status_code=422, content={
+                "detail": problem, "sql": sql, "response": completion or EMPTY_CHAT_RESPONSE, "timings": timings
+            })
+
+        with timed(timings, "guard"):
+            verdict = await cost_guard.check(creds, sql, request.cost_guard, request.confirmed)
+        if verdict.action in ("reject", "confirm"):
+            return guard_response(verdict, detail=verdict.reason, timings=timings)
+        sql = verdict.sql
+
+        # Reject before the 200 goes out if this connection's queue is already full
+        admission.check_database(creds)
+        timeout_ms = effective_timeout_ms(request.timeout_ms)
+    except (HTTPException, Overloaded):
+        raise
+    except Exception as e:
+        logger.exception("General error in ask endpoint")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return StreamingResponse(
+        stream_ask(http_request, creds, sql, timings, pipeline_started, cached, request.batch_size, timeout_ms),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Prompt-Tokens": str(prompt_tokens)}
+    )
+
+
+def chat_cursor(chat):
+    # "<createdAt>|<id>": ids never contain "|"
+    return f"{chat['createdAt']}|{chat['id']}"
 
 
 @app.get("/api/v1/chats")
-async def get_chat_history():
+async def get_chat_history(limit: Optional[int] = None, cursor: Optional[str] = None, before: Optional[str] = None,
+                           view: Literal["full", "list"] = "full"):
+    # Newest first; a full page carries X-Next-Cursor, pass it back as `cursor` for the next one
+    # (`before`, a bare createdAt, is still accepted). view=list returns only id/title/createdAt,
+    # messages are then loaded per chat.
+    if cursor is not None:
+        created_at, separator, chat_id = cursor.rpartition("|")
+        if not separator:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        before = (created_at, chat_id)
     try:
-        # Create chats directory if it doesn't exist
-        chats_dir = "chats"
-        os.makedirs(chats_dir, exist_ok=True)
-
-        # Read all chat files
-        chat_files = []
-        if os.path.exists(chats_dir):
-            chat_files = [f for f in os.listdir(chats_dir) if f.endswith(".json")]
-        
-        chats = []
-        for file in chat_files:
-            try:
-                with open(f"{chats_dir}/{file}", "r") as f:
-                    data = json.load(f)
-                    
-                    # Handle case where file contains a list
-                    if isinstance(data, list):
-                        chat = {
-                            "id": file.replace(".json", ""),
-                            "messages": [],
-                            "createdAt": datetime.now().isoformat(),
-                            "title": "New Chat"
-                        }
-                        # Convert list items to messages if possible
-                        for item in data:
-                            if isinstance(item, dict) and "content" in item:
-                                chat["messages"].append({
-                                    "role": item.get("role", "user"),
-                                    "content": item["content"]
-                                })
-                            elif isinstance(item, str):
-                                chat["messages"].append({
-                                    "role": "user",
-                                    "content": item
-                                })
-                    else:
-                        chat = data if isinstance(data, dict) else {}
-                    
-                    # Format messages
-                    messages = chat.get("messages", [])
-                    formatted_messages = []
-                    if isinstance(messages, list):
-                        for msg in messages:
-                            if isinstance(msg, dict):
-                                formatted_messages.append({
-                                    "role": msg.get("role", "user"),
-                                    "content": msg.get("content", "")
-                                })
-                            elif isinstance(msg, str):
-                                formatted_messages.append({
-                                    "role": "user",
-                                    "content": msg
-                                })
-                    
-                    # Create properly formatted chat object with generated title
-                    formatted_chat = {
-                        "id": chat.get("id", file.replace(".json", "")),
-                        "messages": formatted_messages,
-                        "createdAt": chat.get("createdAt", datetime.now().isoformat()),
-                        "title": chat.get("title") or generate_chat_title(formatted_messages)
-                    }
-                    
-                    chats.append(formatted_chat)
-                    
-                    # Update the file with the fixed structure
-                    with open(f"{chats_dir}/{file}", "w") as f:
-                        json.dump(formatted_chat, f, indent=2)
-                        
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"Error reading chat file {file}: {str(e)}")
-                continue
-        
-        # Sort chats by createdAt in descending order
-        try:
-            chats.sort(key=lambda x: x["createdAt"], reverse=True)
-        except Exception as e:
-            print(f"Error sorting chats: {str(e)}")
-            return chats
-            
-        return chats
+        chats = await run_blocking(
+            "sqlite", chat_store.list_chats,
+            limit=limit, before=before, include_messages=(view == "full")
+        )
+        headers = {"X-Next-Cursor": chat_cursor(chats[-1])} if limit and len(chats) == limit else {}
+        return JSONResponse(chats, headers=headers)
     except Exception as e:
-        print(f"Error in get_chat_history: {str(e)}")
+        logger.exception("Error in get_chat_history")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/v1/chats")
 async def save_chat(chat: ChatSession):
     try:
-        # Create chats directory if it doesn't exist
-        chats_dir = "chats"
-        os.makedirs(chats_dir, exist_ok=True)
+        messages = [{"role": msg.role, "content": msg.content} for msg in chat.messages]
         
         # Generate title if not provided
-        title = chat.title or generate_chat_title(chat.messages)
+        title = chat.title or generate_chat_title(messages)
         
         # Ensure the chat data is properly formatted
         chat_data = {
             "id": chat.id,
-            "messages": [{"role": msg.role, "content": msg.content} for msg in chat.messages],
+            "messages": messages,
             "createdAt": chat.createdAt,
             "title": title
         }
         
-        # Save chat to a file
-        with open(f"{chats_dir}/{chat.id}.json", "w") as f:
-            json.dump(chat_data, f, indent=2)
+        await run_blocking("sqlite", chat_store.save_chat, chat_data)
         
         return {"message": "Chat saved successfully"}
     except Exception as e:
-        print(f"Error in save_chat: {str(e)}")
+        logger.exception("Error in save_chat")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/v1/chats/{chat_id}/messages")
+async def append_chat_messages(chat_id: str, request: AppendMessagesRequest):
+    # Send only the new turn(s); the stored conversation is never rewritten
+    try:
+        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        count = await run_blocking(
+            "sqlite", chat_store.append_messages,
+            chat_id, messages, request.createdAt, request.title
+        )
+        return {"message": "Messages appended successfully", "message_count": count}
+    except Exception as e:
+        logger.exception("Error in append_chat_messages")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/v1/chats/{chat_id}")
-async def get_chat(chat_id: str):
+async def get_chat(chat_id: str, include_messages: bool = True):
     try:
-        # Check if chat file exists
-        chat_path = f"chats/{chat_id}.json"
-        if not os.path.exists(chat_path):
+        chat = await run_blocking("sqlite", chat_store.get_chat, chat_id, include_messages)
+        if chat is None:
             raise HTTPException(status_code=404, detail="Chat not found")
-        
-        # Read chat from file
-        try:
-            with open(chat_path, "r") as f:
-                chat = json.load(f)
-            return chat
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Error reading chat file {chat_id}: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error reading chat: {str(e)}")
+        return chat
             
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Error in get_chat: {str(e)}")
+        logger.exception("Error in get_chat")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.delete("/api/v1/chats/{chat_id}")
 async def delete_chat(chat_id: str):
     try:
-        # Check if chat file exists
-        chat_path = f"chats/{chat_id}.json"
-        if not os.path.exists(chat_path):
+        deleted = await run_blocking("sqlite", chat_store.delete_chat, chat_id)
+        if not deleted:
             raise HTTPException(status_code=404, detail="Chat not found")
-        
-        # Delete chat file
-        try:
-            os.remove(chat_path)
-            return {"message": "Chat deleted successfully"}
-        except IOError as e:
-            print(f"Error deleting chat file {chat_id}: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error deleting chat: {str(e)}")
+        return {"message": "Chat deleted successfully"}
             
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Error in delete_chat: {str(e)}")
+        logger.exception("Error in delete_chat")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def metadata_etag(digest, request: DatabaseMetadataRequest):
+    # One tag per catalog version and response shape
+    shape = json.dumps([request.schema_name, request.view, sorted(request.tables or []),
+                        request.page_size, request.cursor, request.stream])
+    return f'"{digest}-{hashlib.sha256(shape.encode()).hexdigest()[:8]}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def table_summary(name, columns):
+    return {"name": name, "column_count": len(columns)}
+
+
+async def stream_metadata(schema, names, next_cursor, names_only, batch=200):
+    # One JSON line per table, so the schema tree can render while the rest arrives,
+    # then a {"total", "next_cursor"} line
+    for start in range(0, len(names), batch):
+        lines = []
+        for name in names[start:start + batch]:
+            columns = schema.metadata[name]
+            line = table_summary(name, columns) if names_only else {"name": name, "columns": columns}
+            lines.append(json.dumps(line, separators=(",", ":")) + "\n")
+        yield "".join(lines)
+    yield json.dumps({"total": len(schema.metadata), "next_cursor": next_cursor}) + "\n"
+
+
 @app.post("/api/v1/metadata")
-async def get_metadata(request: DatabaseMetadataRequest):
+async def get_metadata(request: DatabaseMetadataRequest, http_request: Request):
+    # Without options this returns {table: columns} for the connection's schema, as before
     try:
-        # Determine database type and establish connection
-        if '.postgres.database.azure.com' in request.host or request.port == 5432:
-            # PostgreSQL connection
-            conn = psycopg2.connect(
-                host=request.host,
-                user=request.username,
-                password=request.password,
-                database=request.database,
-                port=request.port,
-                sslmode='require' if '.postgres.database.azure.com' in request.host else None
+        creds = DBCredentials.from_request(request)
+        if not supports_metadata(creds.type):
+            raise HTTPException(
+                status_code=400,
+                detail="Unsupported database type. Currently supporting PostgreSQL, MySQL, MotherDuck and ClickHouse."
             )
-            
-            # Query to fetch table and column information
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT 
-                    table_name,
-                    array_agg(ARRAY[column_name, data_type]) as columns
-                FROM information_schema.columns 
-                WHERE table_schema = 'public'
-                GROUP BY table_name;
-            """)
-            
-            # Format the results
-            metadata = {}
-            for table_name, columns in cursor.fetchall():
-                metadata[table_name] = columns
-            
-            cursor.close()
-            conn.close()
-            
-            return metadata
-
-        elif '.mysql.database.azure.com' in request.host or request.port == 3306:
-            # MySQL connection
-            conn = mysql.connector.connect(
-                host=request.host,
-                user=request.username,
-                password=request.password,
-                database=request.database,
-                port=request.port,
-                ssl_disabled=True
+        
+        if request.view == "schemas":
+            return {"schemas": await list_schemas(creds)}
+
+        if request.tables is not None and schema_cache.peek(creds, request.schema_name) is None:
+            # Cold cache: read just these tables' columns and load the full schema in the background.
+            # There's no catalog digest yet, so no ETag either
+            tables, _ = await fetch_table_columns(creds, request.tables, request.schema_name)
+            schema_cache.warm(creds, request.schema_name)
+            return tables
+
+        schema = await schema_cache.get(creds, request.schema_name)
+        body, digest = await schema.serialized()
+        etag = metadata_etag(digest, request)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(http_request.headers.get("if-none-match"), etag):
+            # Catalog unchanged since the client's copy: nothing to serialize or send
+            return Response(status_code=304, headers=headers)
+
+        if request.tables is not None:
+            tables = {}
+            for table in request.tables:
+                table_name, columns = schema.table(table)
+                if table_name is not None:
+                    tables[table_name] = columns
+            return JSONResponse(tables, headers=headers)
+
+        names_only = request.view == "tables"
+        if request.stream:
+            names, next_cursor = schema.page(request.cursor, request.page_size)
+            return StreamingResponse(stream_metadata(schema, names, next_cursor, names_only),
+                                     media_type="application/x-ndjson", headers=headers)
+
+        if not names_only and request.page_size is None and request.cursor is None:
+            # Serialized once per catalog load and reused
+            return Response(content=body, media_type="application/json", headers=headers)
+
+        names, next_cursor = schema.page(request.cursor, request.page_size)
+        tables = schema.metadata
+        return JSONResponse({
+            "total": len(tables),
+            "next_cursor": next_cursor,
+            "tables": [table_summary(name, tables[name]) for name in names] if names_only
+                      else {name: tables[name] for name in names},
+        }, headers=headers)
+
+    except (HTTPException, Overloaded):
+        raise
+    except Exception as e:
+        logger.exception("Error fetching metadata")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/v1/autocomplete")
+async def autocomplete(request: AutocompleteRequest):
+    # Called on every keystroke, so it only answers from the schema cache
+    try:
+        creds = DBCredentials.from_request(request)
+        if not supports_metadata(creds.type):
+            raise HTTPException(
+                status_code=400,
+                detail="Unsupported database type. Currently supporting PostgreSQL, MySQL, MotherDuck and ClickHouse."
             )
-            
-            cursor = conn.cursor()
-            
-            # Get all tables
-            cursor.execute("""
-                SELECT 
-                    TABLE_NAME,
-                    GROUP_CONCAT(CONCAT(COLUMN_NAME, ',', DATA_TYPE) SEPARATOR ';') as columns
-                FROM information_schema.columns 
-                WHERE table_schema = %s
-                GROUP BY TABLE_NAME;
-            """, (request.database,))
-            
-            # Format the results
-            metadata = {}
-            for table_name, columns_str in cursor.fetchall():
-                if columns_str:
-                    columns = []
-                    for col in columns_str.split(';'):
-                        name, type_ = col.split(',')
-                        columns.append([name, type_])
-                    metadata[table_name] = columns
-            
-            cursor.close()
-            conn.close()
-            
-            return metadata
 
-        else:
+        if schema_cache.peek(creds, request.schema_name) is None:
+            # Cold cache: load it in the background rather than make the user wait on catalog queries
+            schema_cache.warm(creds, request.schema_name)
+            return {"suggestions": [], "loading": True}
+
+        schema = await schema_cache.get(creds, request.schema_name)
+        return {"suggestions": await schema.complete(request.text, request.limit), "loading": False}
+
+    except (HTTPException, Overloaded):
+        raise
+    except Exception as e:
+        logger.exception("Error completing references")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/v1/metadata/refresh")
+async def refresh_metadata(request: DatabaseMetadataRequest):
+    try:
+        creds = DBCredentials.from_request(request)
+        if not supports_metadata(creds.type):
             raise HTTPException(
                 status_code=400,
-                detail="Unsupported database type. Currently supporting PostgreSQL and MySQL."
+                detail="Unsupported database type. Currently supporting PostgreSQL, MySQL, MotherDuck and ClickHouse."
             )
+        
+        # Drop the cached schema and read the catalog again
+        schema = await schema_cache.refresh(creds, request.schema_name)
+        return {
+            "message": "Metadata refreshed successfully",
+            "fingerprint": schema.fingerprint,
+            "tables": len(schema.metadata)
+        }
 
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
-        print(f"Error fetching metadata: {str(e)}")
+        logger.exception("Error refreshing metadata")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/cache/stats")
+async def cache_stats():
+    return {
+        "llm": llm_cache.stats(),
+        "schema": schema_cache.stats(),
+        "query": query_cache.stats(),
+        "pools": registry.stats(),
+        "admission": admission.stats(),
+        "single_flight": single_flight.stats(),
+        "cost_guard": cost_guard.stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus exposition: per-stage and per-route latency histograms
+    body, content_type = metrics_response()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,497 @@
+import asyncio
+import hashlib
+import importlib
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from executor import run_blocking
+from instrumentation import stage
+from admission import admission
+
+logger = logging.getLogger(__name__)
+
+POSTGRESQL = "postgresql"
+MYSQL = "mysql"
+MOTHERDUCK = "motherduck"
+CLICKHOUSE = "clickhouse"
+CLOUDFLARE = "cloudflare"
+
+# Pool sizing defaults, overridable through the environment
+POOL_MIN_SIZE = int(os.getenv("POOL_MIN_SIZE", 1))
+POOL_MAX_SIZE = int(os.getenv("POOL_MAX_SIZE", 10))
+POOL_MAX_TOTAL = int(os.getenv("POOL_MAX_TOTAL", 100))                        # Cap on open connections across every pool
+POOL_IDLE_TIMEOUT = float(os.getenv("POOL_IDLE_TIMEOUT", 300))                # Seconds before an idle connection above min_size is closed
+POOL_EXPIRE_AFTER = float(os.getenv("POOL_EXPIRE_AFTER", 900))                # Seconds before an unused pool is closed entirely
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("POOL_HEALTH_CHECK_AFTER", 30))     # Seconds idle before a connection is pinged on checkout
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("POOL_ACQUIRE_TIMEOUT", 30))           # Seconds to wait for a free connection
+
+# Driver module per backend, imported on first use so startup doesn't pay for drivers nobody connects with
+_DRIVER_MODULES = {
+    POSTGRESQL: "asyncpg",
+    MYSQL: "mysql.connector",
+    MOTHERDUCK: "duckdb",
+    CLICKHOUSE: "clickhouse_driver",
+}
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionBroken(Exception):
+    # Raised by a borrower whose connection must not go back to the pool (e.g. a driver call still running on it)
+    pass
+
+
+def driver(db_type):
+    """The driver module for `db_type`, imported on first call (later calls hit sys.modules)."""
+    return importlib.import_module(_DRIVER_MODULES[db_type])
+
+
+def resolve_db_type(host, port, declared=None):
+    # Prefer the type the client told us about, fall back to host/port heuristics
+    if declared:
+        return declared.lower()
+    host = (host or "").lower()
+    if '.postgres.database.azure.com' in host or port == 5432:
+        return POSTGRESQL
+    if '.mysql.database.azure.com' in host or port == 3306:
+        return MYSQL
+    if 'motherduck' in host:
+        return MOTHERDUCK
+    if 'clickhouse' in host:
+        return CLICKHOUSE
+    if 'cloudflare' in host:
+        return CLOUDFLARE
+    return None
+
+
+@dataclass(frozen=True)
+class DBCredentials:
+    type: str
+    host: str
+    port: int
+    database: str
+    username: str
+    password: str
+
+    @classmethod
+    def from_request(cls, request):
+        # Accepts any of the request models or the chat `database_credentials` dict
+        data = request if isinstance(request, dict) else request.model_dump()
+        host = data.get('host', '')
+        port = data.get('port')
+        return cls(
+            type=resolve_db_type(host, port, data.get('type')),
+            host=host,
+            port=int(port) if port is not None else None,
+            database=data.get('database'),
+            username=data.get('username'),
+            password=data.get('password'),
+        )
+
+    @property
+    def key(self):
+        identity = f"{self.type}|{self.host}|{self.port}|{self.database}|{self.username}"
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    @property
+    def secret(self):
+        return hashlib.sha256((self.password or "").encode()).hexdigest()
+
+
+class _AsyncpgPool:
+    def __init__(self, creds, min_size, max_size, idle_timeout):
+        self.creds = creds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self._pool = None
+        self._checked = {}
+
+    async def open(self):
+        host = self.creds.host
+        self._pool = await driver(POSTGRESQL).create_pool(
+            user=self.creds.username,
+            password=self.creds.password,
+            database=self.creds.database,
+            host=host,
+            port=self.creds.port,
+            ssl='require' if '.postgres.database.azure.com' in host else None,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            max_inactive_connection_lifetime=self.idle_timeout,
+        )
+
+    def size(self):
+        return self._pool.get_size() if self._pool else 0
+
+    def idle(self):
+        return self._pool.get_idle_size() if self._pool else 0
+
+    async def acquire(self, timeout, health_check_after):
+        conn = await self._pool.acquire(timeout=timeout)
+        last_checked = self._checked.get(conn.get_server_pid(), 0)
+        if conn.is_closed() or time.monotonic() - last_checked > health_check_after:
+            try:
+                await conn.execute("SELECT 1")
+            except Exception:
+                # Dead connection, drop it and let the pool open a fresh one
+                conn.terminate()
+                await self._pool.release(conn)
+                conn = await self._pool.acquire(timeout=timeout)
+        self._checked[conn.get_server_pid()] = time.monotonic()
+        return conn
+
+    async def release(self, conn, broken=False):
+        if broken:
+            conn.terminate()
+        await self._pool.release(conn)
+
+    async def reap(self, now):
+        # asyncpg already closes connections idle longer than max_inactive_connection_lifetime,
+        # only forget the health check timestamps of those connections
+        self._checked = {
+            pid: checked for pid, checked in self._checked.items()
+            if now - checked <= self.idle_timeout
+        }
+
+    async def close(self):
+        if self._pool:
+            await self._pool.close()
+        self._checked.clear()
+
+
+class _BlockingPool:
+    # Minimal pool for drivers without a usable async pool (MySQL, ClickHouse, MotherDuck)
+    def __init__(self, creds, min_size, max_size, idle_timeout, connect, ping, close, reset=None):
+        self.creds = creds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self._connect = connect
+        self._ping = ping
+        self._close = close
+        self._reset = reset
+        self._idle = deque()  # (conn, last_used)
+        self._open = 0
+        self._slots = asyncio.Semaphore(max_size)
+        self._closed = False
+
+    async def open(self):
+        return None
+
+    def size(self):
+        return self._open
+
+    def idle(self):
+        return len(self._idle)
+
+    async def _run(self, fn, *args):
+        # Driver calls block, so they run on the backend's worker threads
+        return await run_blocking(self.creds.type, fn, *args)
+
+    async def _discard(self, conn):
+        self._open -= 1
+        try:
+            await self._run(self._close, conn)
+        except Exception as e:
+            logger.warning("Error closing pooled connection: %s", e)
+
+    async def _checkout(self, health_check_after):
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if time.monotonic() - last_used <= health_check_after:
+                return conn
+            try:
+                await self._run(self._ping, conn)
+                return conn
+            except Exception:
+                await self._discard(conn)
+        self._open += 1
+        try:
+            return await self._run(self._connect, self.creds)
+        except BaseException:
+            self._open -= 1
+            raise
+
+    async def acquire(self, timeout, health_check_after):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise PoolExhausted(f"No free connection for {self.creds.host} after {timeout}s")
+        try:
+            return await self._checkout(health_check_after)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, conn, broken=False):
+        try:
+            if self._closed or broken:
+                await self._discard(conn)
+                return
+            if self._reset:
+                try:
+                    await self._run(self._reset, conn)
+                except Exception:
+                    await self._discard(conn)
+                    return
+            self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    async def reap(self, now):
+        # Close connections idle for too long, but keep min_size warm
+        keep = deque()
+        expired = []
+        while self._idle:
+            conn, last_used = self._idle.popleft()
+            if now - last_used > self.idle_timeout and len(keep) + self.in_use >= self.min_size:
+                expired.append(conn)
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+        for conn in expired:
+            await self._discard(conn)
+
+    async def close(self):
+        self._closed = True
+        while self._idle:
+            conn, _ = self._idle.pop()
+            await self._discard(conn)
+
+
+def _mysql_connect(creds):
+    config = {
+        'host': creds.host,
+        'user': creds.username,
+        'password': creds.password,
+        'database': creds.database,
+        'port': creds.port,
+    }
+    if '.mysql.database.azure.com' in creds.host:
+        config['ssl_ca'] = '/etc/ssl/certs/ca-certificates.crt'
+        config['ssl_verify_cert'] = True
+    return driver(MYSQL).connect(**config)
+
+
+def _mysql_ping(conn):
+    conn.ping(reconnect=False)
+
+
+def _mysql_close(conn):
+    conn.close()
+
+
+def _mysql_reset(conn):
+    # End the implicit transaction so the next borrower doesn't read a stale snapshot
+    conn.rollback()
+
+
+def _clickhouse_connect(creds):
+    return driver(CLICKHOUSE).Client(
+        host=creds.host,
+        port=creds.port,
+        user=creds.username,
+        password=creds.password,
+        database=creds.database,
+        secure=True
+    )
+
+
+def _clickhouse_ping(client):
+    client.execute("SELECT 1")
+
+
+def _clickhouse_close(client):
+    client.disconnect()
+
+
+def _motherduck_connect(creds):
+    # Using password field for token
+    return driver(MOTHERDUCK).connect(f"md:{creds.database}?token={creds.password}")
+
+
+def _duckdb_ping(conn):
+    conn.execute("SELECT 1").fetchall()
+
+
+def _duckdb_close(conn):
+    conn.close()
+
+
+_BLOCKING_DRIVERS = {
+    MYSQL: (_mysql_connect, _mysql_ping, _mysql_close, _mysql_reset),
+    CLICKHOUSE: (_clickhouse_connect, _clickhouse_ping, _clickhouse_close, None),
+    MOTHERDUCK: (_motherduck_connect, _duckdb_ping, _duckdb_close, None),
+}
+
+
+class PoolRegistry:
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, max_total=POOL_MAX_TOTAL,
+                 idle_timeout=POOL_IDLE_TIMEOUT, expire_after=POOL_EXPIRE_AFTER,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER, acquire_timeout=POOL_ACQUIRE_TIMEOUT):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.expire_after = expire_after
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        # (connection key, password digest) -> pool. A different password gets a pool of its own
+        # rather than replacing the shared one: it may be wrong, and after a rotation the old
+        # pool just goes unused until reap() expires it
+        self._pools = {}
+        self._lock = asyncio.Lock()
+        self._released = asyncio.Condition()
+
+    def supports(self, db_type):
+        return db_type == POSTGRESQL or db_type in _BLOCKING_DRIVERS
+
+    def total_open(self):
+        return sum(pool.size() for pool in self._pools.values())
+
+    async def _create_pool(self, creds):
+        if creds.type == POSTGRESQL:
+            pool = _AsyncpgPool(creds, self.min_size, self.max_size, self.idle_timeout)
+        elif creds.type in _BLOCKING_DRIVERS:
+            connect, ping, close, reset = _BLOCKING_DRIVERS[creds.type]
+            pool = _BlockingPool(creds, self.min_size, self.max_size, self.idle_timeout,
+                                 connect, ping, close, reset)
+        else:
+            raise ValueError(f"Connection pooling is not supported for database type: {creds.type}")
+        await pool.open()
+        return pool
+
+    async def _get_pool(self, creds):
+        key = (creds.key, creds.secret)
+        async with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                return pool
+        await self._wait_for_room(self.min_size)
+        async with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = await self._create_pool(creds)
+                self._pools[key] = pool
+            return pool
+
+    async def _make_room(self, needed):
+        # Close least recently used pools that have nothing checked out until the new connections fit
+        if self.total_open() + needed <= self.max_total:
+            return True
+        for key, pool in sorted(self._pools.items(), key=lambda item: item[1].last_used):
+            if pool.in_use == 0:
+                self._pools.pop(key)
+                await pool.close()
+                if self.total_open() + needed <= self.max_total:
+                    return True
+        return self.total_open() + needed <= self.max_total
+
+    async def _wait_for_room(self, needed):
+        deadline = time.monotonic() + self.acquire_timeout
+        async with self._released:
+            while True:
+                async with self._lock:
+                    if await self._make_room(needed):
+                        return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"Connection limit of {self.max_total} reached")
+                try:
+                    await asyncio.wait_for(self._released.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    @asynccontextmanager
+    async def acquire(self, creds, admit=True):
+        """Borrow a connection for `creds`.
+
+        Unless `admit` is False (used to KILL a running query, which must not queue
+        behind it), the caller first takes one of the connection's admission slots,
+        so a burst queues in priority order or is rejected with Overloaded instead
+        of piling onto the database.
+        """
+        if not admit:
+            async with self._acquire(creds) as conn:
+                yield conn
+            return
+        async with admission.database(creds):
+            async with self._acquire(creds) as conn:
+                yield conn
+
+    @asynccontextmanager
+    async def _acquire(self, creds):
+        with stage("connect"):
+            pool = await self._get_pool(creds)
+            # Counting the borrower before any await keeps the pool from being evicted underneath us
+            pool.in_use += 1
+            try:
+                if pool.idle() == 0 and pool.size() < pool.max_size:
+                    # This checkout opens a new connection, so it has to fit under the global cap
+                    await self._wait_for_room(1)
+                conn = await pool.acquire(self.acquire_timeout, self.health_check_after)
+            except BaseException:
+                pool.in_use -= 1
+                raise
+        pool.last_used = time.monotonic()
+        broken = False
+        try:
+            yield conn
+        except (asyncio.CancelledError, GeneratorExit, ConnectionBroken):
+            # The borrower was interrupted mid-operation (e.g. a streaming client went away),
+            # so the connection may still have unread results on the wire
+            broken = True
+            raise
+        finally:
+            pool.in_use -= 1
+            pool.last_used = time.monotonic()
+            await pool.release(conn, broken)
+            async with self._released:
+                self._released.notify_all()
+
+    async def reap(self):
+        now = time.monotonic()
+        async with self._lock:
+            for key, pool in list(self._pools.items()):
+                if pool.in_use == 0 and now - pool.last_used > self.expire_after:
+                    self._pools.pop(key)
+                    await pool.close()
+                else:
+                    await pool.reap(now)
+
+    async def reap_forever(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.exception("Error reaping connection pools")
+
+    async def close_all(self):
+        async with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            await pool.close()
+
+    def stats(self):
+        return {
+            "pools": len(self._pools),
+            "open_connections": self.total_open(),
+            "in_use": sum(pool.in_use for pool in self._pools.values()),
+            "max_total": self.max_total,
+        }
+
+
+registry = PoolRegistry()
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 8000))       # Tokens sent to the model per turn
+PROMPT_RECENT_MESSAGES = int(os.getenv("PROMPT_RECENT_MESSAGES", 6))    # Trailing history kept verbatim
+PROMPT_SUMMARY_BUDGET = int(os.getenv("PROMPT_SUMMARY_BUDGET", 1000))   # Tokens for the summary of older turns
+PROMPT_SUMMARY_CACHE_SIZE = int(os.getenv("PROMPT_SUMMARY_CACHE_SIZE", 10000))
+
+# Per-message overhead of the chat format (role, separators), as documented by OpenAI
+_MESSAGE_OVERHEAD = 4
+_REPLY_PRIMING = 3
+
+# Schema descriptions as encode_schema writes them. prose: "Table 'x' has the following columns:"
+# followed by "- col (type)" and "Primary key:"/"Foreign key:" lines; ddl/compact: an optional "Types: i=int, ..." legend, then one
+# "table(col type, col type(10, 2) pk, col type ->other.id, ...+3)" line per table
+_PROSE_DUMP = r"Table '[^']+' has the following columns:\n(?:(?:- |Primary key: |Foreign key: )[^\n]*\n?)*"
+_DDL_COLUMN = r"[^\s,()]+ [^,()\n]*(?:\([\d, ]*\)[^,()\n]*)?"
+_DDL_TABLE = rf"[^\s,()]+\({_DDL_COLUMN}(?:, (?:{_DDL_COLUMN}|\.\.\.\+\d+))*\)"
+_DDL_DUMP = rf"(?:^|(?<=\s))(?:Types: \w+=\w+(?:, \w+=\w+)*\n)?(?:{_DDL_TABLE}(?:\n|$))+"
+_SCHEMA_DUMP = re.compile(f"{_PROSE_DUMP}|{_DDL_DUMP}", re.MULTILINE)
+_SQL_BLOCK = re.compile(r"```(?:sql)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_CODE_BLOCK = re.compile(r"(```.*?(?:```|\Z))", re.DOTALL)
+
+_encodings = {}
+
+
+def strip_schema_dumps(text):
+    # Code blocks are kept as they are: a ddl line looks a lot like a function call in a query
+    return "".join(part if i % 2 else _SCHEMA_DUMP.sub("", part) for i, part in enumerate(_CODE_BLOCK.split(text)))
+
+
+def load_encoding(model):
+    """Load the tokenizer for `model`. Blocking: tiktoken reads, and on first use downloads,
+    its BPE file, so the app calls this on an executor at startup."""
+    # tiktoken is optional; without it token counts are estimated
+    if model not in _encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            tiktoken = None
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # The BPE files are downloaded on first use, which fails on offline hosts
+                logger.warning("Could not load tiktoken encoding, estimating token counts: %s", e)
+        _encodings[model] = encoding
+    return _encodings[model]
+
+
+def _encoding(model):
+    if model in _encodings:
+        return _encodings[model]
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return load_encoding(model)
+    # On the event loop, never load here; counts are estimated until load_encoding() has run
+    return None
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    encoding = _encoding(model)
+    if encoding is None:
+        # ~4 characters per token for English text and SQL
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model="gpt-4o-mini"):
+    return sum(count_tokens(m["content"], model) + _MESSAGE_OVERHEAD for m in messages) + _REPLY_PRIMING
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+class _SummaryCache:
+    # One-line summaries of individual messages, keyed by content hash, least recently used first
+    def __init__(self, max_entries=PROMPT_SUMMARY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, message, model):
+        key = hashlib.sha256(f"{message['role']}\0{message['content']}".encode()).hexdigest()
+        entry = self._entries.get(key)
+        if entry is None:
+            line = self._summarize(message)
+            entry = (line, count_tokens(line, model))
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def _summarize(message):
+        content = strip_schema_dumps(message["content"])
+        if message["role"] == "assistant":
+            # The SQL is what later turns refer back to ("now group that by month")
+            sql = _SQL_BLOCK.search(content)
+            if sql:
+                return f"- assistant wrote SQL: {_clip(sql.group(1), 300)}"
+            return f"- assistant: {_clip(content, 160)}"
+        return f"- {message['role']}: {_clip(content, 200)}"
+
+
+_summaries = _SummaryCache()
+
+
+class PromptAssembler:
+    """Fit a chat prompt into a token budget.
+
+    The system prompt, the current question and the last few messages are sent
+    verbatim. Older messages collapse into a summary made of cached one-line
+    digests, newest first, until the summary budget is spent. Schema dumps in the
+    history are dropped because the system prompt already carries the current schema.
+    """
+
+    def __init__(self, model, budget=PROMPT_TOKEN_BUDGET, recent=PROMPT_RECENT_MESSAGES,
+                 summary_budget=PROMPT_SUMMARY_BUDGET):
+        self.model = model
+        self.budget = budget
+        self.recent = recent
+        self.summary_budget = summary_budget
+
+    def _summary(self, older):
+        lines = []
+        used = 0
+        for message in reversed(older):
+            line, tokens = _summaries.get(message, self.model)
+            if used + tokens > self.summary_budget:
+                break
+            lines.append(line)
+            used += tokens
+        if not lines:
+            return None
+        omitted = len(older) - len(lines)
+        header = "Summary of the earlier conversation"
+        if omitted:
+            header += f" ({omitted} older messages omitted)"
+        return {"role": "system", "content": header + ":\n" + "\n".join(reversed(lines))}
+
+    def assemble(self, system_prompt, history, question):
+        """Return (messages, prompt_tokens)."""
+        history = [
+            {"role": m["role"], "content": strip_schema_dumps(m["content"]).strip() or m["content"]}
+            for m in history
+        ]
+        split = max(len(history) - self.recent, 0)
+        older, recent = history[:split], history[split:]
+
+        system = {"role": "system", "content": system_prompt}
+        task = {"role": "user", "content": question}
+        while True:
+            summary = self._summary(older) if older else None
+            messages = [system] + ([summary] if summary else []) + recent + [task]
+            tokens = count_message_tokens(messages, self.model)
+            if tokens <= self.budget or not recent:
+                return messages, tokens
+            # Still too big (long recent turns): move the oldest verbatim message into the summary
+            older.append(recent.pop(0))
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 60))                       # Default seconds a result stays valid
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # Total size of cached results
+QUERY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("QUERY_CACHE_MAX_ENTRY_BYTES", 16 * 1024 * 1024))  # Larger results aren't cached
+
+# Quoted strings/identifiers, comments, or a run of whitespace
+_TOKENS = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`)|(--[^\n]*|/\*.*?\*/)|(\s+)""",
+    re.DOTALL,
+)
+_READ_ONLY_STATEMENTS = {"select", "show", "describe", "desc", "values", "table"}
+# Statements that can follow a WITH; anything else there is part of a CTE (ClickHouse's WITH <expr> AS name)
+_MAIN_STATEMENTS = _READ_ONLY_STATEMENTS | {"insert", "update", "delete", "merge", "upsert", "replace"}
+_WORDS = re.compile(r"\w+|[()]")
+# The "(" that opens a CTE body: name AS [NOT] [MATERIALIZED] (
+_CTE_BODY = re.compile(r"\bas\s*(?:not\s+)?(?:materialized\s*)?\($", re.IGNORECASE)
+# Locking reads and SELECT ... INTO (a new table on PostgreSQL, a file or variables on MySQL)
+_LOCKING_OR_INTO = re.compile(
+    r"\bfor\s+(?:no\s+key\s+update|key\s+share|update|share)\b|\block\s+in\s+share\s+mode\b|\binto\b",
+    re.IGNORECASE,
+)
+# Functions that write, lock, sleep or reach outside the database, when called
+_SIDE_EFFECT_FUNCTIONS = re.compile(
+    r"\b(nextval|setval|set_config|pg_sleep|pg_sleep_for|pg_sleep_until|pg_advisory_lock|pg_advisory_xact_lock|"
+    r"pg_try_advisory_lock|pg_try_advisory_xact_lock|pg_advisory_lock_shared|pg_advisory_xact_lock_shared|"
+    r"pg_try_advisory_lock_shared|pg_try_advisory_xact_lock_shared|pg_terminate_backend|pg_cancel_backend|"
+    r"pg_reload_conf|pg_rotate_logfile|pg_notify|pg_read_file|pg_read_binary_file|pg_ls_dir|lo_import|lo_export|"
+    r"lo_unlink|dblink|dblink_exec|txid_current|sleep|sleepeachrow|benchmark|get_lock|release_lock|"
+    r"release_all_locks|load_file)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def outside_quotes(query):
+    # The query with literals and quoted identifiers blanked, comments removed
+    def blank(match):
+        if match.group(1):
+            return "''"
+        return " "
+    return _TOKENS.sub(blank, query)
+
+
+def sql_fingerprint(query):
+    """Normalize `query` so formatting differences share a cache entry.
+
+    Comments are removed, whitespace outside literals is collapsed and a trailing
+    semicolon is dropped. Case is kept: identifiers are case-sensitive on some backends.
+    """
+    def normalize(match):
+        if match.group(1):
+            return match.group(1)
+        return " "
+    normalized = _TOKENS.sub(normalize, query).strip().rstrip(";").strip()
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def _statement_keywords(bare):
+    # The keyword that says what the statement does, after those of its CTE bodies
+    # (PostgreSQL allows INSERT/UPDATE/DELETE in a WITH): ["select"], ["delete", "select"]
+    text = bare.lstrip("( \t\r\n")
+    first = re.match(r"\w+", text)
+    if not first:
+        return [""]
+    if first.group(0).lower() != "with":
+        return [first.group(0).lower()]
+    rest = text[first.end():]
+    keywords, depth, body = [], 0, None
+    for token in _WORDS.finditer(rest):
+        word = token.group(0)
+        if word == "(":
+            if depth == 0 and _CTE_BODY.search(rest, 0, token.end()):
+                body = token.end()
+            depth += 1
+        elif word == ")":
+            depth -= 1
+            if depth == 0 and body is not None:
+                keywords += _statement_keywords(rest[body:token.start()])
+                body = None
+        elif depth == 0 and word.lower() in _MAIN_STATEMENTS:
+            # replace(...) and MySQL's insert(...) are also string functions
+            if word.lower() in ("replace", "insert") and rest[token.end():].lstrip().startswith("("):
+                continue
+            return keywords + [word.lower()]
+    return keywords + [""]
+
+
+def is_read_only(query):
+    """True for a single SELECT-like statement without writes, locks or side-effect functions.
+
+    The statement is classified by its leading keyword (the one after the CTEs for
+    WITH), so names like `share`, `set` or `replace()` in a SELECT don't make it a write.
+    """
+    bare = outside_quotes(query).strip().rstrip(";").strip()
+    if not bare or ";" in bare:
+        return False
+    if any(keyword not in _READ_ONLY_STATEMENTS for keyword in _statement_keywords(bare)):
+        return False
+    return not _LOCKING_OR_INTO.search(bare) and not _SIDE_EFFECT_FUNCTIONS.search(bare)
+
+
+_DANGLING_END = re.compile(
+    r"(,|=|<|>|\+|-|/|\b(select|from|where|and|or|not|by|on|join|having|as|in|like|between|union|with))$",
+    re.IGNORECASE,
+)
+
+
+def syntax_error(query):
+    """A reason `query` can't be valid SQL (unterminated quote, unbalanced parentheses,
+    ends mid-clause), or None. Catches truncated or garbled statements without a round trip."""
+    bare = outside_quotes(query).strip().rstrip(";").strip()
+    if not bare:
+        return "Empty query"
+    if any(mark in bare for mark in ("'", '"', "`", "/*")):
+        return "Unterminated string, quoted identifier or comment"
+    depth = 0
+    for char in bare:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                return "Unbalanced parentheses"
+    if depth:
+        return "Unbalanced parentheses"
+    if _DANGLING_END.search(bare):
+        return "Query ends in the middle of a clause"
+    return None
+
+
+def parse_cache_control(header):
+    """Request directives: no-store (skip the cache), no-cache (run and refresh), max-age=N."""
+    directives = {}
+    for part in (header or "").split(","):
+        name, _, value = part.strip().partition("=")
+        name = name.strip().lower()
+        if name in ("no-store", "no-cache"):
+            directives[name] = True
+        elif name == "max-age":
+            try:
+                directives[name] = max(float(value.strip().strip('"')), 0.0)
+            except ValueError:
+                pass
+    return directives
+
+
+@dataclass
+class CachedResult:
+    body: bytes
+    media_type: str
+    secret: str      # Password digest of the credentials that produced it
+    created_at: float
+    ttl: float
+    connection: str
+
+
+class QueryCache:
+    """Results of read-only queries, keyed by SQL fingerprint, result format and connection.
+
+    Entries expire after the connection's TTL and the least recently used ones are
+    evicted once the cached bodies exceed `max_bytes`.
+    """
+
+    def __init__(self, ttl=QUERY_CACHE_TTL, max_bytes=QUERY_CACHE_MAX_BYTES, max_entry_bytes=QUERY_CACHE_MAX_ENTRY_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()  # key -> CachedResult, least recently used first
+        self._by_connection = {}       # connection key -> set of entry keys
+        self._ttls = {}                # connection key -> TTL set by its requests
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def _key(self, creds, query, format):
+        return f"{creds.key}:{format}:{sql_fingerprint(query)}"
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= len(entry.body)
+        keys = self._by_connection.get(entry.connection)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_connection[entry.connection]
+
+    def get(self, creds, query, format, max_age=None):
+        key = self._key(creds, query, format)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        age = time.monotonic() - entry.created_at
+        if entry.secret != creds.secret or age >= entry.ttl or (max_age is not None and age > max_age):
+            # Never serve results to credentials that haven't been checked against the database
+            if entry.secret == creds.secret and age >= entry.ttl:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, creds, query, format, body, media_type, ttl=None):
+        if len(body) > self.max_entry_bytes:
+            return
+        if ttl is not None:
+            self._ttls[creds.key] = ttl
+        key = self._key(creds, query, format)
+        self._drop(key)
+        self._entries[key] = CachedResult(body, media_type, creds.secret, time.monotonic(),
+                                          self._ttls.get(creds.key, self.ttl), creds.key)
+        self._by_connection.setdefault(creds.key, set()).add(key)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def fetch(self, creds, query, format, directives, ttl, produce):
+        """Return (body, media_type, cached), calling `produce()` on a miss.
+
+        `directives` come from parse_cache_control: no-store bypasses the cache
+        entirely, no-cache runs the query and replaces the cached result.
+        """
+        if directives.get("no-store"):
+            self.bypasses += 1
+            body, media_type = await produce()
+            return body, media_type, False
+        if not directives.get("no-cache"):
+            entry = self.get(creds, query, format, directives.get("max-age"))
+            if entry is not None:
+                return entry.body, entry.media_type, True
+        else:
+            self.bypasses += 1
+        body, media_type = await produce()
+        self.put(creds, query, format, body, media_type, ttl)
+        return body, media_type, False
+
+    def invalidate(self, creds):
+        # After a write on the connection, everything cached for it may be stale
+        for key in list(self._by_connection.get(creds.key, ())):
+            self._drop(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+query_cache = QueryCache()
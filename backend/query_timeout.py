@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import math
+import os
+import uuid
+
+from pools import registry, driver, ConnectionBroken, MYSQL, MOTHERDUCK, CLICKHOUSE
+from executor import run_blocking
+
+logger = logging.getLogger(__name__)
+
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", 30000))       # Server default per statement, 0 disables
+QUERY_TIMEOUT_MAX_MS = int(os.getenv("QUERY_TIMEOUT_MAX_MS", 0))   # Cap on per-request timeout_ms, 0 for none
+# How long past the timeout we wait for the database's own timeout before interrupting it ourselves
+TIMEOUT_GRACE = float(os.getenv("QUERY_TIMEOUT_GRACE", 1.0))
+# How long an interrupted driver call gets to unwind before its connection is dropped anyway
+INTERRUPT_WAIT = 5.0
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryNotInterrupted(QueryTimeout, ConnectionBroken):
+    # Timed out, and the driver call didn't stop within INTERRUPT_WAIT: the connection is discarded
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def effective_timeout_ms(requested=None):
+    timeout_ms = requested or QUERY_TIMEOUT_MS
+    if QUERY_TIMEOUT_MAX_MS and (not timeout_ms or timeout_ms > QUERY_TIMEOUT_MAX_MS):
+        timeout_ms = QUERY_TIMEOUT_MAX_MS
+    return timeout_ms or None
+
+
+def backstop(timeout_ms):
+    # Client-side deadline in seconds, slightly after the server-side one
+    return timeout_ms / 1000 + TIMEOUT_GRACE if timeout_ms else None
+
+
+def new_query_id():
+    # ClickHouse query ids let us KILL the exact query from another connection
+    return str(uuid.uuid4())
+
+
+def clickhouse_settings(timeout_ms, **settings):
+    if timeout_ms:
+        settings["max_execution_time"] = max(math.ceil(timeout_ms / 1000), 1)
+    return settings
+
+
+async def set_postgres_timeout(conn, timeout_ms):
+    # Session-level; asyncpg runs RESET ALL when the connection goes back to the pool
+    if timeout_ms:
+        await conn.execute(f"SET statement_timeout = {int(timeout_ms)}")
+
+
+def set_mysql_timeout(cursor, timeout_ms):
+    """Set the session statement timeout on a MySQL/MariaDB connection (0 clears it).
+
+    MySQL's MAX_EXECUTION_TIME only covers SELECT statements; other statements are
+    bounded by the client-side backstop, which issues KILL QUERY.
+    """
+    try:
+        cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout_ms or 0)}")
+    except driver(MYSQL).Error:
+        # MariaDB spells it max_statement_time, in seconds
+        cursor.execute(f"SET SESSION max_statement_time = {(timeout_ms or 0) / 1000:.3f}")
+
+
+def _mysql_kill(conn, thread_id):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"KILL QUERY {int(thread_id)}")
+    finally:
+        cursor.close()
+
+
+def _clickhouse_kill(client, query_id):
+    client.execute("KILL QUERY WHERE query_id = %(query_id)s ASYNC", {"query_id": query_id})
+
+
+async def interrupt(creds, conn, query_id=None):
+    """Stop the statement running on `conn`. PostgreSQL is handled by asyncpg itself."""
+    try:
+        if creds.type == MOTHERDUCK:
+            conn.interrupt()
+        elif creds.type == MYSQL:
+            async with registry.acquire(creds, admit=False) as other:
+                await run_blocking(MYSQL, _mysql_kill, other, conn.connection_id)
+        elif creds.type == CLICKHOUSE and query_id:
+            async with registry.acquire(creds, admit=False) as other:
+                await run_blocking(CLICKHOUSE, _clickhouse_kill, other, query_id)
+    except Exception as e:
+        logger.warning("Could not interrupt %s query: %s", creds.type, e)
+
+
+async def run_interruptible(creds, conn, timeout_ms, fn, *args, query_id=None):
+    """Run a blocking driver call for `conn` on the backend's executor.
+
+    If it outlives the timeout (plus grace, so the database's own timeout usually
+    fires first) or the caller is cancelled, the statement is interrupted on the
+    server and the driver call is given time to unwind before the connection is
+    handed back. If it still hasn't returned, QueryNotInterrupted tells the pool
+    to discard the connection instead.
+    """
+    future = asyncio.ensure_future(run_blocking(creds.type, fn, *args))
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), backstop(timeout_ms))
+    except asyncio.TimeoutError:
+        message = f"Query exceeded the {timeout_ms} ms timeout and was cancelled"
+        if not await _interrupt_and_wait(creds, conn, query_id, future):
+            raise QueryNotInterrupted(message)
+        raise QueryTimeout(message)
+    except asyncio.CancelledError:
+        await _interrupt_and_wait(creds, conn, query_id, future)
+        raise
+
+
+async def _interrupt_and_wait(creds, conn, query_id, future):
+    try:
+        await asyncio.wait_for(asyncio.shield(interrupt(creds, conn, query_id)), INTERRUPT_WAIT)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out interrupting %s query", creds.type)
+    # Whether the driver call has returned, so the connection is free again
+    await asyncio.wait({future}, timeout=INTERRUPT_WAIT)
+    if not future.done():
+        logger.warning("%s query still running %g s after being interrupted, dropping its connection",
+                       creds.type, INTERRUPT_WAIT)
+        return False
+    if not future.cancelled():
+        future.exception()  # The driver's "interrupted" error is expected here
+    return True
+
+
+async def cancel_on_disconnect(request, awaitable, interval=0.25):
+    """Await `awaitable`, cancelling it (and so the database query) if the client goes away."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling query")
+                task.cancel()
+                await asyncio.wait({task})
+                if not task.cancelled():
+                    task.exception()
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
@@ -0,0 +1,220 @@
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from pools import registry, driver, POSTGRESQL, MYSQL, MOTHERDUCK, CLICKHOUSE, CLOUDFLARE
+from executor import get_http_client
+from instrumentation import stage
+from query_timeout import (run_interruptible, set_postgres_timeout, set_mysql_timeout, clickhouse_settings,
+                           new_query_id, backstop)
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def json_default(value):
+    # Same conversions FastAPI's jsonable_encoder applies to the non-streaming response
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode(errors="replace")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def _transpose(rows, width):
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(column) for column in zip(*rows)]
+
+
+# Blocking halves, run on the backend's executor. Each one executes the statement exactly
+# once and reads the column metadata off that same cursor/result.
+def _mysql_execute(conn, query, columnar, timeout_ms=None):
+    cursor = conn.cursor()
+    try:
+        if timeout_ms:
+            set_mysql_timeout(cursor, timeout_ms)
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        field_type = driver(MYSQL).FieldType
+        columns = [(desc[0], field_type.get_info(desc[1])) for desc in cursor.description or []]
+        return columns, _transpose(rows, len(columns)) if columnar else rows
+    finally:
+        if timeout_ms:
+            # Pooled connections are shared; don't leave this request's limit behind
+            try:
+                set_mysql_timeout(cursor, 0)
+            except driver(MYSQL).Error:
+                pass
+        cursor.close()
+
+
+def _duckdb_execute(conn, query, columnar):
+    result = conn.execute(query)
+    columns = [(desc[0], str(desc[1])) for desc in result.description or []]
+    rows = result.fetchall()
+    return columns, _transpose(rows, len(columns)) if columnar else rows
+
+
+def _duckdb_arrow(conn, query):
+    # DuckDB hands back Arrow buffers directly, no per-value conversion
+    return conn.execute(query).fetch_arrow_table()
+
+
+def _clickhouse_execute(client, query, columnar, timeout_ms=None, query_id=None):
+    data, column_types = client.execute(query, with_column_types=True, columnar=columnar,
+                                        settings=clickhouse_settings(timeout_ms), query_id=query_id)
+    columns = [(name, type_) for name, type_ in column_types]
+    if columnar:
+        data = [list(values) for values in data] if data else [[] for _ in columns]
+    return columns, data
+
+
+async def execute_and_describe(creds, query, columnar=False, timeout_ms=None):
+    """Run `query` once and return ([(name, type)], data).
+
+    `data` is a list of row tuples, or one list of values per column when `columnar` is set.
+    `timeout_ms` is enforced by the database; a statement still running past it, or
+    whose caller is cancelled, is cancelled on the server.
+    """
+    if creds.type == POSTGRESQL:
+        async with registry.acquire(creds) as conn:
+            with stage("execute"):
+                await set_postgres_timeout(conn, timeout_ms)
+                # asyncpg sends a cancel request to the server when these time out or are cancelled
+                statement = await conn.prepare(query, timeout=backstop(timeout_ms))
+                columns = [(attr.name, attr.type.name) for attr in statement.get_attributes()]
+                rows = await statement.fetch(timeout=backstop(timeout_ms))
+        return columns, _transpose(rows, len(columns)) if columnar else [tuple(row) for row in rows]
+
+    if creds.type == MYSQL:
+        async with registry.acquire(creds) as conn:
+            with stage("execute"):
+                return await run_interruptible(creds, conn, timeout_ms, _mysql_execute, conn, query, columnar, timeout_ms)
+
+    if creds.type == MOTHERDUCK:
+        # DuckDB has no statement timeout; run_interruptible calls conn.interrupt() at the deadline
+        async with registry.acquire(creds) as conn:
+            with stage("execute"):
+                return await run_interruptible(creds, conn, timeout_ms, _duckdb_execute, conn, query, columnar)
+
+    if creds.type == CLICKHOUSE:
+        query_id = new_query_id()
+        async with registry.acquire(creds) as client:
+            with stage("execute"):
+                return await run_interruptible(creds, client, timeout_ms, _clickhouse_execute,
+                                               client, query, columnar, timeout_ms, query_id, query_id=query_id)
+
+    if creds.type == CLOUDFLARE:
+        results = []
+        for statement in await d1_query(creds, query, timeout_ms):
+            results.extend(statement.get('results') or [])
+        names = list(results[0].keys()) if results else []
+        # D1 doesn't report column types
+        columns = [(name, None) for name in names]
+        if columnar:
+            return columns, [[row.get(name) for row in results] for name in names]
+        return columns, [tuple(row.get(name) for name in names) for row in results]
+
+    raise Exception("Unknown database type. Please check your connection settings.")
+
+
+async def d1_query(creds, query, timeout_ms=None):
+    headers = {
+        'Authorization': f'Bearer {creds.password}',  # Using password field for API token
+        'Content-Type': 'application/json'
+    }
+    url = f"https://api.cloudflare.com/client/v4/accounts/{creds.username}/d1/database/{creds.database}/query"  # Using username field for account_id
+    with stage("execute"):
+        kwargs = {"timeout": timeout_ms / 1000} if timeout_ms else {}
+        response = await get_http_client().post(url, headers=headers, json={"sql": query}, **kwargs)
+    if response.status_code != 200:
+        raise Exception(f"Cloudflare D1 error: {response.text}")
+    return response.json()['result']
+
+
+def rows_payload(columns, rows):
+    names = [name for name, _ in columns]
+    with stage("serialize"):
+        return [dict(zip(names, row)) for row in rows]
+
+
+def columnar_payload(query, columns, values, cached=None):
+    # Column names and types once, then one array per column
+    payload = {} if cached is None else {"cached": cached}
+    payload.update({
+        "response": "Query executed successfully",
+        "sql": query,
+        "format": "columnar",
+        "columns": [{"name": name, "type": type_} for name, type_ in columns],
+        "row_count": len(values[0]) if values else 0,
+        "data": values,
+    })
+    with stage("serialize"):
+        return json.dumps(payload, default=json_default, separators=(",", ":"))
+
+
+def _arrow_array(pa, values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed or driver-specific types: fall back to their text form
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+async def fetch_arrow_ipc(creds, query, timeout_ms=None):
+    """Run `query` and return the result serialized as an Arrow IPC stream."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise Exception("The arrow format requires pyarrow to be installed")
+
+    if creds.type == MOTHERDUCK:
+        async with registry.acquire(creds) as conn:
+            with stage("execute"):
+                table = await run_interruptible(creds, conn, timeout_ms, _duckdb_arrow, conn, query)
+    else:
+        columns, values = await execute_and_describe(creds, query, columnar=True, timeout_ms=timeout_ms)
+        with stage("serialize"):
+            table = pa.Table.from_arrays(
+                [_arrow_array(pa, column) for column in values],
+                names=[name for name, _ in columns]
+            )
+
+    with stage("serialize"):
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+async def render_result(creds, query, format, timeout_ms=None):
+    """Run `query` and return (body, media_type) for a non-streaming /api/v1/query response.
+
+    JSON bodies start with `{"cached":false` so a cached copy can be relabelled
+    without re-serializing it (see mark_cached).
+    """
+    if format == "arrow":
+        return await fetch_arrow_ipc(creds, query, timeout_ms), ARROW_MEDIA_TYPE
+    if format == "columnar":
+        columns, values = await execute_and_describe(creds, query, columnar=True, timeout_ms=timeout_ms)
+        return columnar_payload(query, columns, values, cached=False).encode(), "application/json"
+    if creds.type == CLOUDFLARE:
+        data = await d1_query(creds, query, timeout_ms)
+    else:
+        columns, rows = await execute_and_describe(creds, query, timeout_ms=timeout_ms)
+        data = rows_payload(columns, rows)
+    payload = {"cached": False, "response": "Query executed successfully", "sql": query, "data": data}
+    with stage("serialize"):
+        return json.dumps(payload, default=json_default, separators=(",", ":")).encode(), "application/json"
+
+
+def mark_cached(body, media_type):
+    if media_type == "application/json" and body.startswith(b'{"cached":false'):
+        return b'{"cached":true' + body[len(b'{"cached":false'):]
+    return body
@@ -0,0 +1,310 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from pools import registry, POSTGRESQL, MYSQL, MOTHERDUCK, CLICKHOUSE
+from executor import run_blocking
+from instrumentation import stage
+from admission import background
+from single_flight import metadata_flight
+from table_index import TableIndex, RETRIEVAL_TOP_K
+from completion_index import CompletionIndex, AUTOCOMPLETE_LIMIT
+import introspection
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", 300))   # Seconds before an entry is revalidated
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", 64))    # Connections kept in the cache
+
+def supports_metadata(db_type):
+    return introspection.dialect(db_type) is not None
+
+
+def _mysql_fetch(conn, query, params=None):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _duckdb_fetch(conn, query, params=None):
+    return conn.execute(query, params).fetchall()
+
+
+def _clickhouse_fetch(client, query, params=None):
+    return client.execute(query, params)
+
+
+_BLOCKING_FETCH = {
+    MYSQL: _mysql_fetch,
+    MOTHERDUCK: _duckdb_fetch,
+    CLICKHOUSE: _clickhouse_fetch,
+}
+
+
+async def run_catalog(creds, query, params=None):
+    """Run one catalog query on a pooled connection, with `params` in the driver's paramstyle."""
+    async def fetch():
+        async with registry.acquire(creds) as conn:
+            with stage("metadata"):
+                if creds.type == POSTGRESQL:
+                    return [tuple(row) for row in await conn.fetch(query, *(params or ()))]
+                return await run_blocking(creds.type, _BLOCKING_FETCH[creds.type], conn, query, params)
+
+    # Identical catalog queries running at the same time (a team opening the same
+    # dashboard) share one round trip
+    key = (creds.key, creds.secret, query, repr(params))
+    return await metadata_flight.do(key, fetch)
+
+
+# The server version picks the catalog queries (introspection.resolve); it's asked once per
+# server instead of before every load and fingerprint
+_server_versions = {}  # (type, host, port) -> rows of the version query
+
+
+def _catalog_runner(creds):
+    version_query = introspection.queries_for(creds.type).version if supports_metadata(creds.type) else None
+    server = (creds.type, creds.host, creds.port)
+
+    async def run(query, params):
+        if query == version_query:
+            if server not in _server_versions:
+                _server_versions[server] = await run_catalog(creds, query, params)
+            return _server_versions[server]
+        return await run_catalog(creds, query, params)
+    return run
+
+
+async def load_schema(creds, schema=None):
+    """(metadata, keys) of a schema (default: the connection's own): columns with type,
+    nullability and comment, plus PK/FK edges."""
+    return await introspection.introspect_async(_catalog_runner(creds), creds.type, schema)
+
+
+async def list_schemas(creds):
+    return await introspection.list_schemas_async(_catalog_runner(creds), creds.type)
+
+
+async def fetch_table_columns(creds, tables, schema=None):
+    """(metadata, keys) of just `tables` (matched case-insensitively), in the same shape as a
+    cached schema's, so a cold prompt reads exactly like a warm one."""
+    return await introspection.introspect_tables_async(_catalog_runner(creds), creds.type, tables, schema)
+
+
+async def schema_fingerprint(creds, schema=None):
+    return await introspection.fingerprint_async(_catalog_runner(creds), creds.type, schema)
+
+
+@dataclass
+class SchemaEntry:
+    metadata: dict
+    fingerprint: str
+    secret: str      # Password digest of the credentials that loaded it
+    loaded_at: float
+    checked_at: float
+    keys: dict = field(default_factory=dict)   # {table: {"primary_key": [...], "foreign_keys": [...]}}
+    usage: Counter = field(default_factory=Counter)  # (table, column) lowercased -> @references in chats
+    _lookup: dict = field(default=None, repr=False)
+    _index: TableIndex = field(default=None, repr=False)
+    _completions: CompletionIndex = field(default=None, repr=False)
+    _names: list = field(default=None, repr=False)
+    _serialized: tuple = field(default=None, repr=False)
+
+    def table(self, name):
+        # Case-insensitive lookup, chat references are lowercased
+        if self._lookup is None:
+            self._lookup = {table.lower(): table for table in self.metadata}
+        real_name = self._lookup.get(name.lower())
+        return (real_name, self.metadata[real_name]) if real_name else (None, None)
+
+    def table_names(self):
+        if self._names is None:
+            self._names = sorted(self.metadata)
+        return self._names
+
+    def page(self, after=None, limit=None):
+        """(table names, next cursor): up to `limit` tables in name order, starting after table `after`."""
+        names = self.table_names()
+        start = bisect.bisect_right(names, after) if after else 0
+        end = len(names) if not limit else min(start + limit, len(names))
+        return names[start:end], names[end - 1] if end < len(names) else None
+
+    async def serialized(self):
+        """(JSON body of the whole metadata dict, digest of the catalog), computed once per load."""
+        if self._serialized is None:
+            def serialize():
+                body = json.dumps(self.metadata, separators=(",", ":")).encode()
+                keys = json.dumps(self.keys, sort_keys=True, separators=(",", ":")).encode()
+                return body, hashlib.sha256(body + b"\n" + keys).hexdigest()[:32]
+            self._serialized = await run_blocking("index", serialize)
+        return self._serialized
+
+    async def relevant_tables(self, question, k=RETRIEVAL_TOP_K):
+        """{table: columns} for the `k` tables that best match `question`."""
+        if self._index is None:
+            # Built off the event loop on first use; a reloaded schema gets an incrementally
+            # updated copy of the previous entry's index (see SchemaCache._load)
+            self._index = await run_blocking("index", TableIndex, self.metadata)
+        return {table: self.metadata[table] for table, _ in self._index.search(question, k)}
+
+    async def complete(self, text, limit=AUTOCOMPLETE_LIMIT):
+        """@table / @table.column suggestions for `text`, favouring what this connection references most."""
+        if self._completions is None:
+            # Like the search index: built off the event loop once, then updated incrementally
+            self._completions = await run_blocking("index", CompletionIndex, self.metadata)
+        return self._completions.complete(text, limit, self.usage)
+
+    def record_usage(self, references):
+        # references: [{"table", "column"}] parsed from a chat message; "*" counts for the table
+        for reference in references:
+            column = reference["column"].lower()
+            self.usage[(reference["table"].lower(), "" if column == "*" else column)] += 1
+
+
+def _updated(index, metadata):
+    index = index.copy()
+    index.update(metadata)
+    return index
+
+
+def _cache_key(creds, schema):
+    # The connection's own schema is keyed by the connection alone
+    return creds.key if schema is None else f"{creds.key}:{schema}"
+
+
+class SchemaCache:
+    def __init__(self, ttl=SCHEMA_CACHE_TTL, max_entries=SCHEMA_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # connection key (plus schema) -> SchemaEntry, least recently used first
+        self._locks = {}               # key -> [lock, coroutines using it], only while a load is in flight
+        self._revalidating = {}
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @asynccontextmanager
+    async def _lock(self, key):
+        # One load per key at a time. The lock goes with its last user, so keys that are
+        # evicted, invalidated or never load (wrong credentials) don't leave one behind
+        slot = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._locks[key]
+
+    async def _load(self, creds, schema=None):
+        key = _cache_key(creds, schema)
+        async with self._lock(key):
+            # Another request may have loaded it while we waited
+            entry = self._entries.get(key)
+            if entry is not None and entry.secret == creds.secret and time.monotonic() - entry.checked_at < self.ttl:
+                return entry
+            fingerprint = await schema_fingerprint(creds, schema)
+            metadata, keys = await load_schema(creds, schema)
+            now = time.monotonic()
+            entry = SchemaEntry(metadata, fingerprint, creds.secret, now, now, keys)
+            previous = self._entries.get(key)
+            if previous is not None:
+                # Re-index only the tables that changed, off the event loop. The update runs on a
+                # copy: requests keep being served from the previous entry's indexes meanwhile
+                if previous._index is not None:
+                    entry._index = await run_blocking("index", _updated, previous._index, metadata)
+                if previous._completions is not None:
+                    entry._completions = await run_blocking("index", _updated, previous._completions, metadata)
+                entry.usage = previous.usage
+            self._store(key, entry)
+            return entry
+
+    async def _revalidate(self, creds, entry, schema=None):
+        try:
+            with background():
+                fingerprint = await schema_fingerprint(creds, schema)
+                if fingerprint == entry.fingerprint:
+                    entry.checked_at = time.monotonic()
+                else:
+                    logger.info("Schema changed for %s/%s, reloading", creds.host, schema or creds.database)
+                    await self._load(creds, schema)
+        except Exception as e:
+            logger.warning("Error revalidating schema cache: %s", e)
+        finally:
+            self._revalidating.pop(_cache_key(creds, schema), None)
+
+    async def get(self, creds, schema=None):
+        """Return the cached schema (default: the connection's own), loading it on a miss.
+
+        A stale entry is returned immediately and revalidated in the background by
+        comparing fingerprints, so callers never wait on catalog queries for a hit.
+        """
+        key = _cache_key(creds, schema)
+        entry = self._entries.get(key)
+        if entry is None or entry.secret != creds.secret:
+            # Never serve a schema to credentials that haven't been checked against the database
+            return await self._load(creds, schema)
+        self._entries.move_to_end(key)
+        self._revalidate_if_stale(creds, key, entry, schema)
+        return entry
+
+    def _revalidate_if_stale(self, creds, key, entry, schema=None):
+        if time.monotonic() - entry.checked_at >= self.ttl and key not in self._revalidating:
+            self._revalidating[key] = asyncio.create_task(self._revalidate(creds, entry, schema))
+
+    def warm(self, creds, schema=None):
+        # Load the full schema in the background so later turns are served from memory
+        key = _cache_key(creds, schema)
+        if self.peek(creds, schema) is None and key not in self._revalidating:
+            self._revalidating[key] = asyncio.create_task(self._warm(creds, schema))
+
+    async def _warm(self, creds, schema=None):
+        try:
+            with background():
+                await self._load(creds, schema)
+        except Exception as e:
+            logger.warning("Error warming schema cache: %s", e)
+        finally:
+            self._revalidating.pop(_cache_key(creds, schema), None)
+
+    def peek(self, creds, schema=None):
+        """The cached schema, or None without loading it. A stale one is revalidated in the background, as in get()."""
+        key = _cache_key(creds, schema)
+        entry = self._entries.get(key)
+        if entry is None or entry.secret != creds.secret:
+            return None
+        self._revalidate_if_stale(creds, key, entry, schema)
+        return entry
+
+    def invalidate(self, creds):
+        # After a write on the connection (possibly DDL), every schema cached for it is
+        # revalidated on next use; an unchanged fingerprint keeps the entry and its indexes
+        for key, entry in self._entries.items():
+            if key == creds.key or key.startswith(f"{creds.key}:"):
+                entry.checked_at = float("-inf")
+
+    async def refresh(self, creds, schema=None):
+        entry = self._entries.get(_cache_key(creds, schema))
+        if entry is not None:
+            # Force a reload but keep the entry, so its search index is updated rather than rebuilt
+            entry.checked_at = float("-inf")
+        return await self._load(creds, schema)
+
+    def stats(self):
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl}
+
+
+schema_cache = SchemaCache()
@@ -0,0 +1,148 @@
+import os
+import re
+
+from prompt_budget import count_tokens
+
+SCHEMA_FORMATS = ("prose", "ddl", "compact")
+SCHEMA_PROMPT_FORMAT = os.getenv("SCHEMA_PROMPT_FORMAT", "ddl")               # How chat prompts describe tables
+SCHEMA_PROMPT_MAX_COLUMNS = int(os.getenv("SCHEMA_PROMPT_MAX_COLUMNS", 0))   # Columns per table, 0 for all
+
+# Vendor spellings folded to one short name, used by the ddl format
+_TYPE_ALIASES = {
+    "character varying": "varchar",
+    "character": "char",
+    "timestamp without time zone": "timestamp",
+    "timestamp with time zone": "timestamptz",
+    "time without time zone": "time",
+    "time with time zone": "timetz",
+    "double precision": "double",
+    "integer": "int",
+    "int4": "int",
+    "int8": "bigint",
+    "int2": "smallint",
+    "boolean": "bool",
+}
+
+# Type families and their one/two-letter codes, used by the compact format
+_TYPE_CODES = [
+    ("bi", re.compile(r"^(bigint|int8|u?int64|u?int128|u?int256|hugeint|ubigint|long)$")),
+    ("i", re.compile(r"^(int|integer|int2|int4|smallint|tinyint|mediumint|u?int8|u?int16|u?int32|serial|bigserial|usmallint|uinteger|utinyint)$")),
+    ("n", re.compile(r"^(numeric|decimal)")),
+    ("f", re.compile(r"^(real|float|double|float4|float8|float32|float64)")),
+    ("b", re.compile(r"^(bool|boolean|bit)$")),
+    ("tz", re.compile(r"^(timestamptz|timestamp with time zone)")),
+    ("ts", re.compile(r"^(timestamp|datetime)")),
+    ("d", re.compile(r"^date")),
+    ("t", re.compile(r"^(time|interval)")),
+    ("u", re.compile(r"^uuid")),
+    ("j", re.compile(r"^(json|jsonb|object)")),
+    ("a", re.compile(r"(\[\]|^array)")),
+    ("s", re.compile(r"^(text|varchar|char|character|string|fixedstring|enum|nvarchar|nchar|mediumtext|longtext|tinytext|citext)")),
+]
+_TYPE_NAMES = {"bi": "bigint", "i": "int", "n": "numeric", "f": "float", "b": "bool", "tz": "timestamptz",
+               "ts": "timestamp", "d": "date", "t": "time", "u": "uuid", "j": "json", "a": "array", "s": "text"}
+
+# ClickHouse wraps the real type: Nullable(LowCardinality(String)) -> String
+_WRAPPER = re.compile(r"^(?:Nullable|LowCardinality)\((.*)\)$", re.IGNORECASE)
+
+
+def _base_type(data_type):
+    data_type = (data_type or "").strip()
+    while True:
+        match = _WRAPPER.match(data_type)
+        if not match:
+            return data_type
+        data_type = match.group(1)
+
+
+def short_type(data_type):
+    base = _base_type(data_type)
+    return _TYPE_ALIASES.get(base.lower(), base)
+
+
+def type_code(data_type):
+    base = _base_type(data_type).lower()
+    for code, pattern in _TYPE_CODES:
+        if pattern.search(base):
+            return code
+    return short_type(data_type)
+
+
+def _columns(columns, max_columns):
+    if max_columns and len(columns) > max_columns:
+        return columns[:max_columns], len(columns) - max_columns
+    return columns, 0
+
+
+def _key_notes(table, keys):
+    # keys: {table: {"primary_key": [col, ...], "foreign_keys": [(col, ref_table, ref_col), ...]}}
+    info = (keys or {}).get(table) or {}
+    return info.get("primary_key") or [], info.get("foreign_keys") or []
+
+
+def _encode_prose(tables, keys, max_columns):
+    text = ""
+    for table_name, columns in tables.items():
+        columns, hidden = _columns(columns, max_columns)
+        primary_key, foreign_keys = _key_notes(table_name, keys)
+        text += f"Table '{table_name}' has the following columns:\n"
+        for column in columns:
+            text += f"- {column[0]} ({column[1]})\n"
+        if hidden:
+            text += f"- ... and {hidden} more columns\n"
+        if primary_key:
+            text += f"Primary key: {', '.join(primary_key)}\n"
+        for column, ref_table, ref_column in foreign_keys:
+            text += f"Foreign key: {column} references {ref_table}({ref_column})\n"
+        text += "\n"
+    return text
+
+
+def _encode_ddl(tables, keys, max_columns, type_of):
+    lines = []
+    for table_name, columns in tables.items():
+        columns, hidden = _columns(columns, max_columns)
+        primary_key, foreign_keys = _key_notes(table_name, keys)
+        references = {column: f"{ref_table}.{ref_column}" for column, ref_table, ref_column in foreign_keys}
+        parts = []
+        for column in columns:
+            part = f"{column[0]} {type_of(column[1])}"
+            if column[0] in primary_key:
+                part += " pk"
+            if column[0] in references:
+                part += f" ->{references[column[0]]}"
+            parts.append(part)
+        if hidden:
+            parts.append(f"...+{hidden}")
+        lines.append(f"{table_name}({', '.join(parts)})")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def encode_schema(tables, format=SCHEMA_PROMPT_FORMAT, keys=None, max_columns=SCHEMA_PROMPT_MAX_COLUMNS):
+    """Describe `tables` ({table: [[column, type, ...], ...]}) for a prompt.
+
+    Formats:
+      prose    "Table 'orders' has the following columns:\\n- id (integer)\\n..."
+      ddl      "orders(id int pk, customer_id int ->customers.id, total numeric)"
+      compact  ddl with one/two-letter type codes and a legend for the codes used
+
+    `keys` adds primary/foreign key edges, `max_columns` caps the columns shown per table.
+    """
+    if format == "prose":
+        return _encode_prose(tables, keys, max_columns)
+    if format == "ddl":
+        return _encode_ddl(tables, keys, max_columns, short_type)
+    if format == "compact":
+        text = _encode_ddl(tables, keys, max_columns, type_code)
+        shown = [column for columns in tables.values() for column in _columns(columns, max_columns)[0]]
+        used = sorted({type_code(column[1]) for column in shown} & set(_TYPE_NAMES))
+        if not text or not used:
+            return text
+        legend = ", ".join(f"{code}={_TYPE_NAMES[code]}" for code in used)
+        return f"Types: {legend}\n{text}"
+    raise ValueError(f"Unknown schema format: {format}. Expected one of {', '.join(SCHEMA_FORMATS)}")
+
+
+def schema_token_counts(tables, keys=None, max_columns=SCHEMA_PROMPT_MAX_COLUMNS, model="gpt-4o-mini"):
+    """Prompt tokens each format spends on `tables`."""
+    return {format: count_tokens(encode_schema(tables, format, keys, max_columns), model) for format in SCHEMA_FORMATS}
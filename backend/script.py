@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 from dotenv import load_dotenv
 import mysql.connector
@@ -7,6 +8,10 @@ import clickhouse_driver
 from sqlalchemy import create_engine, text
 import pymysql
 
+from introspection import introspect, introspect_keys, introspect_schemas, INTROSPECTION_PAGE_SIZE, INTROSPECTION_WORKERS
+
+logger = logging.getLogger(__name__)
+
 # Try to load from .env file, but don't fail if it doesn't exist
 try:
     load_dotenv()
@@ -35,37 +40,60 @@ def create_db_connection(db_type, credentials):
             raise ValueError(f"Unsupported database type: {db_type}")
         return connection
     except Exception as e:
-        print(f"Error connecting to {db_type} database: {str(e)}")
+        logger.error("Error connecting to %s database: %s", db_type, e)
         return None
 
-def fetch_table_metadata(connection, db_type):
+def _catalog_runner(connection, db_type):
+    # run(query, params) -> rows on an open connection, as introspection expects
+    def run(query, params):
+        if db_type.lower() == 'duckdb':
+            return connection.execute(query, params).fetchall()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+    return run
+
+def fetch_table_metadata(connection, db_type, schema=None, page_size=INTROSPECTION_PAGE_SIZE):
+    """{table: [[column, type, nullable, comment], ...]} for one schema (default: the connection's own).
+
+    One paged catalog query for all columns instead of a DESCRIBE per table.
+    """
     metadata_info = {}
     try:
-        if db_type.lower() == 'mysql':
-            cursor = connection.cursor()
-            cursor.execute("SHOW TABLES")
-            tables = cursor.fetchall()
-            for (table_name,) in tables:
-                cursor.execute(f"DESCRIBE {table_name}")
-                columns = cursor.fetchall()
-                metadata_info[table_name] = [(col[0], col[1]) for col in columns]
-        elif db_type.lower() == 'duckdb':
-            tables = connection.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'main'").fetchall()
-            for (table_name,) in tables:
-                columns = connection.execute(f"SELECT column_name, data_type FROM information_schema.columns WHERE table_name = '{table_name}'").fetchall()
-                metadata_info[table_name] = columns
-        elif db_type.lower() == 'clickhouse':
-            cursor = connection.cursor()
-            cursor.execute("SHOW TABLES")
-            tables = cursor.fetchall()
-            for (table_name,) in tables:
-                cursor.execute(f"DESCRIBE TABLE {table_name}")
-                columns = cursor.fetchall()
-                metadata_info[table_name] = [(col[0], col[1]) for col in columns]
+        metadata_info, _ = introspect(_catalog_runner(connection, db_type), db_type, schema, page_size)
     except Exception as e:
-        print(f"Error fetching table metadata: {str(e)}")
+        logger.error("Error fetching table metadata: %s", e)
     return metadata_info
 
+def fetch_table_keys(connection, db_type, schema=None):
+    """{table: {"primary_key": [...], "foreign_keys": [(column, ref_table, ref_column), ...]}}"""
+    keys = {}
+    try:
+        keys = introspect_keys(_catalog_runner(connection, db_type), db_type, schema)
+    except Exception as e:
+        logger.error("Error fetching table keys: %s", e)
+    return keys
+
+def fetch_schemas_metadata(db_type, credentials, schemas=None, workers=INTROSPECTION_WORKERS):
+    """(metadata, keys) for several schemas/databases (default: all), introspected in parallel.
+
+    Each worker opens its own connection with create_db_connection; tables are named schema.table.
+    """
+    def connect():
+        connection = create_db_connection(db_type, credentials)
+        if connection is None:
+            raise ConnectionError(f"Could not connect to {db_type} database")
+        return _catalog_runner(connection, db_type), lambda: close_connection(connection, db_type)
+
+    try:
+        return introspect_schemas(connect, db_type, schemas, workers)
+    except Exception as e:
+        logger.error("Error fetching schema metadata: %s", e)
+        return {}, {}
+
 def execute_query(connection, query, db_type):
     try:
         if db_type.lower() in ['mysql', 'clickhouse']:
@@ -80,14 +108,14 @@ def execute_query(connection, query, db_type):
         
         return results, column_names
     except Exception as e:
-        print(f"Error executing query: {str(e)}")
+        logger.error("Error executing query: %s", e)
         return None, None
 
 def close_connection(connection, db_type):
     try:
         connection.close()
     except Exception as e:
-        print(f"Error closing connection: {str(e)}")
+        logger.warning("Error closing connection: %s", e)
 
 def determine_db_type(connection):
     if isinstance(connection, mysql.connector.connection.MySQLConnection):
@@ -0,0 +1,12 @@
+import os
+
+from dotenv import load_dotenv
+
+# Read .env once at startup. Imported by main before the modules that take their
+# settings from the environment, so those see the .env values too.
+try:
+    load_dotenv()
+except Exception:
+    pass
+
+OPENAI_API_KEY = os.getenv("OPENAI_APIKEY")
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+
+from instrumentation import COALESCED
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight operation.
+
+    The first caller starts `produce()`; callers arriving before it finishes await
+    the same task and get the same result (or exception). The operation keeps
+    running while anyone is still waiting for it, and is cancelled once the last
+    waiter goes away (e.g. every client disconnected).
+
+    Keys must identify everything the result depends on, including the credentials'
+    secret, so callers are never handed a result they couldn't have produced.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> _Call
+        self.started = 0
+        self.coalesced = 0
+
+    def _finished(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key, produce):
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(produce()))
+            call.task.add_done_callback(lambda _: self._finished(key, call))
+            self._calls[key] = call
+            self.started += 1
+        else:
+            self.coalesced += 1
+            COALESCED.labels(self.name).inc()
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._finished(key, call)
+
+    def in_flight(self):
+        return len(self._calls)
+
+    def stats(self):
+        return {"in_flight": self.in_flight(), "started": self.started, "coalesced": self.coalesced}
+
+
+# Shared by schema_cache (catalog queries), main (read-only queries and chat completions)
+metadata_flight = SingleFlight("metadata")
+query_flight = SingleFlight("query")
+llm_flight = SingleFlight("llm")
+
+
+def stats():
+    return {flight.name: flight.stats() for flight in (metadata_flight, query_flight, llm_flight)}
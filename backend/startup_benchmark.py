@@ -0,0 +1,81 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that should only be imported once a request needs them
+LAZY_MODULES = ["openai", "asyncpg", "mysql.connector", "duckdb", "clickhouse_driver", "sqlalchemy", "pyarrow", "tiktoken"]
+
+# Runs in a fresh interpreter: import the app, start it, serve one request
+_FIRST_REQUEST = """
+import sys, time
+import main
+imported_at = time.time()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    client.get("/")
+    served_at = time.time()
+print(imported_at, served_at, ",".join(name for name in {lazy!r} if name in sys.modules))
+"""
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def time_to_first_request(cwd):
+    """(seconds until `import main` finished, seconds until the first response, eagerly loaded lazy modules)."""
+    started = time.time()
+    output = subprocess.run(
+        [sys.executable, "-c", _FIRST_REQUEST.format(lazy=LAZY_MODULES)],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    imported_at, served_at = float(output[0]), float(output[1])
+    loaded = output[2].split(",") if len(output) > 2 else []
+    return imported_at - started, served_at - started, loaded
+
+
+def import_profile(cwd):
+    """(module, depth, cumulative seconds) for every import under `import main`, from -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    ).stderr
+    profile = []
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            _, cumulative, indent, name = match.groups()
+            profile.append((name, len(indent) // 2, int(cumulative) / 1e6))
+    return profile
+
+
+# Benchmark: python startup_benchmark.py [runs]
+def main():
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    imports, firsts = [], []
+    loaded = []
+    for _ in range(runs):
+        imported, first, loaded = time_to_first_request(cwd)
+        imports.append(imported)
+        firsts.append(first)
+    print(f"{runs} cold starts")
+    print(f"process start -> app imported: median {statistics.median(imports) * 1000:7.1f} ms")
+    print(f"process start -> first response: median {statistics.median(firsts) * 1000:7.1f} ms")
+    print(f"lazy modules loaded at startup: {', '.join(loaded) if loaded else 'none'}")
+
+    print()
+    print("slowest imports under main (python -X importtime):")
+    profile = import_profile(cwd)
+    total = next((seconds for name, depth, seconds in profile if name == "main" and depth == 0), None)
+    direct = [(name, seconds) for name, depth, seconds in profile if depth == 1]
+    for name, seconds in sorted(direct, key=lambda item: -item[1])[:10]:
+        print(f"  {name:30s} {seconds * 1000:7.1f} ms")
+    if total is not None:
+        print(f"  {'main (total)':30s} {total * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import json
+import logging
+from contextlib import aclosing
+from itertools import islice
+
+from pools import registry, POSTGRESQL, MYSQL, MOTHERDUCK, CLICKHOUSE, CLOUDFLARE
+from executor import run_blocking
+from results import json_default, d1_query
+from query_timeout import (run_interruptible, set_postgres_timeout, set_mysql_timeout, clickhouse_settings,
+                           new_query_id, backstop)
+
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = 1000
+
+
+def _dumps(value):
+    return json.dumps(value, default=json_default, separators=(",", ":"))
+
+
+# Blocking halves of the cursor loops, run on the backend's executor
+def _mysql_open(conn, query, timeout_ms=None):
+    cursor = conn.cursor()  # unbuffered: rows stay on the server until fetched
+    if timeout_ms:
+        set_mysql_timeout(cursor, timeout_ms)
+    cursor.execute(query)
+    return cursor, list(cursor.column_names)
+
+
+def _mysql_close(conn, cursor, timeout_ms=None):
+    cursor.close()
+    if not timeout_ms:
+        return
+    # Pooled connections are shared; don't leave this request's limit behind
+    reset = conn.cursor()
+    try:
+        set_mysql_timeout(reset, 0)
+    finally:
+        reset.close()
+
+
+def _fetch_batch(cursor, batch_size):
+    return cursor.fetchmany(batch_size)
+
+
+def _duckdb_open(conn, query, timeout_ms=None):
+    result = conn.execute(query)
+    return result, [col[0] for col in result.description]
+
+
+def _clickhouse_open(client, query, batch_size, timeout_ms=None, query_id=None):
+    rows = client.execute_iter(query, with_column_types=True, query_id=query_id,
+                               settings=clickhouse_settings(timeout_ms, max_block_size=batch_size))
+    columns = next(rows)
+    return rows, [col[0] for col in columns]
+
+
+def _next_batch(rows, batch_size):
+    return list(islice(rows, batch_size))
+
+
+async def iter_batches(creds, query, batch_size=STREAM_BATCH_SIZE, timeout_ms=None):
+    """Yield (column_names, rows) batches using server-side cursors, so at most one
+    batch of the result is held in memory at a time.
+
+    `timeout_ms` bounds each fetch on PostgreSQL and DuckDB and the whole statement
+    on MySQL and ClickHouse, following each database's own timeout semantics.
+    """
+    if creds.type == POSTGRESQL:
+        async with registry.acquire(creds) as conn:
+            await set_postgres_timeout(conn, timeout_ms)
+            # asyncpg cursors only live inside a transaction
+            async with conn.transaction():
+                statement = await conn.prepare(query, timeout=backstop(timeout_ms))
+                columns = [attr.name for attr in statement.get_attributes()]
+                cursor = await statement.cursor(timeout=backstop(timeout_ms))
+                while True:
+                    rows = await cursor.fetch(batch_size, timeout=backstop(timeout_ms))
+                    if not rows:
+                        break
+                    yield columns, [tuple(row) for row in rows]
+
+    elif creds.type in (MYSQL, MOTHERDUCK):
+        open_cursor = _mysql_open if creds.type == MYSQL else _duckdb_open
+        async with registry.acquire(creds) as conn:
+            cursor, columns = await run_interruptible(creds, conn, timeout_ms, open_cursor, conn, query, timeout_ms)
+            while True:
+                rows = await run_interruptible(creds, conn, timeout_ms, _fetch_batch, cursor, batch_size)
+                if not rows:
+                    break
+                yield columns, rows
+            # Only reached once the result is drained; an abandoned stream discards the connection instead
+            if creds.type == MYSQL:
+                await run_blocking(creds.type, _mysql_close, conn, cursor, timeout_ms)
+
+    elif creds.type == CLICKHOUSE:
+        query_id = new_query_id()
+        async with registry.acquire(creds) as client:
+            rows_iter, columns = await run_interruptible(creds, client, timeout_ms, _clickhouse_open,
+                                                         client, query, batch_size, timeout_ms, query_id,
+                                                         query_id=query_id)
+            while True:
+                rows = await run_interruptible(creds, client, timeout_ms, _next_batch, rows_iter, batch_size,
+                                               query_id=query_id)
+                if not rows:
+                    break
+                yield columns, rows
+
+    elif creds.type == CLOUDFLARE:
+        # D1's HTTP API has no cursors, so the result arrives in one piece
+        for statement in await d1_query(creds, query, timeout_ms):
+            results = statement.get('results') or []
+            for start in range(0, len(results), batch_size):
+                batch = results[start:start + batch_size]
+                columns = list(batch[0].keys())
+                yield columns, [tuple(row.get(col) for col in columns) for row in batch]
+
+    else:
+        raise Exception("Unknown database type. Please check your connection settings.")
+
+
+async def stream_ndjson(request, creds, query, batch_size=STREAM_BATCH_SIZE, timeout_ms=None):
+    # One JSON object per row; a failure mid-stream is reported as a final {"error": ...} line
+    try:
+        # aclosing() hands the connection back as soon as we stop reading
+        async with aclosing(iter_batches(creds, query, batch_size, timeout_ms)) as batches:
+            async for columns, rows in batches:
+                yield "".join(_dumps(dict(zip(columns, row))) + "\n" for row in rows)
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, stopping query stream")
+                    return
+    except Exception as e:
+        logger.warning("Database error while streaming: %s", e)
+        yield _dumps({"error": f"Database error: {str(e)}"}) + "\n"
+
+
+async def stream_json(request, creds, query, batch_size=STREAM_BATCH_SIZE, timeout_ms=None):
+    # Same shape as the buffered response, written out incrementally
+    yield '{"sql":' + _dumps(query) + ',"data":['
+    first = True
+    message = "Query executed successfully"
+    try:
+        async with aclosing(iter_batches(creds, query, batch_size, timeout_ms)) as batches:
+            async for columns, rows in batches:
+                chunk = ",".join(_dumps(dict(zip(columns, row))) for row in rows)
+                yield chunk if first else "," + chunk
+                first = False
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, stopping query stream")
+                    return
+    except Exception as e:
+        logger.warning("Database error while streaming: %s", e)
+        message = f"Database error: {str(e)}"
+    yield '],"response":' + _dumps(message) + '}'
@@ -0,0 +1,175 @@
+import math
+import os
+import re
+from collections import Counter
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 5))            # Tables put in the prompt without @references
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", 0.2))  # Below this a table is not considered relevant
+
+# BM25 parameters and field weights: a hit on the table name counts more than one on a column
+_K1 = 1.2
+_B = 0.75
+_TABLE_WEIGHT = 3
+_COMMENT_WEIGHT = 1
+_COLUMN_WEIGHT = 1
+_FUZZY_MIN_SIMILARITY = 0.4
+
+_STOPWORDS = {
+    "a", "all", "an", "and", "are", "as", "at", "by", "each", "for", "from", "get", "give", "how", "i", "in",
+    "is", "it", "list", "me", "many", "much", "of", "on", "or", "per", "show", "the", "their", "them", "to",
+    "what", "which", "who", "with", "find", "number", "select", "query", "table", "tables", "data",
+}
+
+
+def _stem(word):
+    # Just enough to make "customers" find "customer" and "categories" find "category"
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    # Split identifiers on case changes, digits and punctuation: "orderItems_2024" -> order, item, 2024
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text or "")
+    return [_stem(word) for word in re.findall(r"[a-z]+|\d+", text.lower()) if word not in _STOPWORDS]
+
+
+def _trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _column_text(column):
+    # [name, type, nullable, comment] from the schema cache (see introspection.assemble); comment may be missing
+    return column[0], column[3] if len(column) > 3 and isinstance(column[3], str) else ""
+
+
+class TableIndex:
+    """BM25 over table names, column names and comments, with a trigram fallback for misspelt words.
+
+    Built from schema cache metadata ({table: [[column, type, ...], ...]}). `update`
+    re-indexes only the tables whose columns changed.
+    """
+
+    def __init__(self, metadata=None):
+        self._postings = {}     # term -> {table: weighted term frequency}
+        self._lengths = {}      # table -> document length
+        self._signatures = {}   # table -> columns as indexed, to detect changes
+        self._total_length = 0
+        self._trigram_terms = {}  # trigram -> set of terms, for fuzzy matching
+        if metadata:
+            self.update(metadata)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def copy(self):
+        """An independent index with the same contents; updating it leaves this one untouched."""
+        index = TableIndex()
+        index._postings = {term: dict(postings) for term, postings in self._postings.items()}
+        index._lengths = dict(self._lengths)
+        index._signatures = dict(self._signatures)
+        index._total_length = self._total_length
+        index._trigram_terms = {trigram: set(terms) for trigram, terms in self._trigram_terms.items()}
+        return index
+
+    def _document(self, table, columns):
+        terms = Counter()
+        for term in tokenize(table):
+            terms[term] += _TABLE_WEIGHT
+        for column in columns:
+            name, comment = _column_text(column)
+            for term in tokenize(name):
+                terms[term] += _COLUMN_WEIGHT
+            for term in tokenize(comment):
+                terms[term] += _COMMENT_WEIGHT
+        return terms
+
+    def _add(self, table, columns):
+        terms = self._document(table, columns)
+        for term, frequency in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                for trigram in _trigrams(term):
+                    self._trigram_terms.setdefault(trigram, set()).add(term)
+            postings[table] = frequency
+        length = sum(terms.values())
+        self._lengths[table] = length
+        self._total_length += length
+        self._signatures[table] = tuple(tuple(column) for column in columns)
+
+    def _remove(self, table):
+        for term in self._document(table, self._signatures.pop(table)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(table, None)
+            if not postings:
+                del self._postings[term]
+                for trigram in _trigrams(term):
+                    terms = self._trigram_terms.get(trigram)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del self._trigram_terms[trigram]
+        self._total_length -= self._lengths.pop(table)
+
+    def update(self, metadata):
+        """Bring the index in line with `metadata`; returns the number of tables re-indexed."""
+        changed = 0
+        for table in [table for table in self._signatures if table not in metadata]:
+            self._remove(table)
+            changed += 1
+        for table, columns in metadata.items():
+            signature = tuple(tuple(column) for column in columns)
+            if self._signatures.get(table) == signature:
+                continue
+            if table in self._signatures:
+                self._remove(table)
+            self._add(table, columns)
+            changed += 1
+        return changed
+
+    def _expand(self, term):
+        # Exact term, or else the indexed terms that look most like it
+        if term in self._postings:
+            return [(term, 1.0)]
+        grams = _trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            for candidate in self._trigram_terms.get(gram, ()):
+                shared[candidate] += 1
+        matches = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + len(_trigrams(candidate)) - count)
+            if similarity >= _FUZZY_MIN_SIMILARITY:
+                matches.append((candidate, similarity))
+        return sorted(matches, key=lambda match: -match[1])[:3]
+
+    def search(self, question, k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """The `k` most relevant tables for `question` as [(table, score)], best first."""
+        if not self._lengths:
+            return []
+        if len(self._lengths) <= k:
+            # Small schema: every table fits in the prompt, ranking only decides the order
+            scores = dict(self._rank(question))
+            return sorted(((table, round(scores.get(table, 0.0), 3)) for table in self._lengths),
+                          key=lambda result: -result[1])
+        return [(table, round(score, 3)) for table, score in self._rank(question).most_common(k)
+                if score >= min_score]
+
+    def _rank(self, question):
+        documents = len(self._lengths)
+        average_length = self._total_length / documents
+        scores = Counter()
+        for term in set(tokenize(question)):
+            for indexed_term, similarity in self._expand(term):
+                postings = self._postings[indexed_term]
+                idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                for table, frequency in postings.items():
+                    norm = _K1 * (1 - _B + _B * self._lengths[table] / average_length)
+                    scores[table] += similarity * idf * frequency * (_K1 + 1) / (frequency + norm)
+        return scores
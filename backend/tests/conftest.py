@@ -0,0 +1,163 @@
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+# Keep the chat store out of the working tree; must be set before main is imported
+os.environ.setdefault("CHAT_DB_PATH", os.path.join(tempfile.mkdtemp(), "chats.db"))
+
+import duckdb
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+import main
+import pools
+
+
+@pytest.fixture(scope="session")
+def loop():
+    # One loop for the whole run: the pool registry's locks bind to the first loop that waits on them
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(pools.registry.close_all())
+    loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    return loop.run_until_complete
+
+
+@pytest.fixture
+def connection(tmp_path, monkeypatch):
+    """Request credentials for a local DuckDB file standing in for MotherDuck.
+
+    The file path is the connection's database, so every test gets its own pool and caches.
+    """
+    path = str(tmp_path / "test.duckdb")
+    monkeypatch.setitem(pools._BLOCKING_DRIVERS, pools.MOTHERDUCK,
+                        (lambda creds: duckdb.connect(creds.database),) + pools._BLOCKING_DRIVERS[pools.MOTHERDUCK][1:])
+    return {"host": "motherduck", "port": 0, "database": path, "username": "test", "password": "test"}
+
+
+class Executions(Counter):
+    """Statements executed on the test's DuckDB connections, by query text."""
+    delay = 0.0  # Seconds each statement takes, to make concurrent requests overlap
+
+
+class CountingConnection:
+    """A DuckDB connection that counts the statements executed on it."""
+
+    def __init__(self, conn, executed):
+        self._conn = conn
+        self._executed = executed
+
+    def execute(self, query, *args):
+        self._executed[query] += 1
+        time.sleep(self._executed.delay)
+        return self._conn.execute(query, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@pytest.fixture
+def executed(connection, monkeypatch):
+    executed = Executions()
+    connect, *rest = pools._BLOCKING_DRIVERS[pools.MOTHERDUCK]
+    monkeypatch.setitem(pools._BLOCKING_DRIVERS, pools.MOTHERDUCK,
+                        (lambda creds: CountingConnection(connect(creds), executed), *rest))
+    return executed
+
+
+@pytest.fixture
+def client(run):
+    # Requests go straight to the ASGI app on the test's loop, so they can run concurrently
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+    yield client
+    run(client.aclose())
+
+
+class OpenAIStub:
+    """Answers POST /v1/chat/completions the way the OpenAI API does: one chat.completion
+    object, or with stream=true a chat.completion.chunk per token as Server-Sent Events
+    followed by `data: [DONE]`."""
+
+    def __init__(self):
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.completions)
+        self.reset()
+
+    def reset(self):
+        self.reply = "SELECT 1;"
+        self.delay = 0.0          # Seconds before answering, and between streamed tokens
+        self.calls = 0
+        self.streams_finished = 0
+        self.streams_abandoned = 0
+
+    def _chunk(self, model, delta, finish_reason=None):
+        return {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    async def completions(self, request: Request):
+        body = await request.json()
+        self.calls += 1
+        model = body["model"]
+        if not body.get("stream"):
+            await asyncio.sleep(self.delay)
+            return {"id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": self.reply}}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+
+        async def events():
+            finished = False
+            try:
+                yield f"data: {main.json.dumps(self._chunk(model, {'role': 'assistant', 'content': ''}))}\n\n"
+                for token in re.findall(r"\S+\s*", self.reply):
+                    await asyncio.sleep(self.delay)
+                    yield f"data: {main.json.dumps(self._chunk(model, {'content': token}))}\n\n"
+                yield f"data: {main.json.dumps(self._chunk(model, {}, 'stop'))}\n\n"
+                yield "data: [DONE]\n\n"
+                finished = True
+            finally:
+                if finished:
+                    self.streams_finished += 1
+                else:
+                    self.streams_abandoned += 1
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@pytest.fixture(scope="session")
+def _openai_server():
+    stub = OpenAIStub()
+    server = uvicorn.Server(uvicorn.Config(stub.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    yield stub, f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(5)
+
+
+@pytest.fixture
+def openai_stub(_openai_server, run, monkeypatch):
+    """An OpenAIStub on a local port, with the app's OpenAI client pointed at it."""
+    from openai import AsyncOpenAI
+
+    stub, base_url = _openai_server
+    stub.reset()
+    openai = AsyncOpenAI(api_key="test", base_url=base_url, max_retries=0)
+    monkeypatch.setattr(main, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(main, "get_openai_client", lambda api_key: openai)
+    yield stub
+    run(openai.close())
@@ -0,0 +1,108 @@
+import json
+import time
+
+import main
+from chat_store import ChatStore
+
+
+def test_pages_cover_chats_created_at_the_same_time(tmp_path):
+    store = ChatStore(str(tmp_path / "chats.db"), str(tmp_path / "chats"))
+    for i in range(25):
+        # Five chats per timestamp
+        store.append_messages(f"chat-{i:02d}", [{"role": "user", "content": f"question {i}"}],
+                              created_at=f"2025-01-01T00:00:0{i // 5}")
+
+    seen, before = [], None
+    while True:
+        page = store.list_chats(limit=4, before=before, include_messages=False)
+        if not page:
+            break
+        seen += [chat["id"] for chat in page]
+        before = (page[-1]["createdAt"], page[-1]["id"])
+    assert seen == [f"chat-{i:02d}" for i in reversed(range(25))]
+
+
+def test_append_only_inserts_new_messages(tmp_path):
+    store = ChatStore(str(tmp_path / "chats.db"), str(tmp_path / "chats"))
+    first = [{"role": "user", "content": "How many orders?"}, {"role": "assistant", "content": "SELECT count(*)"}]
+    assert store.append_messages("chat", first) == 2
+    assert store.append_messages("chat", [{"role": "user", "content": "And today?"}]) == 3
+    store.save_chat({**store.get_chat("chat"), "messages": first + [{"role": "user", "content": "And today?"}]})
+    assert [m["content"] for m in store.get_chat("chat")["messages"]] == ["How many orders?", "SELECT count(*)",
+                                                                          "And today?"]
+
+
+def test_chat_list_pages_through_the_api(client, run):
+    for i in range(5):
+        main.chat_store.append_messages(f"paged-{i}", [{"role": "user", "content": "hi"}],
+                                        created_at="2999-01-01T00:00:00")
+    seen, params = [], {"limit": 2, "view": "list"}
+    for _ in range(3):
+        response = run(client.get("/api/v1/chats", params=params, headers={"Origin": "http://localhost:3000"}))
+        seen += [chat["id"] for chat in response.json()]
+        # The cursor header is readable by the frontend on its own origin
+        assert "X-Next-Cursor" in response.headers["Access-Control-Expose-Headers"]
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert seen[:5] == [f"paged-{i}" for i in reversed(range(5))]
+
+
+def test_listing_10k_chats_reads_only_the_page(tmp_path):
+    store = ChatStore(str(tmp_path / "chats.db"), str(tmp_path / "chats"))
+    conn = store._conn()
+    with conn:
+        for i in range(10000):
+            chat_id = f"chat-{i:05d}"
+            conn.execute("INSERT INTO chats (id, title, created_at) VALUES (?, ?, ?)",
+                         (chat_id, f"Chat {i}", f"2025-01-01T00:00:{i:05d}"))
+            conn.executemany(
+                "INSERT INTO messages (chat_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(chat_id, seq, "user" if seq % 2 == 0 else "assistant", "x" * 200) for seq in range(20)]
+            )
+
+    def per_call_ms(fn, runs=20):
+        started = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        return (time.perf_counter() - started) / runs * 1000
+
+    # About 0.1 ms each on a laptop; the bounds only catch a full scan or a per-chat file read
+    timings = {
+        "list page": per_call_ms(lambda: store.list_chats(limit=50, include_messages=False)),
+        "list page with messages": per_call_ms(lambda: store.list_chats(limit=50)),
+        "next page": per_call_ms(lambda: store.list_chats(limit=50, before=("2025-01-01T00:00:05000", "chat-05000"),
+                                                          include_messages=False)),
+        "one chat": per_call_ms(lambda: store.get_chat("chat-05000")),
+    }
+    assert all(ms < 25 for ms in timings.values()), timings
+
+    plan = " ".join(str(row) for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id, title, created_at FROM chats WHERE (created_at, id) < (?, ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT 50", ("2025", "chat")))
+    assert "chats_created_at" in plan and "TEMP B-TREE" not in plan
+
+
+def test_legacy_json_chats_are_imported_once(tmp_path):
+    legacy = tmp_path / "chats"
+    legacy.mkdir()
+    (legacy / "full.json").write_text(json.dumps({
+        "id": "full", "title": "Orders", "createdAt": "2024-05-01T10:00:00",
+        "messages": [{"role": "user", "content": "How many orders?"}, {"role": "assistant", "content": "SELECT 1"}],
+    }))
+    # The oldest shape: a bare list of messages and plain strings
+    (legacy / "bare.json").write_text(json.dumps([{"role": "user", "content": "Top customers by revenue"}, "thanks"]))
+    (legacy / "broken.json").write_text("{")
+
+    store = ChatStore(str(tmp_path / "chats.db"), str(legacy))
+    full = store.get_chat("full")
+    assert full == {"id": "full", "createdAt": "2024-05-01T10:00:00", "title": "Orders",
+                    "messages": [{"role": "user", "content": "How many orders?"},
+                                 {"role": "assistant", "content": "SELECT 1"}]}
+    bare = store.get_chat("bare")
+    assert bare["title"] == "New Chat"
+    assert bare["messages"] == [{"role": "user", "content": "Top customers by revenue"},
+                                {"role": "user", "content": "thanks"}]
+    assert store.get_chat("broken") is None
+    # The files stay as a backup, and aren't imported again
+    store.delete_chat("full")
+    assert (legacy / "full.json").exists()
+    assert ChatStore(str(tmp_path / "chats.db"), str(legacy)).get_chat("full") is None
@@ -0,0 +1,64 @@
+import asyncio
+import json
+import uuid
+
+import main
+from chat_stream import stream_chat_completion
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class DisconnectingRequest:
+    """Stands in for the browser's request; it goes away after `after` checks."""
+
+    def __init__(self, after):
+        self.after = after
+
+    async def is_disconnected(self):
+        self.after -= 1
+        return self.after < 0
+
+
+def test_tokens_are_forwarded_as_they_arrive(openai_stub, client, run):
+    openai_stub.reply = "SELECT name FROM users WHERE id = 1;"
+    response = run(client.post("/api/v1/chat/stream", json={"message": f"Who is user 1? {uuid.uuid4()}", "history": []}))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_events(response.text)
+    tokens = [data["content"] for event, data in events if event == "token"]
+    assert len(tokens) == len(openai_stub.reply.split())
+    assert "".join(tokens) == openai_stub.reply
+    assert events[-1][0] == "done"
+    assert events[-1][1]["response"] == openai_stub.reply
+    assert openai_stub.calls == 1
+    assert openai_stub.streams_finished == 1
+
+
+def test_disconnect_closes_upstream_stream(openai_stub, run):
+    openai_stub.reply = " ".join(f"token{i}" for i in range(50))
+    openai_stub.delay = 0.02
+
+    async def scenario():
+        events = []
+        stream = stream_chat_completion(DisconnectingRequest(after=2), main.get_openai_client("test"),
+                                        main.CHAT_MODEL, [{"role": "user", "content": "count"}], "")
+        async for event in stream:
+            events.append(event)
+        for _ in range(100):
+            if openai_stub.streams_abandoned:
+                break
+            await asyncio.sleep(0.02)
+        return events
+
+    events = run(scenario())
+    assert len(events) == 3
+    assert all(event.startswith("event: token") for event in events)
+    assert openai_stub.streams_abandoned == 1
+    assert openai_stub.streams_finished == 0
@@ -0,0 +1,61 @@
+from completion_index import CompletionIndex
+
+METADATA = {
+    "customers": [["id", "integer"], ["email", "text"], ["country", "text"]],
+    "orders": [["id", "integer"], ["customer_id", "integer"], ["status", "text"], ["created_at", "timestamp"]],
+    "order_items": [["order_id", "integer"], ["product_id", "integer"], ["quantity", "integer"]],
+    "warehouses": [["id", "integer"], ["city", "text"]],
+}
+
+
+def labels(suggestions):
+    return [suggestion["label"] for suggestion in suggestions]
+
+
+def test_prefix_and_word_completion():
+    index = CompletionIndex(METADATA)
+    assert labels(index.complete("ord", limit=3)) == ["orders", "order_items", "order_items.order_id"]
+    # "items" matches the word inside order_items
+    assert labels(index.complete("items")) == ["order_items"]
+    assert labels(index.complete("@orders.c")) == ["orders.created_at", "orders.customer_id"]
+    column = index.complete("orders.status")[0]
+    assert column == {"label": "orders.status", "kind": "column", "table": "orders", "column": "status",
+                      "type": "text", "fuzzy": False}
+
+
+def test_usage_and_fuzzy_matches():
+    index = CompletionIndex(METADATA)
+    usage = {("orders", "customer_id"): 5}
+    assert labels(index.complete("orders.c", usage=usage)) == ["orders.customer_id", "orders.created_at"]
+    misspelt = index.complete("warehose")
+    assert labels(misspelt)[0] == "warehouses"
+    assert misspelt[0]["fuzzy"]
+    assert labels(index.complete("custmers.em")) == ["customers.email"]
+
+
+def test_update_reindexes_only_changed_tables():
+    index = CompletionIndex(METADATA)
+    changed = dict(METADATA)
+    changed["customers"] = changed["customers"] + [["loyalty_tier", "text"]]
+    changed["loyalty_programs"] = [["id", "integer"], ["tier", "text"]]
+    del changed["warehouses"]
+    assert index.update(changed) == 3
+    assert labels(index.complete("loyal")) == ["loyalty_programs", "customers.loyalty_tier"]
+    assert index.complete("ware") == []
+    assert index.update(changed) == 0
+
+
+def test_updated_copy_matches_a_fresh_build():
+    tables = {f"table_{i}": [[f"column_{j}", "text"] for j in range(i % 7 + 1)] for i in range(200)}
+    index = CompletionIndex(tables)
+    # One table changed (inserted key by key), then half of them (filtered and re-sorted once)
+    for changed_tables in (["table_3"], list(tables)[::2]):
+        changed = {table: columns + [["extra", "int"]] if table in changed_tables else columns
+                   for table, columns in tables.items()}
+        updated = index.copy()
+        updated.update(changed)
+        fresh = CompletionIndex(changed)
+        assert updated._entries == fresh._entries
+        assert updated._names == fresh._names
+        assert updated._trigram_names == fresh._trigram_names
+        assert "extra" not in {column for _, _, column in index._entries}
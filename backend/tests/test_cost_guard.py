@@ -0,0 +1,125 @@
+import duckdb
+import pytest
+
+import cost_guard
+from cost_guard import CostGuard, add_limit, effective_mode
+from pools import DBCredentials
+
+CROSS = "SELECT * FROM a, b"
+JOIN = "SELECT * FROM a JOIN b ON a.id = b.id"
+
+
+@pytest.fixture(autouse=True)
+def tables(connection):
+    # 5,000 x 5,000 rows: the cross product is over COST_GUARD_MAX_ROWS, the join isn't
+    with duckdb.connect(connection["database"]) as conn:
+        conn.execute("CREATE TABLE a AS SELECT range AS id FROM range(5000)")
+        conn.execute("CREATE TABLE b AS SELECT range AS id, range % 10 AS g FROM range(5000)")
+
+
+@pytest.fixture
+def creds(connection):
+    return DBCredentials.from_request(connection)
+
+
+@pytest.mark.parametrize("server, requested, expected", [
+    ("off", None, "off"),
+    ("off", "confirm", "confirm"),
+    ("limit", "off", "limit"),
+    ("limit", "reject", "reject"),
+    ("reject", "limit", "reject"),
+    ("reject", "confirm", "reject"),
+])
+def test_requests_can_only_make_the_guard_stricter(monkeypatch, server, requested, expected):
+    monkeypatch.setattr(cost_guard, "COST_GUARD", server)
+    assert effective_mode(requested) == expected
+
+
+@pytest.mark.parametrize("server, action", [("reject", "reject"), ("limit", "limit"), ("confirm", "run")])
+def test_confirmed_only_waives_a_confirm_step(creds, run, monkeypatch, server, action):
+    monkeypatch.setattr(cost_guard, "COST_GUARD", server)
+    verdict = run(CostGuard().check(creds, CROSS, "confirm", confirmed=True))
+    assert verdict.action == action
+
+
+def test_cross_product_is_rejected(creds, run):
+    verdict = run(CostGuard().check(creds, CROSS, "reject"))
+    assert verdict.action == "reject"
+    # The product of both inputs, though DuckDB prints no estimate of its own for CROSS_PRODUCT
+    assert verdict.estimate.scanned == 5000 * 5000
+    assert verdict.reason.startswith("Estimated 25,000,000 rows")
+
+
+def test_equi_join_runs(creds, run):
+    verdict = run(CostGuard().check(creds, JOIN, "reject"))
+    assert verdict.action == "run"
+    assert verdict.sql == JOIN
+    assert verdict.estimate.scanned < 100_000
+
+
+def test_limit_mode_adds_a_limit(connection, client, run):
+    response = run(client.post("/api/v1/query", json={**connection, "query": CROSS, "cost_guard": "limit"},
+                               headers={"Origin": "http://localhost:3000"}))
+    assert response.headers["X-Cost-Guard"] == "limit"
+    # Readable by the frontend on its own origin
+    assert "X-Cost-Guard" in response.headers["Access-Control-Expose-Headers"]
+    body = response.json()
+    assert body["sql"].endswith(f"LIMIT {cost_guard.COST_GUARD_LIMIT}")
+    assert len(body["data"]) == cost_guard.COST_GUARD_LIMIT
+
+
+def test_add_limit():
+    assert add_limit("SELECT * FROM a;", 10) == "SELECT * FROM a\nLIMIT 10"
+    # "limit" in a literal isn't a LIMIT clause
+    assert add_limit("SELECT 'no limit' AS s", 10) == "SELECT 'no limit' AS s\nLIMIT 10"
+    # A query with its own LIMIT (here in a subquery) is wrapped rather than given a second one
+    assert add_limit("SELECT * FROM (SELECT * FROM a LIMIT 5) t", 10) == \
+        "SELECT * FROM (\nSELECT * FROM (SELECT * FROM a LIMIT 5) t\n) AS guarded LIMIT 10"
+
+
+def test_estimates_are_cached_per_connection(creds, executed, run):
+    guard = CostGuard()
+    first = run(guard.check(creds, CROSS, "reject"))
+    # Formatting differences share the cached estimate
+    second = run(guard.check(creds, f"  {CROSS} ;", "reject"))
+    assert (first.action, second.action) == ("reject", "reject")
+    assert second.estimate == first.estimate
+    assert executed["EXPLAIN " + CROSS] == 1
+    assert (guard.hits, guard.misses) == (1, 1)
+
+    guard.invalidate(creds)
+    run(guard.check(creds, CROSS, "reject"))
+    assert executed["EXPLAIN " + CROSS] == 2
+
+
+def test_unestimated_product_join():
+    plan = "\n".join([
+        "┌───────────────────────────┐",
+        "│      NESTED_LOOP_JOIN     ├──────────────┐",
+        "└─────────────┬─────────────┘              │",
+        "┌─────────────┴─────────────┐┌─────────────┴─────────────┐",
+        "│         TABLE_SCAN        ││      READ_CSV_AUTO        │",
+        "│        ~1,000 rows        ││                           │",
+        "└───────────────────────────┘└───────────────────────────┘",
+    ])
+    estimate = cost_guard._duckdb_estimate(plan)
+    assert estimate.unestimated == "NESTED_LOOP_JOIN"
+    assert cost_guard.over_threshold(estimate) == "The plan has a NESTED_LOOP_JOIN whose size can't be estimated"
+
+
+def test_postgres_plan():
+    plan = [{"Plan": {"Node Type": "Limit", "Plan Rows": 10, "Total Cost": 1.5, "Plans": [
+        {"Node Type": "Nested Loop", "Plan Rows": 50_000_000, "Total Cost": 900000.0, "Plans": [
+            {"Node Type": "Seq Scan", "Plan Rows": 5000, "Total Cost": 80.0},
+            {"Node Type": "Seq Scan", "Plan Rows": 10000, "Total Cost": 150.0},
+        ]},
+    ]}}]
+    assert cost_guard._postgres_estimate(plan) == cost_guard.Estimate(10, 50_000_000, 1.5)
+
+
+def test_mysql_plan():
+    plan = {"query_block": {"cost_info": {"query_cost": "5012.25"}, "nested_loop": [
+        {"table": {"table_name": "a", "rows_examined_per_scan": 5000, "rows_produced_per_join": 5000}},
+        {"table": {"table_name": "b", "rows_examined_per_scan": 10000, "rows_produced_per_join": 50000000}},
+    ]}}
+    assert cost_guard._mysql_estimate(plan) == cost_guard.Estimate(50_000_000, 50_000_000, 5012.25)
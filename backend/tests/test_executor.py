@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+import duckdb
+
+import results
+
+
+def test_blocking_queries_run_concurrently(connection, client, run, monkeypatch):
+    duckdb.connect(connection["database"]).close()
+    execute = results._duckdb_execute
+
+    def slow_execute(conn, query, columnar):
+        time.sleep(0.3)
+        return execute(conn, query, columnar)
+    monkeypatch.setattr(results, "_duckdb_execute", slow_execute)
+
+    async def scenario():
+        queries = [client.post("/api/v1/query", json={**connection, "query": f"SELECT {i} AS n"}) for i in range(4)]
+        started = time.monotonic()
+        pending = asyncio.gather(*queries)
+        await asyncio.sleep(0.1)
+        # The event loop stays free while the drivers block their threads
+        ping_started = time.monotonic()
+        ping = await client.get("/")
+        ping_time = time.monotonic() - ping_started
+        responses = await pending
+        return responses, time.monotonic() - started, ping, ping_time
+
+    responses, elapsed, ping, ping_time = run(scenario())
+    assert [r.json()["data"] for r in responses] == [[{"n": i}] for i in range(4)]
+    assert elapsed < 0.3 * 4 * 0.75
+    assert ping.status_code == 200
+    assert ping_time < 0.15
@@ -0,0 +1,21 @@
+from pools import DBCredentials, PoolRegistry
+
+
+def test_another_password_does_not_retire_the_shared_pool(connection, run):
+    registry = PoolRegistry()
+    creds = DBCredentials.from_request(connection)
+    other = DBCredentials.from_request({**connection, "password": "outdated"})
+
+    async def scenario():
+        async with registry.acquire(creds) as conn:
+            async with registry.acquire(other) as other_conn:
+                # Never a connection opened with someone else's password
+                assert other_conn is not conn
+            assert conn.execute("SELECT 42").fetchone() == (42,)
+        async with registry.acquire(creds) as again:
+            assert again is conn
+        stats = registry.stats()
+        await registry.close_all()
+        return stats
+
+    assert run(scenario())["pools"] == 2
@@ -0,0 +1,49 @@
+from prompt_budget import PromptAssembler, count_message_tokens, strip_schema_dumps
+
+SYSTEM_PROMPT = (
+    "You are a helpful PostgreSQL database agent. The database metadata is as follows- "
+    "Table 'orders' has the following columns:\n- id (integer)\n- customer_id (integer)\n- total (numeric)\n"
+)
+
+
+def conversation(turns):
+    # (history, question) before each turn of a conversation about top customers
+    history = []
+    for turn in range(1, turns + 1):
+        question = f"Question {turn}: show the top {turn} customers by total order value in the last {turn} days"
+        yield list(history), question
+        history.append({"role": "user", "content": question})
+        history.append({
+            "role": "assistant",
+            "content": f"Here is the query:\n```sql\nSELECT c.id, sum(o.total) AS value FROM customers c "
+                       f"JOIN orders o ON o.customer_id = c.id WHERE o.created_at > now() - interval '{turn} days' "
+                       f"GROUP BY c.id ORDER BY value DESC LIMIT {turn};\n```\n"
+                       f"This joins customers to their orders and ranks them by total value.",
+        })
+
+
+def test_prompt_size_stays_flat_over_long_conversations():
+    assembler = PromptAssembler("gpt-4o-mini", budget=2000, recent=6)
+    sent = {}
+    for history, question in conversation(200):
+        messages, tokens = assembler.assemble(SYSTEM_PROMPT, history, question)
+        assert tokens == count_message_tokens(messages)
+        assert tokens <= assembler.budget
+        assert len(messages) <= 6 + 3  # System prompt, summary, recent turns and the question
+        sent[len(history) // 2 + 1] = tokens
+
+    full = count_message_tokens(
+        [{"role": "system", "content": SYSTEM_PROMPT}] + history + [{"role": "user", "content": question}]
+    )
+    assert full > 10 * sent[200]
+    # Once the summary budget is reached the prompt stops growing
+    plateau = [sent[turn] for turn in range(50, 201)]
+    assert max(plateau) - min(plateau) <= 0.05 * sent[50]
+
+
+def test_schema_dumps_are_stripped_outside_code():
+    text = "Using:\nTable 'orders' has the following columns:\n- id (integer)\n- total (numeric)\n" \
+           "```\norders(id int, total numeric)\n```"
+    stripped = strip_schema_dumps(text)
+    assert "has the following columns" not in stripped
+    assert "orders(id int, total numeric)" in stripped
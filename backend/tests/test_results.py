@@ -0,0 +1,33 @@
+import duckdb
+import pytest
+
+QUERY = "SELECT n, n * 2 AS doubled FROM numbers ORDER BY n"
+
+
+@pytest.fixture(autouse=True)
+def numbers(connection):
+    with duckdb.connect(connection["database"]) as conn:
+        conn.execute("CREATE TABLE numbers AS SELECT range AS n FROM range(3)")
+
+
+@pytest.mark.parametrize("options", [
+    {"format": "rows"},
+    {"format": "columnar"},
+    {"format": "arrow"},
+    {"stream": True, "stream_format": "ndjson"},
+    {"stream": True, "stream_format": "json"},
+])
+def test_query_executes_once(connection, executed, client, run, options):
+    response = run(client.post("/api/v1/query", json={**connection, "query": QUERY, "cost_guard": "off", **options}))
+    assert response.status_code == 200
+    assert b"doubled" in response.content
+    assert executed[QUERY] == 1
+
+
+def test_write_applies_once(connection, executed, client, run):
+    insert = "INSERT INTO numbers VALUES (3)"
+    response = run(client.post("/api/v1/query", json={**connection, "query": insert}))
+    assert response.status_code == 200
+    assert executed[insert] == 1
+    with duckdb.connect(connection["database"]) as conn:
+        assert conn.execute("SELECT count(*) FROM numbers").fetchone() == (4,)
@@ -0,0 +1,77 @@
+import asyncio
+
+import duckdb
+import pytest
+
+from pools import DBCredentials
+from schema_cache import schema_cache
+
+
+@pytest.fixture
+def creds(connection):
+    with duckdb.connect(connection["database"]) as conn:
+        conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, total DECIMAL(10, 2))")
+    return DBCredentials.from_request(connection)
+
+
+def columns(entry, table):
+    return [column[0] for column in entry.table(table)[1]]
+
+
+async def peek(creds):
+    # On the loop, where a revalidation can be scheduled
+    return schema_cache.peek(creds)
+
+
+async def revalidated(creds):
+    # Let a revalidation scheduled by peek() or get() finish
+    await asyncio.gather(*schema_cache._revalidating.values())
+
+
+def test_peek_revalidates_a_stale_entry(creds, run):
+    entry = run(schema_cache.get(creds))
+    with duckdb.connect(creds.database) as conn:
+        conn.execute("ALTER TABLE orders ADD COLUMN status VARCHAR")
+    # Still fresh: served as cached
+    assert columns(run(peek(creds)), "orders") == ["id", "total"]
+
+    entry.checked_at -= schema_cache.ttl
+    assert run(peek(creds)) is entry
+    run(revalidated(creds))
+    assert columns(run(peek(creds)), "orders") == ["id", "total", "status"]
+
+
+def test_writes_through_the_query_endpoint_revalidate_the_schema(connection, creds, client, run):
+    entry = run(schema_cache.get(creds))
+    response = run(client.post("/api/v1/query", json={**connection, "query": "ALTER TABLE orders ADD COLUMN note VARCHAR"}))
+    assert response.status_code == 200
+    assert run(peek(creds)) is entry
+    run(revalidated(creds))
+    assert columns(run(peek(creds)), "orders") == ["id", "total", "note"]
+
+    # A write that leaves the catalog alone keeps the entry
+    entry = run(peek(creds))
+    run(client.post("/api/v1/query", json={**connection, "query": "INSERT INTO orders VALUES (1, 9.99, NULL)"}))
+    run(peek(creds))
+    run(revalidated(creds))
+    assert run(peek(creds)) is entry
+
+
+def test_cold_table_columns_skip_the_full_load(connection, creds, client, run, monkeypatch):
+    with duckdb.connect(creds.database) as conn:
+        conn.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, email VARCHAR)")
+    request = {**connection, "tables": ["ORDERS", "missing"]}
+    warmed = []
+    monkeypatch.setattr(schema_cache, "warm", lambda creds, schema=None: warmed.append(schema))
+
+    cold = run(client.post("/api/v1/metadata", json=request))
+    assert cold.status_code == 200
+    assert list(cold.json()) == ["orders"]
+    # Only the requested table was read; the full schema is left to the background load
+    assert warmed == [None]
+    assert run(peek(creds)) is None
+
+    run(schema_cache.get(creds))
+    warm = run(client.post("/api/v1/metadata", json=request))
+    assert warm.json() == cold.json()
+    assert "ETag" in warm.headers
@@ -0,0 +1,59 @@
+import pytest
+
+from prompt_budget import strip_schema_dumps
+from schema_encoder import encode_schema, schema_token_counts
+
+TABLES = {
+    "orders": [["id", "integer"], ["customer_id", "integer"], ["total", "numeric(10,2)"],
+               ["created_at", "timestamp without time zone"]],
+    "customers": [["id", "integer"], ["email", "character varying"], ["tags", "Nullable(LowCardinality(String))"]],
+}
+KEYS = {
+    "orders": {"primary_key": ["id"], "foreign_keys": [("customer_id", "customers", "id")]},
+    "customers": {"primary_key": ["id"], "foreign_keys": []},
+}
+
+
+def test_formats():
+    assert encode_schema(TABLES, "ddl", KEYS) == (
+        "orders(id int pk, customer_id int ->customers.id, total numeric(10,2), created_at timestamp)\n"
+        "customers(id int pk, email varchar, tags String)\n"
+    )
+    assert encode_schema(TABLES, "compact", KEYS, max_columns=2) == (
+        "Types: i=int, s=text\n"
+        "orders(id i pk, customer_id i ->customers.id, ...+2)\n"
+        "customers(id i pk, email s, ...+1)\n"
+    )
+    prose = encode_schema(TABLES, "prose", KEYS)
+    assert "Table 'orders' has the following columns:\n- id (integer)\n" in prose
+    assert "Foreign key: customer_id references customers(id)\n" in prose
+    with pytest.raises(ValueError):
+        encode_schema(TABLES, "yaml")
+
+
+def test_ddl_formats_are_smaller_than_prose():
+    counts = schema_token_counts(TABLES, KEYS)
+    assert counts["ddl"] < counts["prose"]
+    assert counts["compact"] < counts["prose"]
+
+
+@pytest.mark.parametrize("format", ["prose", "ddl", "compact"])
+def test_dumps_can_be_stripped_from_history(format):
+    # What an assistant turn that echoed the schema looks like once compacted
+    answer = f"The database metadata is as follows- {encode_schema(TABLES, format, KEYS)}SELECT 1"
+    stripped = strip_schema_dumps(answer)
+    assert "customer_id" not in stripped
+    assert stripped.endswith("SELECT 1")
+
+
+def test_schema_tokens_are_only_counted_for_debug_logs(monkeypatch, caplog):
+    import main
+
+    counted = []
+    monkeypatch.setattr(main, "count_tokens", lambda text, model: counted.append(text) or 0)
+    caplog.set_level("INFO", logger="main")
+    assert main.describe_tables(TABLES, {"orders": None}, KEYS)
+    assert counted == []
+    caplog.set_level("DEBUG", logger="main")
+    main.describe_tables(TABLES, {"orders": None}, KEYS)
+    assert len(counted) == 1
@@ -0,0 +1,120 @@
+import asyncio
+import uuid
+
+import duckdb
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_operation(run):
+    flight = SingleFlight("test")
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        return await asyncio.gather(*[flight.do("key", upstream) for _ in range(100)])
+
+    assert run(scenario()) == ["result"] * 100
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "started": 1, "coalesced": 99}
+
+    # Later calls start a new operation
+    assert run(flight.do("key", upstream)) == "result"
+    assert calls == 2
+
+
+def test_waiters_share_the_exception(run):
+    flight = SingleFlight("test")
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise ValueError("catalog unavailable")
+
+    async def scenario():
+        return await asyncio.gather(*[flight.do("key", upstream) for _ in range(3)], return_exceptions=True)
+
+    errors = run(scenario())
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert errors[0] is errors[1] is errors[2]
+    assert flight.in_flight() == 0
+
+
+def test_operation_is_cancelled_when_the_last_waiter_leaves(run):
+    flight = SingleFlight("test")
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def upstream():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(flight.do("key", upstream)) for _ in range(2)]
+        await started.wait()
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        # Someone is still waiting, so the operation keeps running
+        assert not cancelled.is_set()
+        waiters[1].cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    run(scenario())
+    assert flight.in_flight() == 0
+
+
+@pytest.fixture
+def numbers(connection, executed):
+    with duckdb.connect(connection["database"]) as conn:
+        conn.execute("CREATE TABLE numbers (n INTEGER PRIMARY KEY, label VARCHAR)")
+        conn.execute("INSERT INTO numbers VALUES (1, 'one'), (2, 'two')")
+    executed.delay = 0.1
+
+
+def test_identical_queries_execute_once(connection, executed, numbers, client, run):
+    query = "SELECT label FROM numbers ORDER BY n"
+
+    async def scenario():
+        return await asyncio.gather(*[
+            client.post("/api/v1/query", json={**connection, "query": query, "cost_guard": "off"})
+            for _ in range(5)
+        ])
+
+    responses = run(scenario())
+    assert [r.json()["data"] for r in responses] == [[{"label": "one"}, {"label": "two"}]] * 5
+    assert executed[query] == 1
+
+
+def test_identical_metadata_requests_query_the_catalog_once(connection, executed, numbers, client, run):
+    async def scenario():
+        return await asyncio.gather(*[client.post("/api/v1/metadata", json=connection) for _ in range(5)])
+
+    responses = run(scenario())
+    assert all(r.status_code == 200 for r in responses)
+    assert len({r.content for r in responses}) == 1
+    assert "numbers" in responses[0].json()
+    catalog = {query: count for query, count in executed.items() if query != "SELECT 1"}
+    assert catalog
+    assert set(catalog.values()) == {1}
+
+
+def test_identical_chat_requests_call_openai_once(openai_stub, client, run):
+    openai_stub.delay = 0.1
+    request = {"message": f"How many orders were placed today? {uuid.uuid4()}", "history": []}
+
+    async def scenario():
+        return await asyncio.gather(*[client.post("/api/v1/chat", json=request) for _ in range(5)])
+
+    responses = run(scenario())
+    assert [r.json()["response"] for r in responses] == [openai_stub.reply] * 5
+    assert openai_stub.calls == 1
@@ -0,0 +1,19 @@
+import os
+
+from startup_benchmark import LAZY_MODULES, import_profile, time_to_first_request
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_loads_no_drivers_or_clients():
+    profile = import_profile(BACKEND)
+    imported = {name for name, _, _ in profile}
+    assert "main" in imported
+    assert not {name for name in imported if any(name == lazy or name.startswith(f"{lazy}.") for lazy in LAZY_MODULES)}
+
+
+def test_first_request_loads_only_the_tokenizer():
+    imported, first, loaded = time_to_first_request(BACKEND)
+    assert 0 < imported <= first
+    # The startup hook warms the tokenizer in the background; nothing else is loaded for GET /
+    assert set(loaded) <= {"tiktoken"}
@@ -0,0 +1,32 @@
+from table_index import TableIndex
+
+METADATA = {
+    "customers": [["id", "integer"], ["name", "text"], ["country", "text"]],
+    "orders": [["id", "integer"], ["customer_id", "integer"], ["total", "numeric"]],
+    "order_items": [["order_id", "integer"], ["product_id", "integer"], ["quantity", "integer"]],
+    "products": [["id", "integer"], ["name", "text"], ["price", "numeric"]],
+    "warehouses": [["id", "integer"], ["city", "text"]],
+    "shipments": [["id", "integer"], ["warehouse_id", "integer"], ["shipped_at", "timestamp"]],
+    "refunds": [["id", "integer"], ["order_id", "integer"], ["amount", "numeric", True, "Refunded amount in USD"]],
+}
+
+
+def test_search_ranks_tables_by_question():
+    index = TableIndex(METADATA)
+    assert [table for table, _ in index.search("total order value per customer", k=2)] == ["orders", "customers"]
+    assert index.search("refunded USD amounts", k=1)[0][0] == "refunds"
+    # Misspelt words still find the table through trigrams
+    assert index.search("warehose cities", k=1)[0][0] == "warehouses"
+
+
+def test_update_reindexes_only_changed_tables():
+    index = TableIndex(METADATA)
+    changed = dict(METADATA)
+    changed["customers"] = changed["customers"] + [["loyalty_tier", "text"]]
+    changed["loyalty_programs"] = [["id", "integer"], ["tier", "text"]]
+    del changed["refunds"]
+    assert index.update(changed) == 3
+    assert len(index) == len(changed)
+    assert index.search("loyalty tier", k=1)[0][0] in ("customers", "loyalty_programs")
+    assert "refunds" not in dict(index.search("refunded amount", k=10))
+    assert index.update(changed) == 0